@@ -0,0 +1,260 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import datetime
+import json
+import random
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import discord
+
+from lightning import cache
+from lightning.bench.fakes import (FakeBot, FakeMessage, FakePool,
+                                   mod_config_record)
+from lightning.cogs.listeners.automod import AutoMod
+from lightning.cogs.mod import Mod
+from lightning.utils.automod_state import MemoryAutomodState
+
+# Punishment types are AutomodPunishmentEnum values
+DEFAULT_AUTOMOD_CONFIG = """
+[automod.message-spam]
+count = 5
+seconds = 5
+
+[automod.message-spam.punishment]
+type = 2
+
+[automod.invite-spam]
+count = 2
+seconds = 10
+
+[automod.invite-spam.punishment]
+type = 3
+duration = "10m"
+
+[automod.url-spam]
+count = 3
+seconds = 10
+
+[automod.url-spam.punishment]
+type = 2
+
+[automod.mass-mentions]
+count = 5
+
+[automod.mass-mentions.punishment]
+type = 4
+"""
+
+SAMPLE_CONTENT = ["hello", "how's everyone doing?", "lol", "anyone here play smash?", "gm",
+                  "check this out https://example.com/cool", "can someone help me with my code"]
+SPAM_CONTENT = ["FREE NITRO https://discord.gg/abcdef", "join https://discord.gg/spamspam",
+                "https://example.com/spam", "spam spam spam"]
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """Loads a JSONL corpus.
+
+    Each line is a message with guild_id, channel_id, author_id, content, an optional list of mentions (user
+    IDs), an optional list of roles (role IDs) and a timestamp in seconds since the start of the corpus.
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def generate_corpus(count: int, *, guilds: int = 1, members: int = 50, spam_ratio: float = 0.1,
+                    seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Generates a synthetic corpus.
+
+    Regular members chat at a normal pace while a few spammers post bursts of invites, links and mentions.
+    """
+    rng = random.Random(seed)
+    records = []
+    clock = 0.0
+
+    for _ in range(count):
+        guild_id = rng.randint(1, guilds)
+        spam = rng.random() < spam_ratio
+        author_id = guild_id * 100000 + (rng.randint(1, max(1, members // 10)) if spam else rng.randint(1, members))
+        clock += rng.uniform(0.0, 0.05) if spam else rng.uniform(0.05, 1.5)
+
+        record = {"guild_id": guild_id, "channel_id": guild_id * 1000 + rng.randint(1, 3), "author_id": author_id,
+                  "content": rng.choice(SPAM_CONTENT if spam else SAMPLE_CONTENT), "timestamp": round(clock, 3)}
+        if spam and rng.random() < 0.2:
+            record['mentions'] = [guild_id * 100000 + rng.randint(1, members) for _ in range(6)]
+        records.append(record)
+
+    return records
+
+
+def write_corpus(path: str, records: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as fp:
+        for record in records:
+            fp.write(json.dumps(record) + "\n")
+
+
+def build_messages(bot: FakeBot, records: List[Dict[str, Any]]) -> List[FakeMessage]:
+    start = discord.utils.utcnow()
+    messages = []
+    for idx, record in enumerate(records):
+        guild = bot.get_or_create_guild(record['guild_id'])
+        author = guild.get_or_create_member(record['author_id'], roles=list(record.get('roles', [])))
+        mentions = [guild.get_or_create_member(user_id) for user_id in record.get('mentions', [])]
+        created_at = start + datetime.timedelta(seconds=record.get('timestamp', idx))
+        messages.append(FakeMessage(idx, guild=guild, channel=guild.get_or_create_channel(record['channel_id']),
+                                    author=author, content=record['content'], created_at=created_at,
+                                    mentions=mentions))
+    return messages
+
+
+class AutomodBenchResult:
+    def __init__(self):
+        self.messages = 0
+        self.elapsed = 0.0
+        self.rules: Dict[str, float] = {}
+        self.allocated_blocks = 0
+        self.allocated_size = 0
+        self.peak_memory = 0
+        self.queries: Counter = Counter()
+        self.dispatched: Counter = Counter()
+
+    @property
+    def rate(self) -> float:
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"messages": self.messages, "elapsed": self.elapsed, "messages_per_second": self.rate,
+                "rules_us_per_message": self.rules, "allocated_blocks": self.allocated_blocks,
+                "allocated_size": self.allocated_size, "peak_memory": self.peak_memory,
+                "queries": dict(self.queries), "dispatched": dict(self.dispatched)}
+
+
+def setup_bot(records: List[Dict[str, Any]], *, automod_config: str, pool=None) -> FakeBot:
+    # The config caches are module level, so anything cached by a previous run has to go.
+    for name in ("automod_config", "mod_config"):
+        c = cache.registry.get(name)
+        if c:
+            asyncio.get_event_loop().run_until_complete(c.clear())
+
+    if pool is None:
+        guild_ids = {record['guild_id'] for record in records}
+        pool = FakePool(automod_configs={guild_id: automod_config for guild_id in guild_ids},
+                        mod_configs={guild_id: mod_config_record(guild_id, mute_role_id=1) for guild_id in guild_ids})
+
+    bot = FakeBot(pool)
+    bot.add_cog(Mod(bot))
+    bot.add_cog(AutoMod(bot))
+    return bot
+
+
+async def replay(bot: FakeBot, messages: List[FakeMessage]) -> float:
+    automod = bot.get_cog("AutoMod")
+    mod = bot.get_cog("Mod")
+
+    start = time.perf_counter()
+    for message in messages:
+        await automod.on_message(message)
+        await mod.on_message(message)
+    elapsed = time.perf_counter() - start
+
+    # Punishments are carried out in the background, let them finish so the next run starts clean.
+    await mod.punishment_queue.join()
+    return elapsed
+
+
+async def measure_rules(automod: AutoMod, messages: List[FakeMessage]) -> Dict[str, float]:
+    """Times each rule on its own, in microseconds per message"""
+    costs = {}
+    guild_ids = {message.guild.id for message in messages}
+    configs = {guild_id: await automod.get_automod_config(guild_id) for guild_id in guild_ids}
+    config = next((c for c in configs.values() if c), None)
+    if config is None:
+        return costs
+
+    if config.mass_mentions:
+        threshold = config.mass_mentions.count
+        start = time.perf_counter()
+        for message in messages:
+            len(message.mentions) >= threshold
+        costs[config.mass_mentions.type] = (time.perf_counter() - start) / len(messages) * 1e6
+
+    for rule in (config.message_spam, config.message_content_spam, config.invite_spam, config.url_spam):
+        if rule is None:
+            continue
+
+        state = MemoryAutomodState()
+        start = time.perf_counter()
+        for message in messages:
+            if rule.applies_to(message):
+                await state.update_many([rule.to_update(message)], now=message.created_at.timestamp())
+        costs[rule.name] = (time.perf_counter() - start) / len(messages) * 1e6
+
+    return costs
+
+
+def run_automod_bench(records: List[Dict[str, Any]], *, automod_config: str = DEFAULT_AUTOMOD_CONFIG,
+                      pool=None, trace_allocations: bool = True) -> AutomodBenchResult:
+    """Replays a corpus through AutoMod.on_message and Mod.on_message.
+
+    The corpus is replayed twice with fresh state. The first run is timed and the second one is traced with
+    tracemalloc, so tracing doesn't skew the timings.
+
+    Parameters
+    ----------
+    records : List[Dict[str, Any]]
+        The corpus to replay
+    automod_config : str
+        The automod TOML config every guild uses when running against the fake pool
+    pool : optional
+        A real asyncpg pool to use instead of the in-memory fake. The guilds in the corpus need to be set up in it.
+    trace_allocations : bool
+        Whether to count allocations
+    """
+    loop = asyncio.get_event_loop()
+    result = AutomodBenchResult()
+    result.messages = len(records)
+
+    bot = setup_bot(records, automod_config=automod_config, pool=pool)
+    messages = build_messages(bot, records)
+    result.elapsed = loop.run_until_complete(replay(bot, messages))
+    result.dispatched = bot.dispatched
+    if isinstance(bot.pool, FakePool):
+        result.queries = bot.pool.queries
+
+    result.rules = loop.run_until_complete(measure_rules(bot.get_cog("AutoMod"), messages))
+
+    if trace_allocations:
+        bot = setup_bot(records, automod_config=automod_config, pool=pool)
+        messages = build_messages(bot, records)
+
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            loop.run_until_complete(replay(bot, messages))
+            after = tracemalloc.take_snapshot()
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        stats = after.compare_to(before, "filename")
+        result.allocated_blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+        result.allocated_size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+
+    return result
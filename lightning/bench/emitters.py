@@ -0,0 +1,175 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Compares emitter pacing against a local HTTP server that ratelimits like Discord does.
+import asyncio
+import re
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import discord
+from aiohttp import web
+
+from lightning.utils.emitters import TextChannelEmitter, coalesce_messages
+from lightning.utils.ratelimits import RatelimitTracker
+
+ENTRY_REGEX = re.compile(r"#(\d+)")
+
+
+class FakeDiscordServer:
+    """Serves POST /api/v10/channels/{id}/messages with a fixed window ratelimit per channel"""
+    def __init__(self, *, limit: int = 5, per: float = 5.0):
+        self.limit = limit
+        self.per = per
+        self.requests = 0
+        self.ratelimited = 0
+        self._windows: Dict[str, List[float]] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def handle_message(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        now = time.monotonic()
+        channel_id = request.match_info['channel_id']
+
+        window = self._windows.get(channel_id)
+        if window is None or now >= window[0]:
+            window = self._windows[channel_id] = [now + self.per, self.limit]
+
+        reset_after = window[0] - now
+        if window[1] <= 0:
+            self.ratelimited += 1
+            return web.json_response({"retry_after": reset_after, "global": False}, status=429,
+                                     headers={"Retry-After": f"{reset_after:.3f}"})
+
+        window[1] -= 1
+        headers = {"X-RateLimit-Limit": str(self.limit), "X-RateLimit-Remaining": str(window[1]),
+                   "X-RateLimit-Reset-After": f"{reset_after:.3f}"}
+        return web.json_response(await request.json(), headers=headers)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/api/v10/channels/{channel_id}/messages", self.handle_message)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeChannel:
+    """Sends messages to the fake server and retries on 429 like discord.py does"""
+    def __init__(self, id: int, *, session: aiohttp.ClientSession, base_url: str):
+        self.id = id
+        self.session = session
+        self.url = f"{base_url}/api/v10/channels/{id}/messages"
+        self.delivered: Dict[int, float] = {}
+        self.sends = 0
+
+    async def send(self, content=None, *, embeds=None, embed=None, allowed_mentions=None, **kwargs) -> None:
+        payload = {"content": content, "embeds": len(embeds or ([embed] if embed else []))}
+        while True:
+            async with self.session.post(self.url, json=payload) as resp:
+                if resp.status == 429:
+                    await asyncio.sleep(float(resp.headers.get("Retry-After", 1)))
+                    continue
+                break
+
+        self.sends += 1
+        now = time.monotonic()
+        for entry in ENTRY_REGEX.findall(content or ""):
+            self.delivered[int(entry)] = now
+
+
+class FixedSleepTextChannelEmitter(TextChannelEmitter):
+    """The emitter as it was before ratelimit pacing, sleeping 0.7s after every send"""
+    async def _emit(self):
+        while not self.closed:
+            items = [await self._get()]
+            while len(items) < self.max_batch and not self._queue.empty():
+                items.append(self._get_nowait())
+
+            for msg in coalesce_messages(items):
+                try:
+                    await self.channel.send(**msg)
+                except (asyncio.TimeoutError, aiohttp.ClientError, discord.HTTPException):
+                    pass
+                await asyncio.sleep(0.7)
+
+
+async def _run_emitter(cls, *, entries: int, rate: float, limit: int, per: float, line_length: int,
+                       bursts: int) -> Dict[str, Any]:
+    server = FakeDiscordServer(limit=limit, per=per)
+    await server.start()
+
+    tracker = RatelimitTracker(default_limit=limit, default_per=per)
+    async with aiohttp.ClientSession(trace_configs=[tracker.trace_config]) as session:
+        channel = FakeChannel(1, session=session, base_url=f"http://127.0.0.1:{server.port}")
+        emitter = cls(channel, ratelimits=tracker)
+        emitter.start()
+
+        queued: Dict[int, float] = {}
+        padding = "x" * max(0, line_length - 8)
+        start = time.monotonic()
+        per_burst = max(1, entries // max(1, bursts))
+        for idx in range(entries):
+            queued[idx] = time.monotonic()
+            await emitter.put(f"#{idx} {padding}")
+            if (idx + 1) % per_burst == 0:
+                await asyncio.sleep(per_burst / rate)
+
+        while len(channel.delivered) < entries:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - start
+        emitter.close()
+
+    await server.close()
+
+    latencies = [channel.delivered[idx] - queued[idx] for idx in range(entries)]
+    return {"elapsed": elapsed, "requests": server.requests, "sends": channel.sends,
+            "ratelimited": server.ratelimited, "latency_mean": statistics.mean(latencies),
+            "latency_p95": sorted(latencies)[int(len(latencies) * 0.95) - 1], "latency_max": max(latencies)}
+
+
+def run_emitter_bench(*, entries: int = 200, rate: float = 50.0, limit: int = 5, per: float = 5.0,
+                      line_length: int = 60, bursts: int = 10) -> Dict[str, Dict[str, Any]]:
+    """Runs the fixed-sleep and the ratelimit-paced emitters against the same load.
+
+    Parameters
+    ----------
+    entries : int
+        How many log entries to queue
+    rate : float
+        How many entries per second are queued
+    limit : int
+        How many requests the fake server allows per window
+    per : float
+        The length of the fake server's window in seconds
+    line_length : int
+        The length of each entry
+    bursts : int
+        How many bursts the entries are queued in
+    """
+    loop = asyncio.get_event_loop()
+    kwargs = dict(entries=entries, rate=rate, limit=limit, per=per, line_length=line_length, bursts=bursts)
+    return {"fixed-sleep": loop.run_until_complete(_run_emitter(FixedSleepTextChannelEmitter, **kwargs)),
+            "ratelimit-paced": loop.run_until_complete(_run_emitter(TextChannelEmitter, **kwargs))}
@@ -0,0 +1,262 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Lightweight stand-ins for the discord.py models and the bot, just enough to drive listeners offline.
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import discord
+
+
+class FakeUser:
+    def __init__(self, id: int, *, name: str = "user", bot: bool = False,
+                 created_at: Optional[datetime.datetime] = None, avatar=None):
+        self.id = id
+        self.name = name
+        self.discriminator = "0000"
+        self.bot = bot
+        self.created_at = created_at or discord.utils.utcnow() - datetime.timedelta(days=365)
+        self.avatar = avatar
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    def __str__(self) -> str:
+        return f"{self.name}#{self.discriminator}"
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id={self.id}>"
+
+
+class FakeRole:
+    def __init__(self, id: int, *, name: str = "role"):
+        self.id = id
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"<FakeRole id={self.id}>"
+
+
+class FakeMember(FakeUser):
+    """A member that records the punishments done to it instead of calling Discord"""
+    def __init__(self, id: int, guild: "FakeGuild", *, roles: List[int] = None, **kwargs):
+        super().__init__(id, **kwargs)
+        self.guild = guild
+        self._roles = roles or []
+        self.actions: Counter = Counter()
+
+    async def kick(self, *, reason=None) -> None:
+        self.actions['kick'] += 1
+
+    async def ban(self, *, reason=None, delete_message_days=1) -> None:
+        self.actions['ban'] += 1
+
+    async def add_roles(self, *roles, reason=None) -> None:
+        self.actions['add_roles'] += 1
+        self._roles.extend(role.id for role in roles)
+
+    async def edit(self, *, reason=None, **fields) -> None:
+        self.actions['edit'] += 1
+
+
+class FakeChannel:
+    def __init__(self, id: int, guild: "FakeGuild", *, name: str = "general"):
+        self.id = id
+        self.guild = guild
+        self.name = name
+
+    def permissions_for(self, member) -> discord.Permissions:
+        return discord.Permissions.all()
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+
+class FakeGuild:
+    def __init__(self, id: int, *, name: str = "guild", me_id: int = 0):
+        self.id = id
+        self.name = name
+        self._members: Dict[int, FakeMember] = {}
+        self._channels: Dict[int, FakeChannel] = {}
+        self._roles: Dict[int, FakeRole] = {}
+        self.me = self.get_or_create_member(me_id, bot=True)
+
+    def get_or_create_member(self, member_id: int, **kwargs) -> FakeMember:
+        member = self._members.get(member_id)
+        if member is None:
+            member = self._members[member_id] = FakeMember(member_id, self, **kwargs)
+        return member
+
+    def get_or_create_channel(self, channel_id: int) -> FakeChannel:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = FakeChannel(channel_id, self)
+        return channel
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self._members.get(member_id)
+
+    def get_role(self, role_id: int) -> FakeRole:
+        role = self._roles.get(role_id)
+        if role is None:
+            role = self._roles[role_id] = FakeRole(role_id)
+        return role
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    async def kick(self, member, *, reason=None) -> None:
+        await member.kick(reason=reason)
+
+    async def ban(self, member, *, reason=None, delete_message_days=1) -> None:
+        await member.ban(reason=reason)
+
+
+class FakeMessage:
+    def __init__(self, id: int, *, guild: FakeGuild, channel: FakeChannel, author: FakeMember, content: str,
+                 created_at: datetime.datetime, mentions: List[FakeMember] = None):
+        self.id = id
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.mentions = mentions or []
+        self.stickers = []
+        self.attachments = []
+        self.embeds = []
+        self.deleted = False
+
+    async def delete(self) -> None:
+        self.deleted = True
+
+
+class _FakeAcquire:
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+    async def __aenter__(self) -> "FakePool":
+        return self.pool
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+
+class FakePool:
+    """An in-memory fake of the queries automod and mod use.
+
+    Every query is counted by its first line so the harness can report how many round trips a run made.
+
+    Parameters
+    ----------
+    automod_configs : Dict[int, str]
+        Automod TOML configs keyed by guild ID
+    mod_configs : Dict[int, Dict[str, Any]]
+        guild_mod_config rows keyed by guild ID
+    """
+    def __init__(self, *, automod_configs: Dict[int, str] = None, mod_configs: Dict[int, Dict[str, Any]] = None):
+        self.automod_configs = automod_configs or {}
+        self.mod_configs = mod_configs or {}
+        self.queries: Counter = Counter()
+        self.infractions: Counter = Counter()
+        self._ids = itertools.count(1)
+
+    def _count(self, query: str) -> None:
+        self.queries[query.strip().splitlines()[0].strip()] += 1
+
+    def acquire(self) -> _FakeAcquire:
+        return _FakeAcquire(self)
+
+    async def fetchval(self, query: str, *args):
+        self._count(query)
+        if "FROM automod" in query:
+            return self.automod_configs.get(args[0])
+        if "COUNT(*) FROM infractions" in query:
+            return self.infractions[(args[1], args[0])]
+        if "INSERT INTO" in query:
+            return next(self._ids)
+
+    async def fetchrow(self, query: str, *args):
+        self._count(query)
+        if "FROM guild_mod_config" in query:
+            return self.mod_configs.get(args[0])
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        self._count(query)
+        if "INSERT INTO" in query and "jsonb_to_recordset" in query:
+            rows = args[0]
+            if "INSERT INTO infractions" in query:
+                for row in rows:
+                    self.infractions[(row['guild_id'], row['user_id'])] += 1
+            return [{"id": next(self._ids)} for _ in rows]
+        return []
+
+    async def execute(self, query: str, *args) -> str:
+        self._count(query)
+        return "EXECUTE 0"
+
+
+def mod_config_record(guild_id: int, **kwargs) -> Dict[str, Any]:
+    """Builds a guild_mod_config row with everything turned off"""
+    record = {"guild_id": guild_id, "mute_role_id": None, "warn_kick": None, "warn_ban": None,
+              "temp_mute_role_id": None, "flags": 0, "automod_join_threshold_users": None,
+              "automod_join_threshold_seconds": None, "automod_raid_punishment": None, "raid_mode": False}
+    record.update(kwargs)
+    return record
+
+
+class FakeBot:
+    """Just enough of :class:`LightningBot` to run cogs without a gateway connection"""
+    def __init__(self, pool, *, loop: asyncio.AbstractEventLoop = None, config: Dict[str, Any] = None):
+        self.pool = pool
+        self.loop = loop or asyncio.get_event_loop()
+        self.config = config or {"automod": {"state": "memory"}}
+        self.redis_pool = ConnectionError("redis is not used by the bench harness")
+        self.user = FakeUser(0, name="Lightning", bot=True)
+        self.cogs: Dict[str, Any] = {}
+        self.guilds: Dict[int, FakeGuild] = {}
+        self.dispatched: Counter = Counter()
+
+    def add_cog(self, cog) -> None:
+        self.cogs[cog.qualified_name] = cog
+
+    def get_cog(self, name: str):
+        return self.cogs.get(name)
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(guild_id)
+
+    def get_or_create_guild(self, guild_id: int) -> FakeGuild:
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(guild_id, me_id=self.user.id)
+        return guild
+
+    def dispatch(self, event: str, *args, **kwargs) -> None:
+        self.dispatched[event] += 1
+
+    async def get_guild_bot_config(self, guild_id: int):
+        return None
@@ -0,0 +1,84 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Measures how fast logging channels are looked up for an event.
+import random
+import timeit
+from typing import Any, Dict, List, Optional
+
+from lightning.enums import LoggingType
+from lightning.models import LoggingConfig
+
+FORMATS = ["emoji", "minimal with timestamp", "minimal without timestamp", "embed"]
+FEATURES = [LoggingType.COMMAND_RAN, LoggingType.MEMBER_JOIN, LoggingType.MEMBER_LEAVE,
+            LoggingType.MEMBER_ROLE_ADD, LoggingType.MEMBER_ROLE_REMOVE, LoggingType.MEMBER_NICK_CHANGE,
+            LoggingType.MEMBER_BAN, LoggingType.MEMBER_WARN]
+
+
+def generate_records(channels: int, *, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Generates logging rows for a guild where each channel logs a random set of features"""
+    rng = random.Random(seed)
+    bits = [int(flag) for flag in LoggingType]
+    records = []
+    for idx in range(channels):
+        types = 0
+        for bit in rng.sample(bits, rng.randint(1, len(bits))):
+            types |= bit
+        records.append({"channel_id": 100000 + idx, "types": types, "format": rng.choice(FORMATS)})
+    return records
+
+
+def scan_channels_with_feature(config: LoggingConfig, feature) -> list:
+    """The lookup as it was before LoggingConfig kept an index"""
+    channels = []
+    for key, value in list(config.logging.items()):
+        if feature in value['types']:
+            channels.append((key, value))
+    return channels
+
+
+def run_modlog_bench(*, channels: int = 50, lookups: int = 100000,
+                     seed: Optional[int] = 0) -> Dict[str, Dict[str, float]]:
+    """Times feature lookups with a linear scan and with LoggingConfig's index.
+
+    Parameters
+    ----------
+    channels : int
+        How many logging channels the guild has
+    lookups : int
+        How many lookups to time
+    seed : Optional[int]
+        Seed for the generated logging rows
+    """
+    config = LoggingConfig(generate_records(channels, seed=seed))
+    features = [FEATURES[idx % len(FEATURES)] for idx in range(lookups)]
+
+    for feature in FEATURES:
+        assert sorted(scan_channels_with_feature(config, feature)) == sorted(config.get_channels_with_feature(feature))
+
+    def scan():
+        for feature in features:
+            scan_channels_with_feature(config, feature)
+
+    def index():
+        for feature in features:
+            config.get_channels_with_feature(feature)
+
+    results = {}
+    for name, func in (("scan", scan), ("index", index)):
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        results[name] = {"elapsed": elapsed, "per_lookup_us": elapsed / lookups * 1_000_000}
+    return results
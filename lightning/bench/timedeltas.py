@@ -0,0 +1,127 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Measures how fast timedeltas are formatted for list views.
+import datetime
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+
+from lightning.formatters import human_join, plural
+from lightning.utils import time as ltime
+
+
+def relativedelta_natural_timedelta(dt, *, source=None, accuracy=3, brief=False, suffix=True) -> str:
+    """natural_timedelta as it was before, with a relativedelta per call"""
+    now = source or datetime.datetime.now(datetime.timezone.utc)
+    if dt.tzinfo is None:
+        dt = ltime.add_tzinfo(dt)
+
+    if now.tzinfo is None:
+        now = ltime.add_tzinfo(now)
+
+    now = now.replace(microsecond=0)
+    dt = dt.replace(microsecond=0)
+
+    if dt > now:
+        delta = relativedelta(dt, now)
+        suffix = ''
+    else:
+        delta = relativedelta(now, dt)
+        suffix = ' ago' if suffix else ''
+
+    output = []
+    for attr, brief_attr in ltime.TIMEDELTA_UNITS:
+        elem = getattr(delta, attr + 's')
+        if not elem:
+            continue
+
+        if attr == 'day':
+            weeks = delta.weeks
+            if weeks:
+                elem -= weeks * 7
+                if not brief:
+                    output.append(format(plural(weeks), 'week'))
+                else:
+                    output.append(f'{weeks}w')
+
+        if elem <= 0:
+            continue
+
+        if brief:
+            output.append(f'{elem}{brief_attr}')
+        else:
+            output.append(format(plural(elem), attr))
+
+    if accuracy is not None:
+        output = output[:accuracy]
+
+    if len(output) == 0:
+        return 'now'
+    else:
+        if not brief:
+            return human_join(output, conj='and') + suffix
+        else:
+            return ' '.join(output) + suffix
+
+
+def generate_timestamps(count: int, *, source: datetime.datetime, seed: Optional[int] = None,
+                        span: float = 4 * 365 * 86400) -> List[datetime.datetime]:
+    """Generates timestamps spread around the source, mostly in the past like infractions are"""
+    rng = random.Random(seed)
+    return [source - datetime.timedelta(seconds=rng.uniform(-span / 4, span)) for _ in range(count)]
+
+
+def run_timedelta_bench(*, count: int = 10000, seed: Optional[int] = 0, accuracy: Optional[int] = 3,
+                        brief: bool = False) -> Dict[str, Any]:
+    """Formats the same timestamps with the relativedelta implementation, natural_timedelta and natural_timedeltas.
+
+    The caches are cleared before each run, so the numbers are for timestamps that haven't been rendered yet.
+
+    Parameters
+    ----------
+    count : int
+        How many timestamps to format
+    seed : Optional[int]
+        Seed for the generated timestamps
+    accuracy : Optional[int]
+        How many units to show
+    brief : bool
+        Whether to use short units
+    """
+    source = datetime.datetime.now(datetime.timezone.utc)
+    timestamps = generate_timestamps(count, source=source, seed=seed)
+    kwargs = dict(source=source, accuracy=accuracy, brief=brief)
+
+    results: Dict[str, Dict[str, float]] = {}
+    outputs = {}
+
+    def record(name, func):
+        ltime._timedelta_cache.clear()
+        start = time.perf_counter()
+        outputs[name] = func()
+        elapsed = time.perf_counter() - start
+        results[name] = {"elapsed": elapsed, "rate": count / elapsed if elapsed else 0.0}
+
+    record("relativedelta", lambda: [relativedelta_natural_timedelta(dt, **kwargs) for dt in timestamps])
+    record("natural_timedelta", lambda: [ltime.natural_timedelta(dt, **kwargs) for dt in timestamps])
+    record("natural_timedeltas", lambda: ltime.natural_timedeltas(timestamps, **kwargs))
+
+    mismatches = [(str(dt), expected, got) for dt, expected, got in
+                  zip(timestamps, outputs["relativedelta"], outputs["natural_timedeltas"]) if expected != got]
+    return {"timestamps": count, "results": results, "mismatches": mismatches}
@@ -0,0 +1,116 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Measures how long UserFriendlyTime takes to parse reminder inputs.
+import datetime
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from discord.ext import commands
+
+from lightning.utils import time as ltime
+
+# Inputs in the shape people give the remind command
+REMINDER_INPUTS = [
+    "in 2 hours check the oven", "1h take out the laundry", "30m stand up", "in 10 minutes call mom",
+    "tomorrow at 5pm submit the report", "tomorrow 9:30am dentist", "in 3 days renew the domain",
+    "in 2 weeks pay rent", "2d water the plants", "in 1 hour, check the build", "an hour stretch",
+    "in 5 mins tea", "tomorrow do the essay", "2026-12-01 birthday party", "2026-12-24 18:00 wrap presents",
+    "in 6 months dentist checkup", "in a year renew passport", "today at 9pm raid night", "45 minutes pizza",
+    "me to sleep in 8 hours", "next friday at noon team lunch", "in 2 hours and 30 minutes leave for the airport",
+    "check the mail in 3 hours", "on monday at 10am standup", "\"in 20 minutes\" flip the steak",
+    "10 minutes from now", "1w", "in 90 seconds eggs", "friday movie night", "in 4 hours switch shifts",
+]
+
+
+def _parse_nlp_only(argument: str, now: datetime.datetime) -> ltime.ParsedTime:
+    # The path every non-ShortTime input took before the fast path existed
+    match = ltime.ShortTime.compiled.match(argument)
+    if match is not None and match.group(0):
+        return ltime._parse(argument, now)
+
+    return ltime.parse_nlp(ltime._strip_filler(argument), now)
+
+
+def _time_parser(parser: Callable[[str, datetime.datetime], Any], inputs: List[str], *, iterations: int,
+                 now: datetime.datetime, step: float) -> Dict[str, float]:
+    timings = []
+    for idx in range(iterations):
+        # Each iteration is parsed a little later, like real commands would be
+        current = now + datetime.timedelta(seconds=idx * step)
+        for argument in inputs:
+            start = time.perf_counter()
+            try:
+                parser(argument, current)
+            except commands.BadArgument:
+                pass
+            timings.append((time.perf_counter() - start) * 1e6)
+
+    timings.sort()
+    return {"mean": statistics.mean(timings), "p50": timings[len(timings) // 2],
+            "p95": timings[int(len(timings) * 0.95) - 1], "max": timings[-1]}
+
+
+def compare_fast_path(inputs: List[str], *, now: datetime.datetime) -> List[Dict[str, Any]]:
+    """Lists the inputs the fast path parses differently from parsedatetime.
+
+    Differences under a second are ignored, parsedatetime drops microseconds.
+    """
+    differences = []
+    for argument in inputs:
+        argument = ltime._strip_filler(argument.strip())
+        fast = ltime.parse_fast(argument, now)
+        if fast is None:
+            continue
+
+        try:
+            slow = ltime.parse_nlp(argument, now)
+        except commands.BadArgument as e:
+            differences.append({"input": argument, "fast": str(fast.dt), "nlp": str(e)})
+            continue
+
+        if abs((fast.dt - slow.dt).total_seconds()) >= 1 or fast.remaining != slow.remaining:
+            differences.append({"input": argument, "fast": f"{fast.dt} {fast.remaining!r}",
+                                "nlp": f"{slow.dt} {slow.remaining!r}"})
+    return differences
+
+
+def run_timeparse_bench(inputs: Optional[List[str]] = None, *, iterations: int = 100,
+                        step: float = 1.0) -> Dict[str, Any]:
+    """Times parsing a corpus of reminder inputs with parsedatetime alone, with the fast path and with the cache.
+
+    Parameters
+    ----------
+    inputs : Optional[List[str]]
+        The inputs to parse. Defaults to :data:`REMINDER_INPUTS`.
+    iterations : int
+        How many times the corpus is parsed
+    step : float
+        How many seconds apart each pass over the corpus is parsed. The cache is per minute, so this sets its hit
+        rate.
+    """
+    inputs = inputs or REMINDER_INPUTS
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ltime._parse_cache.clear()
+
+    results = {"nlp": _time_parser(_parse_nlp_only, inputs, iterations=iterations, now=now, step=step),
+               "fast path": _time_parser(ltime._parse, inputs, iterations=iterations, now=now, step=step),
+               "fast path + cache": _time_parser(ltime.parse_user_friendly_time, inputs, iterations=iterations,
+                                                 now=now, step=step)}
+    fast = sum(1 for argument in inputs if ltime.parse_fast(ltime._strip_filler(argument.strip()), now) is not None)
+    return {"inputs": len(inputs), "fast_path_inputs": fast, "parsers": results,
+            "differences": compare_fast_path(inputs, now=now)}
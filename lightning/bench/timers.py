@@ -0,0 +1,248 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+# Checks and measures the timer queries and the timer scheduler against a real database.
+import asyncio
+import importlib
+import json
+import statistics
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import asyncpg
+
+from lightning.bench.fakes import FakeBot
+from lightning.cogs.reminders import REMINDER_QUERIES
+
+# Every timer the bench makes uses this event, so it can clean up after itself
+BENCH_EVENT = "bench"
+
+# Arguments to plan each reminder query with
+REMINDER_QUERY_ARGS = {"get": (1, 1), "list": (1,), "delete": (1, 1), "count": (1,), "clear": (1,)}
+
+
+def _seq_scans(plan: Dict[str, Any], relation: str) -> List[Dict[str, Any]]:
+    scans = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == relation:
+        scans.append(plan)
+
+    for child in plan.get("Plans", []):
+        scans.extend(_seq_scans(child, relation))
+    return scans
+
+
+def _node_names(plan: Dict[str, Any]) -> List[str]:
+    name = f"{plan['Node Type']} on {plan['Index Name']}" if 'Index Name' in plan else plan['Node Type']
+    names = [name]
+    for child in plan.get("Plans", []):
+        names.extend(_node_names(child))
+    return names
+
+
+async def explain_reminder_queries(pool: asyncpg.Pool) -> Dict[str, Tuple[bool, List[str]]]:
+    """Plans every reminder query with sequential scans disabled.
+
+    A query that still gets a sequential scan on timers has no index it can use.
+
+    Returns
+    -------
+    Dict[str, Tuple[bool, List[str]]]
+        Whether each query scans timers sequentially and the nodes of its plan
+    """
+    results = {}
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute("SET LOCAL enable_seqscan = off;")
+            for name, query in REMINDER_QUERIES.items():
+                plan = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *REMINDER_QUERY_ARGS[name])
+                if isinstance(plan, str):  # The pool wasn't made with create_pool's json codecs
+                    plan = json.loads(plan)
+
+                root = plan[0]['Plan']
+                results[name] = (bool(_seq_scans(root, "timers")), _node_names(root))
+    return results
+
+
+class CountingPool:
+    """Wraps an asyncpg pool and counts every round trip by the query's first line"""
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self.queries: Counter = Counter()
+
+    def _count(self, query: str) -> None:
+        self.queries[query.strip().splitlines()[0].strip()] += 1
+
+    @property
+    def round_trips(self) -> int:
+        return sum(self.queries.values())
+
+    async def fetch(self, query: str, *args):
+        self._count(query)
+        return await self.pool.fetch(query, *args)
+
+    async def fetchval(self, query: str, *args):
+        self._count(query)
+        return await self.pool.fetchval(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        self._count(query)
+        return await self.pool.fetchrow(query, *args)
+
+    async def execute(self, query: str, *args):
+        self._count(query)
+        return await self.pool.execute(query, *args)
+
+
+class TimerBenchBot(FakeBot):
+    """Records how late each bench timer fired"""
+    def __init__(self, pool, *, config: Dict[str, Any]):
+        super().__init__(pool, config=config)
+        self.extra_events: Dict[str, list] = {f"on_lightning_{BENCH_EVENT}_complete": [self.on_bench_complete]}
+        self.lags: List[float] = []
+
+    async def wait_until_ready(self) -> None:
+        pass
+
+    def is_closed(self) -> bool:
+        return False
+
+    async def on_error(self, event: str, *args, **kwargs) -> None:
+        pass
+
+    async def on_bench_complete(self, timer) -> None:
+        self.lags.append((datetime.utcnow() - timer.expiry).total_seconds())
+
+
+def load_scheduler(path: str):
+    """Imports a scheduler cog from a ``module:Class`` path"""
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent))]
+
+
+def summarize_lags(lags: List[float]) -> Dict[str, float]:
+    """Summarizes dispatch lag (fire time minus expiry) in seconds"""
+    if not lags:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "mean": 0.0}
+
+    return {"p50": _percentile(lags, 0.50), "p95": _percentile(lags, 0.95), "p99": _percentile(lags, 0.99),
+            "max": max(lags), "mean": statistics.mean(lags)}
+
+
+async def _wait_for(predicate, *, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def _run_timer_bench(pool: asyncpg.Pool, *, scheduler: str, pending: int, inserts: int, burst: int,
+                           burst_in: float, short: bool, timeout: float) -> Dict[str, Any]:
+    await pool.execute("DELETE FROM timers WHERE event = $1;", BENCH_EVENT)
+
+    counting = CountingPool(pool)
+    config = {"timers": {"instance": "bench", "journal_short_timers": True}, "logging": {}}
+    bot = TimerBenchBot(counting, config=config)
+    cog = load_scheduler(scheduler)(bot)
+    results: Dict[str, Any] = {"scheduler": scheduler}
+
+    try:
+        # Far away timers only sit in the table, like most reminders do
+        now = datetime.utcnow()
+        later = now + timedelta(days=30)
+        start = time.perf_counter()
+        for idx in range(0, pending, 5000):
+            chunk = min(5000, pending - idx)
+            await cog.add_jobs([(BENCH_EVENT, now, later + timedelta(seconds=idx + n), {"n": idx + n})
+                                for n in range(chunk)])
+        elapsed = time.perf_counter() - start
+        results['add_jobs'] = {"timers": pending, "elapsed": elapsed, "rate": pending / elapsed if elapsed else 0.0}
+
+        start = time.perf_counter()
+        for n in range(inserts):
+            await cog.add_job(BENCH_EVENT, now, later, force_insert=True, n=n)
+        elapsed = time.perf_counter() - start
+        results['add_job'] = {"timers": inserts, "elapsed": elapsed, "rate": inserts / elapsed if elapsed else 0.0}
+
+        # Wait for the first load so the burst goes through the scheduler's usual path
+        await _wait_for(lambda: cog._horizon != datetime.min, timeout=timeout)
+
+        # Every burst timer expires in the same second
+        counting.queries.clear()
+        now = datetime.utcnow()
+        expiry = now + timedelta(seconds=burst_in)
+        start = time.perf_counter()
+        for n in range(burst):
+            await cog.add_job(BENCH_EVENT, now, expiry, force_insert=not short, n=n)
+        results['burst_insert_elapsed'] = time.perf_counter() - start
+
+        fired = await _wait_for(lambda: len(bot.lags) >= burst, timeout=burst_in + timeout)
+        # Let the deletes and journal writes that follow the dispatch finish
+        await asyncio.sleep(1.5)
+
+        results['burst'] = {"timers": burst, "fired": len(bot.lags), "complete": fired, **summarize_lags(bot.lags)}
+        results['round_trips'] = counting.round_trips
+        results['round_trips_per_timer'] = counting.round_trips / burst if burst else 0.0
+        results['queries'] = dict(counting.queries)
+        if hasattr(cog, "metrics"):
+            database = cog.metrics.database
+            results['database_per_dispatch'] = {"p50": database.percentile(0.5), "p95": database.percentile(0.95),
+                                                "dispatches": database.count}
+    finally:
+        cog.cog_unload()
+        await pool.execute("DELETE FROM timers WHERE event = $1;", BENCH_EVENT)
+
+    return results
+
+
+def run_timer_bench(pool: asyncpg.Pool, *, scheduler: str = "lightning.cogs.reminders:Reminders",
+                    pending: int = 100000, inserts: int = 1000, burst: int = 1000, burst_in: float = 5.0,
+                    short: bool = False, timeout: float = 30.0) -> Dict[str, Any]:
+    """Drives a timer scheduler with synthetic timers against a real database.
+
+    The timers table is filled with ``pending`` far away timers first, then ``burst`` timers are added that all
+    expire in the same second. Every timer the bench made is deleted afterwards.
+
+    Parameters
+    ----------
+    pool : asyncpg.Pool
+        The database to run against. It needs the timer migrations applied.
+    scheduler : str
+        The ``module:Class`` path of the scheduler cog to drive
+    pending : int
+        How many far away timers are in the table during the burst
+    inserts : int
+        How many timers are added one by one to measure add_job
+    burst : int
+        How many timers expire in the same second
+    burst_in : float
+        How many seconds after being added the burst expires
+    short : bool
+        Whether the burst goes through the short timer path instead of being inserted
+    timeout : float
+        How long to wait for the burst to fire after it expires
+    """
+    return asyncio.get_event_loop().run_until_complete(_run_timer_bench(
+        pool, scheduler=scheduler, pending=pending, inserts=inserts, burst=burst, burst_in=burst_in, short=short,
+        timeout=timeout))
@@ -18,11 +18,13 @@ import asyncio
 import collections
 import contextlib
 import logging
+import os
 import pathlib
 import secrets
+import socket
 import traceback
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 import asyncpg
@@ -36,7 +38,9 @@ from lightning.context import LightningContext
 from lightning.meta import __version__ as version
 from lightning.models import GuildBotConfig
 from lightning.storage import Storage
-from lightning.utils.emitters import WebhookEmbedEmitter
+from lightning.utils.emitters import OverflowPolicy, WebhookEmbedEmitter
+from lightning.utils.outbox import OUTBOX_OWNER_TTL, OUTBOX_PAGE_SIZE, Outbox
+from lightning.utils.ratelimits import RatelimitTracker
 
 __all__ = ("LightningBot")
 log = logging.getLogger(__name__)
@@ -75,9 +79,11 @@ class LightningBot(commands.AutoShardedBot):
         intents = discord.Intents.all()
         intents.invites = False
         intents.voice_states = False
+        # Shared by the emitters so they can pace themselves from Discord's ratelimit headers
+        self.ratelimits = RatelimitTracker()
         super().__init__(command_prefix=_callable_prefix, reconnect=True,
                          allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=False),
-                         intents=intents, **kwargs)
+                         intents=intents, http_trace=self.ratelimits.trace_config, **kwargs)
 
         self.launch_time = discord.utils.utcnow()
 
@@ -90,13 +96,22 @@ class LightningBot(commands.AutoShardedBot):
         self._pending_cogs = {}
 
         headers = {"User-Agent": self.config['bot'].pop("user_agent", f"Lightning Bot/{self.version}")}
-        self.aiosession = aiohttp.ClientSession(headers=headers)
+        self.aiosession = aiohttp.ClientSession(headers=headers, trace_configs=[self.ratelimits.trace_config])
         self.pool: Optional[asyncpg.Pool] = None
         self.redis_pool = cache.start_redis_client()
 
+        # Undelivered log entries are kept here so they survive restarts. Like timer leases, they're owned by the
+        # process' instance name.
+        instance = (self.config.get('timers') or {}).get('instance') or f"{socket.gethostname()}:{os.getpid()}"
+        self.outbox = Outbox(self, owner=instance)
+        self._outbox_task: Optional[asyncio.Task] = None
+
         # Error logger
         self._error_logger = WebhookEmbedEmitter(self.config['logging']['bot_errors'], session=self.aiosession,
-                                                 loop=self.loop)
+                                                 loop=self.loop, ratelimits=self.ratelimits, maxsize=100,
+                                                 overflow=OverflowPolicy.drop_oldest, outbox=self.outbox,
+                                                 linger=self.config['logging'].get("bot_errors_linger", 1.0),
+                                                 max_batch=self.config['logging'].get("bot_errors_batch", 10))
         self._error_logger.start()
 
         path = pathlib.Path("lightning/cogs/")
@@ -163,6 +178,87 @@ class LightningBot(commands.AutoShardedBot):
         summary = f"{len(self.guilds)} guild(s) and {len(self.users)} user(s)"
         log.info(f'READY: {str(self.user)} ({self.user.id}) and can see {summary}.')
 
+        if self._outbox_task is None:
+            self._outbox_task = self.loop.create_task(self._outbox_loop())
+
+    async def _outbox_loop(self) -> None:
+        include_own = True
+        while not self.is_closed():
+            try:
+                await self.outbox.heartbeat()
+                await self.replay_outbox(include_own=include_own)
+                include_own = False
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                log.warning(f"Unable to replay the outbox: {e}")
+
+            # Picks up the entries of processes that stopped without delivering them
+            await asyncio.sleep(OUTBOX_OWNER_TTL.total_seconds() / 4)
+
+    async def replay_outbox(self, *, include_own: bool = False) -> None:
+        """Queues the undelivered outbox entries this process can take over.
+
+        Entries are fetched and claimed a page at a time, so a large backlog isn't loaded all at once.
+
+        Parameters
+        ----------
+        include_own : bool
+            Whether to replay the entries this process' instance name left behind before it last stopped
+        """
+        destinations: Dict[str, Optional[bool]] = {}
+        replayed = discarded = 0
+        after = None
+        while True:
+            entries = await self.outbox.pending(include_own=include_own, after=after, limit=OUTBOX_PAGE_SIZE)
+            if not entries:
+                break
+
+            after = (entries[-1]['created_at'], entries[-1]['id'])
+            page_replayed, page_discarded = await self._replay_outbox_page(entries, destinations,
+                                                                           include_own=include_own)
+            replayed += page_replayed
+            discarded += page_discarded
+
+            if len(entries) < OUTBOX_PAGE_SIZE:
+                break
+
+        if replayed or discarded:
+            log.info(f"Replayed {replayed} undelivered outbox entries ({discarded} discarded)")
+
+    async def _replay_outbox_page(self, entries: List[Dict[str, Any]], destinations: Dict[str, Optional[bool]], *,
+                                  include_own: bool) -> Tuple[int, int]:
+        modlog = self.get_cog("ModLog")
+        for destination in {entry['destination'] for entry in entries} - destinations.keys():
+            if destination == self._error_logger.outbox_key:
+                destinations[destination] = True
+            elif modlog is not None:
+                destinations[destination] = await modlog.destination_exists(destination)
+
+        # Entries for channels this process doesn't know about are left for the process that does
+        entries = [entry for entry in entries if destinations.get(entry['destination']) is not None]
+        claimed = set(await self.outbox.claim([entry['id'] for entry in entries], include_own=include_own))
+
+        replayed = 0
+        discarded = []
+        for entry in entries:
+            if entry['id'] not in claimed:
+                continue
+
+            if entry['destination'] == self._error_logger.outbox_key:
+                await self._error_logger.replay(entry['id'], entry['payload'])
+                queued = True
+            elif destinations[entry['destination']]:
+                queued = await modlog.replay_entry(entry['destination'], entry['id'], entry['payload'])
+            else:
+                queued = False
+
+            if queued:
+                replayed += 1
+            else:
+                discarded.append(entry['id'])
+
+        self.outbox.ack(discarded)
+        return replayed, len(discarded)
+
     async def _notify_of_spam(self, member, channel, guild=None, blacklist=False) -> None:
         e = discord.Embed(color=discord.Color.red(), title="Member hit ratelimit")
         webhook = discord.Webhook.from_url(self.config['logging']['auto_blacklist'],
@@ -352,6 +448,9 @@ class LightningBot(commands.AutoShardedBot):
     async def close(self) -> None:
         log.info("Shutting down...")
         log.info("Closing database...")
+        if self._outbox_task is not None:
+            self._outbox_task.cancel()
+        await self.outbox.close()
         await self.pool.close()
         await self.aiosession.close()
         log.info("Closed aiohttp session and database successfully.")
@@ -0,0 +1,223 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import json
+import pathlib
+from typing import Optional
+
+import typer
+from tabulate import tabulate
+
+from lightning.bench import automod as automod_bench
+from lightning.bench import emitters as emitters_bench
+from lightning.bench import modlog as modlog_bench
+from lightning.bench import timedeltas as timedeltas_bench
+from lightning.bench import timeparse as timeparse_bench
+from lightning.bench import timers as timers_bench
+from lightning.config import CONFIG
+from lightning.utils.helpers import create_pool
+
+parser = typer.Typer()
+
+
+@parser.command()
+def corpus(output: pathlib.Path = typer.Argument(..., help="Where to write the corpus"),
+           messages: int = typer.Option(10000, help="Amount of messages to generate"),
+           guilds: int = typer.Option(1, help="Amount of guilds to spread messages across"),
+           members: int = typer.Option(50, help="Amount of members per guild"),
+           spam_ratio: float = typer.Option(0.1, help="How many of the messages are spam"),
+           seed: Optional[int] = typer.Option(None, help="Seed for the random generator")):
+    """Generates a synthetic JSONL message corpus"""
+    records = automod_bench.generate_corpus(messages, guilds=guilds, members=members, spam_ratio=spam_ratio,
+                                            seed=seed)
+    automod_bench.write_corpus(str(output), records)
+    typer.echo(f"Wrote {len(records)} messages to {output}")
+
+
+@parser.command()
+def automod(corpus: Optional[pathlib.Path] = typer.Option(None, help="A JSONL corpus to replay. A synthetic "
+                                                                     "corpus is generated if not given."),
+            messages: int = typer.Option(10000, help="Amount of messages to generate without a corpus"),
+            guilds: int = typer.Option(1, help="Amount of guilds to generate without a corpus"),
+            seed: Optional[int] = typer.Option(0, help="Seed for the generated corpus"),
+            config: Optional[pathlib.Path] = typer.Option(None, help="Automod TOML config to use for every guild"),
+            dsn: Optional[str] = typer.Option(None, help="Run against a Postgres database instead of the in-memory "
+                                                         "fake. Infractions are written to it!"),
+            allocations: bool = typer.Option(True, help="Whether to count allocations"),
+            output: Optional[pathlib.Path] = typer.Option(None, help="Write the results as JSON to this file"),
+            min_rate: Optional[float] = typer.Option(None, help="Exit with an error if messages/sec is below this")):
+    """Replays messages through the automod pipeline and reports its throughput"""
+    if corpus:
+        records = automod_bench.load_corpus(str(corpus))
+    else:
+        records = automod_bench.generate_corpus(messages, guilds=guilds, seed=seed)
+
+    automod_config = config.read_text() if config else automod_bench.DEFAULT_AUTOMOD_CONFIG
+
+    pool = None
+    if dsn:
+        pool = asyncio.get_event_loop().run_until_complete(create_pool(dsn, command_timeout=60))
+
+    result = automod_bench.run_automod_bench(records, automod_config=automod_config, pool=pool,
+                                             trace_allocations=allocations)
+
+    typer.echo(f"{result.messages} messages in {result.elapsed:.3f}s ({result.rate:,.0f} messages/sec)")
+
+    if result.rules:
+        table = [(name, f"{cost:.2f}") for name, cost in result.rules.items()]
+        typer.echo(tabulate(table, headers=["Rule", "µs/message"], tablefmt="psql"))
+
+    if allocations:
+        typer.echo(f"Allocations: {result.allocated_blocks:,} blocks, {result.allocated_size:,} bytes "
+                   f"(peak {result.peak_memory:,} bytes)")
+
+    if result.queries:
+        table = sorted(result.queries.items(), key=lambda x: x[1], reverse=True)
+        typer.echo(tabulate(table, headers=["Query", "Calls"], tablefmt="psql"))
+
+    if output:
+        output.write_text(json.dumps(result.to_dict(), indent=2))
+
+    if min_rate is not None and result.rate < min_rate:
+        typer.echo(f"Throughput is below {min_rate:,.0f} messages/sec", err=True)
+        raise typer.Exit(1)
+
+
+@parser.command()
+def emitters(entries: int = typer.Option(200, help="Amount of log entries to queue"),
+             rate: float = typer.Option(50.0, help="Entries queued per second"),
+             limit: int = typer.Option(5, help="Requests the fake server allows per window"),
+             per: float = typer.Option(5.0, help="Length of the fake server's ratelimit window in seconds"),
+             line_length: int = typer.Option(60, help="Length of each log entry"),
+             bursts: int = typer.Option(10, help="Amount of bursts the entries are queued in")):
+    """Compares fixed-sleep and ratelimit-paced emitters against a local fake Discord"""
+    results = emitters_bench.run_emitter_bench(entries=entries, rate=rate, limit=limit, per=per,
+                                               line_length=line_length, bursts=bursts)
+
+    headers = ["Emitter", "Elapsed (s)", "Requests", "429s", "Mean latency (s)", "p95 latency (s)"]
+    table = [(name, f"{r['elapsed']:.2f}", r['requests'], r['ratelimited'], f"{r['latency_mean']:.2f}",
+              f"{r['latency_p95']:.2f}") for name, r in results.items()]
+    typer.echo(tabulate(table, headers=headers, tablefmt="psql"))
+
+
+@parser.command()
+def modlog(channels: int = typer.Option(50, help="Amount of logging channels in the guild"),
+           lookups: int = typer.Option(100000, help="Amount of feature lookups to time"),
+           seed: Optional[int] = typer.Option(0, help="Seed for the generated logging config")):
+    """Compares scanning and indexed logging channel lookups"""
+    results = modlog_bench.run_modlog_bench(channels=channels, lookups=lookups, seed=seed)
+
+    table = [(name, f"{r['elapsed']:.3f}", f"{r['per_lookup_us']:.2f}") for name, r in results.items()]
+    typer.echo(tabulate(table, headers=["Lookup", "Elapsed (s)", "µs/lookup"], tablefmt="psql"))
+
+
+@parser.command(name="explain-reminders")
+def explain_reminders(dsn: Optional[str] = typer.Option(None, help="The database to check. Defaults to the "
+                                                                   "configured one.")):
+    """Checks that every reminder query can use an index"""
+    dsn = dsn or CONFIG['tokens']['postgres']['uri']
+    loop = asyncio.get_event_loop()
+    pool = loop.run_until_complete(create_pool(dsn, command_timeout=60))
+    try:
+        results = loop.run_until_complete(timers_bench.explain_reminder_queries(pool))
+    finally:
+        loop.run_until_complete(pool.close())
+
+    table = [(name, "yes" if seq_scan else "no", " > ".join(nodes)) for name, (seq_scan, nodes) in results.items()]
+    typer.echo(tabulate(table, headers=["Query", "Seq Scan", "Plan"], tablefmt="psql"))
+
+    if any(seq_scan for seq_scan, _ in results.values()):
+        typer.echo("Some reminder queries scan timers sequentially. Are the migrations applied?", err=True)
+        raise typer.Exit(1)
+
+
+@parser.command()
+def timers(dsn: Optional[str] = typer.Option(None, help="The database to run against. Defaults to the configured "
+                                                        "one. Bench timers are written to it and deleted after!"),
+           scheduler: str = typer.Option("lightning.cogs.reminders:Reminders",
+                                         help="The module:Class path of the scheduler cog to drive"),
+           pending: int = typer.Option(100000, help="Amount of far away timers in the table"),
+           inserts: int = typer.Option(1000, help="Amount of timers added one by one"),
+           burst: int = typer.Option(1000, help="Amount of timers that expire in the same second"),
+           burst_in: float = typer.Option(5.0, help="Seconds until the burst expires"),
+           short: bool = typer.Option(False, help="Send the burst through the short timer path"),
+           output: Optional[pathlib.Path] = typer.Option(None, help="Write the results as JSON to this file")):
+    """Measures timer insert throughput, dispatch lag and round trips per timer"""
+    dsn = dsn or CONFIG['tokens']['postgres']['uri']
+    loop = asyncio.get_event_loop()
+    pool = loop.run_until_complete(create_pool(dsn, command_timeout=60))
+    try:
+        result = timers_bench.run_timer_bench(pool, scheduler=scheduler, pending=pending, inserts=inserts,
+                                              burst=burst, burst_in=burst_in, short=short)
+    finally:
+        loop.run_until_complete(pool.close())
+
+    table = [(name, result[name]['timers'], f"{result[name]['elapsed']:.3f}", f"{result[name]['rate']:,.0f}")
+             for name in ("add_jobs", "add_job")]
+    typer.echo(tabulate(table, headers=["Insert", "Timers", "Elapsed (s)", "Timers/sec"], tablefmt="psql"))
+
+    lag = result['burst']
+    typer.echo(f"Burst: {lag['fired']}/{lag['timers']} fired, lag p50 {lag['p50'] * 1000:.1f}ms, "
+               f"p95 {lag['p95'] * 1000:.1f}ms, p99 {lag['p99'] * 1000:.1f}ms, max {lag['max'] * 1000:.1f}ms")
+    typer.echo(f"Round trips: {result['round_trips']} ({result['round_trips_per_timer']:.3f}/timer)")
+
+    table = sorted(result['queries'].items(), key=lambda x: x[1], reverse=True)
+    typer.echo(tabulate(table, headers=["Query", "Calls"], tablefmt="psql"))
+
+    if output:
+        output.write_text(json.dumps(result, indent=2))
+
+    if not lag['complete']:
+        typer.echo("Not every burst timer fired", err=True)
+        raise typer.Exit(1)
+
+
+@parser.command()
+def timeparse(corpus: Optional[pathlib.Path] = typer.Option(None, help="A file of reminder inputs, one per line. "
+                                                                       "A built in corpus is used if not given."),
+              iterations: int = typer.Option(100, help="Amount of passes over the corpus"),
+              step: float = typer.Option(1.0, help="Seconds between each pass")):
+    """Compares parsedatetime, the fast path and the parse cache on reminder inputs"""
+    inputs = [line for line in corpus.read_text().splitlines() if line.strip()] if corpus else None
+    result = timeparse_bench.run_timeparse_bench(inputs, iterations=iterations, step=step)
+
+    typer.echo(f"{result['fast_path_inputs']}/{result['inputs']} inputs take the fast path")
+    table = [(name, f"{r['mean']:.1f}", f"{r['p50']:.1f}", f"{r['p95']:.1f}", f"{r['max']:.1f}")
+             for name, r in result['parsers'].items()]
+    typer.echo(tabulate(table, headers=["Parser", "Mean (µs)", "p50 (µs)", "p95 (µs)", "Max (µs)"],
+                        tablefmt="psql"))
+
+    if result['differences']:
+        typer.echo(tabulate([(d['input'], d['fast'], d['nlp']) for d in result['differences']],
+                            headers=["Input", "Fast path", "parsedatetime"], tablefmt="psql"))
+
+
+@parser.command()
+def timedeltas(count: int = typer.Option(10000, help="Amount of timestamps to format"),
+               seed: Optional[int] = typer.Option(0, help="Seed for the generated timestamps"),
+               brief: bool = typer.Option(False, help="Use short units")):
+    """Compares natural_timedelta implementations on the same timestamps"""
+    result = timedeltas_bench.run_timedelta_bench(count=count, seed=seed, brief=brief)
+
+    table = [(name, f"{r['elapsed']:.3f}", f"{r['rate']:,.0f}") for name, r in result['results'].items()]
+    typer.echo(tabulate(table, headers=["Implementation", "Elapsed (s)", "Timestamps/sec"], tablefmt="psql"))
+
+    if result['mismatches']:
+        typer.echo(tabulate(result['mismatches'][:20], headers=["Timestamp", "relativedelta", "natural_timedeltas"],
+                            tablefmt="psql"))
+        typer.echo(f"{len(result['mismatches'])} timestamps were formatted differently", err=True)
+        raise typer.Exit(1)
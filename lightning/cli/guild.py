@@ -23,7 +23,7 @@ from lightning.config import CONFIG
 parser = typer.Typer()
 tables = [("commands_usage", "guild_id"), ("nin_updates", "guild_id"), ("guilds", "id"),
           ("guild_config", "guild_id"), ("guild_mod_config", "guild_id"), ("roles", "guild_id"),
-          ("logging", "guild_id"), ("infractions", "guild_id")]
+          ("logging", "guild_id"), ("infractions", "guild_id"), ("logging_webhooks", "guild_id")]
 
 
 def build_delete_query(table: str, column: str) -> str:
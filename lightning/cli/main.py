@@ -27,7 +27,7 @@ import sentry_sdk
 import typer
 
 from lightning.bot import LightningBot
-from lightning.cli import guild, tools
+from lightning.cli import bench, guild, tools
 from lightning.cli.utils import asyncd
 from lightning.config import CONFIG
 from lightning.utils.helpers import create_pool, run_in_shell
@@ -44,6 +44,7 @@ else:
 parser = typer.Typer()
 parser.add_typer(tools.parser, name="tools", help="Developer tools")
 parser.add_typer(guild.parser, name="guild", help="Guild management commands")
+parser.add_typer(bench.parser, name="bench", help="Offline benchmarks")
 
 
 @contextlib.contextmanager
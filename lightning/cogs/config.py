@@ -69,6 +69,8 @@ class ConfigViewerMenu(ViewMenu):
                             inline=False)
             embed.add_field(name="RoleSaver", value="Enabled" if record.flags.role_reapply else "Disabled",
                             inline=False)
+            embed.add_field(name="WebhookLogging", value="Enabled" if record.flags.webhook_logging else "Disabled",
+                            inline=False)
 
         if record.autorole:
             role = self.ctx.guild.get_role(record.autorole)
@@ -112,7 +114,9 @@ class ConfigViewerMenu(ViewMenu):
 
 Features = {"role saver": (ConfigFlags.role_reapply, "Now saving member roles.", "No longer saving member roles."),
             "invoke delete": (ConfigFlags.invoke_delete, "Now deleting successful command invocation messages",
-                              "No longer deleting successful command invocation messages")}
+                              "No longer deleting successful command invocation messages"),
+            "webhook logging": (ConfigFlags.webhook_logging, "Now sending logs through webhooks.",
+                                "No longer sending logs through webhooks.")}
 AutoModFeatures = {"delete longer messages": (ModFlags.delete_longer_messages,
                                               "deleting messages over 2000 characters"),
                    "delete stickers": (ModFlags.delete_stickers, "deleting messages containing a sticker.")}
@@ -537,6 +541,7 @@ class Configuration(LightningCog):
         await ctx.send("Configured automod according to your settings.")
         c = self.bot.get_cog("AutoMod")
         await c.get_automod_config.invalidate(ctx.guild.id)
+        c.invalidate_whitelist(ctx.guild.id)
 
     @automod.command(level=CommandLevel.Admin, aliases=['download'])
     @has_guild_permissions(manage_guild=True)
@@ -560,6 +565,11 @@ class Configuration(LightningCog):
         """Manages user permissions for the bot"""
         await ctx.send_help("config permissions")
 
+    def invalidate_automod_whitelist(self, guild_id: int) -> None:
+        cog = self.bot.get_cog("AutoMod")
+        if cog:
+            cog.invalidate_whitelist(guild_id)
+
     async def adjust_level(self, guild_id, level, _id, *, adjuster) -> bool:
         if level.lower() not in ('user', 'trusted', 'mod', 'admin', 'owner', 'blocked'):
             raise
@@ -610,6 +620,7 @@ class Configuration(LightningCog):
 
         await self.add_config_key(guild_id, "permissions", perms)
         await self.bot.get_guild_bot_config.invalidate(guild_id)
+        self.invalidate_automod_whitelist(guild_id)
         return res
 
     @permissions.command(name='add', level=CommandLevel.Admin)
@@ -743,6 +754,7 @@ class Configuration(LightningCog):
         query = "UPDATE guild_config SET permissions = permissions - 'LEVELS' WHERE guild_id=$1;"
         await self.bot.pool.execute(query, ctx.guild.id)
         await self.bot.get_guild_bot_config.invalidate(ctx.guild.id)
+        self.invalidate_automod_whitelist(ctx.guild.id)
         await ctx.tick(True)
 
     @has_guild_permissions(manage_guild=True)
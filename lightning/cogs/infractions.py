@@ -30,7 +30,7 @@ from lightning.formatters import truncate_text
 from lightning.utils.checks import has_guild_permissions
 from lightning.utils.helpers import ticker
 from lightning.utils.modlogformats import ActionType, base_user_format
-from lightning.utils.time import add_tzinfo, natural_timedelta
+from lightning.utils.time import add_tzinfo, natural_timedeltas
 
 
 class InfractionRecord:
@@ -114,26 +114,27 @@ class InfractionSource(menus.KeysetPageSource):
         return records
 
     def format_embed_description(self, embed: discord.Embed, entries: list) -> discord.Embed:
+        times = natural_timedeltas(entry['created_at'] for entry in entries)
         if self.member:
-            for entry in entries:
+            for entry, created in zip(entries, times):
                 moderator = self.bot.get_user(entry['moderator_id']) or entry['moderator_id']
                 reason = entry['reason'] or 'No reason provided.'
-                embed.add_field(name=f"{entry['id']}: {natural_timedelta(entry['created_at'])}",
+                embed.add_field(name=f"{entry['id']}: {created}",
                                 value=f"**Moderator**: {base_user_format(moderator)}\n"
                                       f"**Reason**: {truncate_text(reason, 45)}", inline=False)
         elif self.moderator:
-            for entry in entries:
+            for entry, created in zip(entries, times):
                 user = self.bot.get_user(entry['user_id']) or entry['user_id']
                 reason = entry['reason'] or 'No reason provided.'
-                embed.add_field(name=f"{entry['id']}: {natural_timedelta(entry['created_at'])}",
+                embed.add_field(name=f"{entry['id']}: {created}",
                                 value=f"**User**: {base_user_format(user)}\n"
                                       f"**Reason**: {truncate_text(reason, 45)}", inline=False)
         else:
-            for entry in entries:
+            for entry, created in zip(entries, times):
                 user = self.bot.get_user(entry['user_id']) or entry['user_id']
                 mod = self.bot.get_user(entry['moderator_id']) or entry['moderator_id']
                 reason = entry['reason'] or 'No reason provided.'
-                embed.add_field(name=f"{entry['id']}: {natural_timedelta(entry['created_at'])}",
+                embed.add_field(name=f"{entry['id']}: {created}",
                                 value=f"**User**: {base_user_format(user)}\n**Moderator**: {base_user_format(mod)}"
                                       f"\n**Reason**: {truncate_text(reason, 45)}",
                                 inline=False)
@@ -14,26 +14,41 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import asyncio
 import datetime
+import functools
+import logging
 import re
-from typing import Optional, Union
+import time
+from typing import Dict, FrozenSet, List, Optional, Union
 
 import discord
-from discord.ext.commands.cooldowns import (BucketType, Cooldown,
-                                            CooldownMapping)
+from discord.ext.commands.cooldowns import BucketType
+from lru import LRU
 from tomlkit import loads as toml_loads
 
-from lightning import CommandLevel, LightningCog, cache
-from lightning.models import PartialGuild
+from lightning import CommandLevel, LightningCog, PunishmentType, cache
+from lightning.events import InfractionEvent
+from lightning.models import PartialGuild, bulk_add_infractions
 from lightning.utils import modlogformats
 from lightning.utils.automod_parser import (AutomodPunishmentEnum,
                                             AutomodPunishmentModel,
                                             BaseTableModel, MessageSpamModel,
                                             read_file)
+from lightning.utils.automod_state import (AutomodStateStore, BucketUpdate,
+                                           MemoryAutomodState,
+                                           RedisAutomodState)
+from lightning.utils.executors import RatelimitedExecutor
+from lightning.utils.punishments import PunishmentJob
+from lightning.utils.raids import RaidDetector
 from lightning.utils.time import ShortTime
 
+log = logging.getLogger(__name__)
+
 INVITE_REGEX = re.compile(r"(?:https?://)?discord(?:app)?\.(?:com/invite|gg)/[a-zA-Z0-9]+/?")
 URL_REGEX = re.compile(r"https?:\/\/.*?$")
+# How long a member's whitelist status is cached for
+WHITELIST_CACHE_TTL = 60.0
 
 
 def invite_check(message):
@@ -54,7 +69,15 @@ class AutomodConfig:
         self.message_content_spam: Optional[MessageConfigBase] = None
         self.invite_spam: Optional[MessageConfigBase] = None
         self.url_spam: Optional[MessageConfigBase] = None
+        # Exemptions are kept as sets so they can be checked for every message without much cost
+        self.ignored_channels: FrozenSet[int] = frozenset()
+        self.ignored_categories: FrozenSet[int] = frozenset()
+        self.ignored_roles: FrozenSet[int] = frozenset()
         for record in records:
+            if record.type == "ignores":
+                self.ignored_channels = frozenset(record.channels)
+                self.ignored_categories = frozenset(record.categories)
+                self.ignored_roles = frozenset(record.roles)
             if record.type == "mass-mentions":
                 self.mass_mentions = record
             if record.type == "message-spam":
@@ -67,11 +90,37 @@ class AutomodConfig:
             if record.type == "url-spam":
                 self.url_spam = MessageConfigBase.from_model(record, BucketType.member, check=url_check)
 
+    def is_ignored(self, message: discord.Message) -> bool:
+        """Whether a message is exempt from automod because of its channel, category or the author's roles"""
+        channel = message.channel
+        if channel.id in self.ignored_channels:
+            return True
+
+        # Threads inherit their parent channel's exemption
+        parent_id = getattr(channel, "parent_id", None)
+        if parent_id and parent_id in self.ignored_channels:
+            return True
+
+        if self.ignored_categories and getattr(channel, "category_id", None) in self.ignored_categories:
+            return True
+
+        if self.ignored_roles:
+            roles = getattr(message.author, "_roles", ())
+            return not self.ignored_roles.isdisjoint(roles)
+
+        return False
+
 
 class MessageConfigBase:
-    """A class to make interacting with a message spam config easier..."""
-    def __init__(self, rate, seconds, punishment_config, bucket_type, *, check=None) -> None:
-        self.cooldown_bucket = CooldownMapping(Cooldown(rate, seconds), bucket_type)
+    """A class to make interacting with a message spam config easier...
+
+    Bucket state is not kept here, it lives in the cog's :class:`AutomodStateStore` so that reloading the config
+    doesn't reset every window."""
+    def __init__(self, name, rate, seconds, punishment_config, bucket_type, *, check=None) -> None:
+        self.name = name
+        self.rate = rate
+        self.seconds = seconds
+        self.bucket_type = bucket_type
         self.punishment: AutomodPunishmentModel = punishment_config
 
         if check and not callable(check):
@@ -81,24 +130,55 @@ class MessageConfigBase:
 
     @classmethod
     def from_model(cls, record: MessageSpamModel, bucket_type, *, check=None):
-        return cls(record.count, record.seconds, record.punishment, bucket_type, check=check)
+        return cls(record.type, record.count, record.seconds, record.punishment, bucket_type, check=check)
 
-    def update_bucket(self, message: discord.Message) -> bool:
-        if self.check and self.check(message) is False:
-            return
+    def applies_to(self, message: discord.Message) -> bool:
+        return not (self.check and self.check(message) is False)
+
+    def bucket_key(self, message: discord.Message) -> str:
+        if isinstance(self.bucket_type, BucketType):
+            key = self.bucket_type.get_key(message)
+        else:
+            key = self.bucket_type(message)
+
+        if not isinstance(key, tuple):
+            key = (key,)
 
-        b = self.cooldown_bucket.get_bucket(message)
-        ratelimited = b.update_rate_limit(message.created_at.timestamp())
-        return bool(ratelimited)
+        return ":".join(str(k) for k in (message.guild.id, self.name, *key))
 
-    def reset_bucket(self, message: discord.Message) -> None:
-        b = self.cooldown_bucket.get_bucket(message)
-        b.reset()
+    def to_update(self, message: discord.Message) -> BucketUpdate:
+        return BucketUpdate(self.bucket_key(message), self.rate, self.seconds)
 
 
 class AutoMod(LightningCog, required=["Mod"]):
     """Auto-moderation"""
 
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.raids = RaidDetector()
+        self._raid_executors: Dict[int, RatelimitedExecutor] = {}
+        self._raid_pending: Dict[int, Dict[int, discord.Member]] = {}
+        self._raid_tasks: Dict[int, asyncio.Task] = {}
+        self.automod_state = self.create_state_store()
+        # (guild_id, member_id, hash of role IDs): (whitelisted, expires at)
+        self._whitelist_cache = LRU(4096)
+
+    def create_state_store(self) -> AutomodStateStore:
+        backend = (self.bot.config.get("automod") or {}).get("state", "memory")
+        if backend != "redis":
+            return MemoryAutomodState()
+
+        if isinstance(self.bot.redis_pool, Exception):
+            log.warning(f"Automod state is set to redis but redis is unavailable ({self.bot.redis_pool!r}). "
+                        "Falling back to memory.")
+            return MemoryAutomodState()
+
+        return RedisAutomodState(self.bot.redis_pool, loop=self.bot.loop)
+
+    def cog_unload(self):
+        for task in self._raid_tasks.values():
+            task.cancel()
+
     @cache.cached('automod_config', cache.Strategy.raw)
     async def get_automod_config(self, guild_id: int):
         query = """SELECT config FROM automod WHERE guild_id=$1;"""
@@ -119,7 +199,29 @@ class AutoMod(LightningCog, required=["Mod"]):
         return await c.log_manual_action(guild, target, moderator, action, timestamp=timestamp, reason=reason, **kwargs)
 
     async def is_member_whitelisted(self, message: discord.Message) -> bool:
-        """Check that tells whether a member is exempt from automod or not"""
+        """Check that tells whether a member is exempt from automod or not.
+
+        The result is cached per member and role set for a short while since it's checked on every message."""
+        roles = message.author._roles if hasattr(message.author, "_roles") else []
+        key = (message.guild.id, message.author.id, hash(tuple(roles)))
+        now = time.monotonic()
+
+        cached = self._whitelist_cache.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        whitelisted = await self._resolve_member_whitelisted(message, roles)
+        self._whitelist_cache[key] = (whitelisted, now + WHITELIST_CACHE_TTL)
+        return whitelisted
+
+    def invalidate_whitelist(self, guild_id: int) -> None:
+        """Forgets every cached whitelist result for a guild.
+
+        This should be called whenever the guild's permissions or automod config change."""
+        for key in [k for k in self._whitelist_cache.keys() if k[0] == guild_id]:
+            del self._whitelist_cache[key]
+
+    async def _resolve_member_whitelisted(self, message: discord.Message, roles) -> bool:
         # TODO: Check against a generic set of moderator permissions.
         record = await self.bot.get_guild_bot_config(message.guild.id)
         if not record or record.permissions is None:
@@ -128,7 +230,6 @@ class AutoMod(LightningCog, required=["Mod"]):
         if record.permissions.levels is None:
             level = CommandLevel.User
         else:
-            roles = message.author._roles if hasattr(message.author, "_roles") else []
             level = record.permissions.levels.get_user_level(message.author.id, roles)
 
         if level == CommandLevel.Blocked:  # Blocked to commands, not ignored by automod
@@ -137,32 +238,26 @@ class AutoMod(LightningCog, required=["Mod"]):
         return level.value >= CommandLevel.Trusted.value
 
     # These only require one param, "message", because it contains all the information we want.
+    def _queue_punishment(self, action: str, message: discord.Message, **kwargs) -> bool:
+        job = PunishmentJob(action, message.author, moderator=self.bot.user, created_at=message.created_at, **kwargs)
+        return self.bot.get_cog("Mod").punishment_queue.put(job)
+
     async def _warn_punishment(self, message: discord.Message):
         reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "WARN", reason=reason)
+        self._queue_punishment("WARN", message, reason=reason)
 
     async def _kick_punishment(self, message: discord.Message):
         reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        await message.author.kick(reason=reason)
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "KICK",
-                                     reason="Member triggered automod")
-
-    async def _time_ban_member(self, message: discord.Message, duration: str):
-        reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        duration = ShortTime(duration, now=message.created_at)
-        cog = self.bot.get_cog("Reminders")
-        timer_id = await cog.add_job("timeban", message.created_at, duration.dt, guild_id=message.guild.id,
-                                     user_id=message.author.id, mod_id=self.bot.user.id, force_insert=True)
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "TIMEBAN", expiry=duration.dt,
-                                     timer_id=timer_id, reason=reason)
+        self._queue_punishment("KICK", message, reason="Member triggered automod", audit_reason=reason)
 
     async def _ban_punishment(self, message: discord.Message, duration=None):
         reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        await message.author.ban(reason=reason)
         if duration:
-            await self._time_ban_member(message, duration)
+            duration = ShortTime(duration, now=message.created_at)
+            self._queue_punishment("TIMEBAN", message, reason=reason, expiry=duration.dt)
             return
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "BAN", reason=reason)
+
+        self._queue_punishment("BAN", message, reason=reason)
 
     async def _delete_punishment(self, message: discord.Message):
         try:
@@ -211,7 +306,7 @@ class AutoMod(LightningCog, required=["Mod"]):
         duration = ShortTime(duration, now=message.created_at)
 
         if self.can_timeout(message, duration):
-            await message.author.edit(timed_out_until=duration.dt, reason=reason)
+            self._queue_punishment("TIMEOUT", message, reason=reason, expiry=duration.dt)
             return
 
         role = await self.get_mute_role(message.guild.id, temp=True)
@@ -222,16 +317,8 @@ class AutoMod(LightningCog, required=["Mod"]):
         if not message.channel.permissions_for(message.guild.get_member(self.bot.user.id)).manage_roles:
             return
 
-        cog = self.bot.get_cog('Reminders')
-        job_id = await cog.add_job("timemute", message.created_at, duration.dt,
-                                   guild_id=message.guild.id, user_id=message.author.id, role_id=role.id,
-                                   mod_id=self.bot.user.id, force_insert=True)
-        await message.author.add_roles(role, reason=reason)
-
-        await self.add_punishment_role(message.guild.id, message.author.id, role.id)
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "TIMEMUTE",
-                                     reason="Member triggered automod", expiry=duration.dt, timer_id=job_id,
-                                     timestamp=message.created_at)
+        self._queue_punishment("TIMEMUTE", message, reason="Member triggered automod", audit_reason=reason,
+                               expiry=duration.dt, role=role)
 
     async def _mute_punishment(self, message: discord.Message, duration=None):
         reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
@@ -245,10 +332,7 @@ class AutoMod(LightningCog, required=["Mod"]):
         if not role:
             return
 
-        await message.author.add_roles(role, reason=reason)
-        await self.add_punishment_role(message.guild.id, message.author.id, role.id)
-        await self.log_manual_action(message.guild, message.author, self.bot.user, "MUTE",
-                                     reason="Member triggered automod", timestamp=message.created_at)
+        self._queue_punishment("MUTE", message, reason="Member triggered automod", audit_reason=reason, role=role)
 
     punishments = {AutomodPunishmentEnum.WARN: _warn_punishment,
                    AutomodPunishmentEnum.KICK: _kick_punishment,
@@ -271,33 +355,138 @@ class AutoMod(LightningCog, required=["Mod"]):
         if message.guild is None:  # DM Channels are exempt.
             return
 
-        # TODO: Ignored channels
-        check = await self.is_member_whitelisted(message)
-        if check is True:
-            return
-
         record = await self.get_automod_config(message.guild.id)
         if not record:
             return
 
+        if record.is_ignored(message):
+            return
+
+        check = await self.is_member_whitelisted(message)
+        if check is True:
+            return
+
         if record.mass_mentions and len(message.mentions) >= record.mass_mentions.count:
             await self._handle_punishment(record.mass_mentions.punishment, message)
 
-        if record.message_spam and record.message_spam.update_bucket(message) is True:
-            record.message_spam.reset_bucket(message)  # Reset our bucket
-            await self._handle_punishment(record.message_spam.punishment, message)
+        rules = [rule for rule in (record.message_spam, record.invite_spam, record.url_spam)
+                 if rule and rule.applies_to(message)]
+        if not rules:
+            return
 
-        if record.invite_spam and record.invite_spam.update_bucket(message) is True:
-            record.invite_spam.reset_bucket(message)  # Reset our bucket
-            await self._handle_punishment(record.invite_spam.punishment, message)
+        # All of the buckets for this message are updated in one go
+        updates = [rule.to_update(message) for rule in rules]
+        results = await self.automod_state.update_many(updates, now=message.created_at.timestamp())
+
+        for rule, update, ratelimited in zip(rules, updates, results):
+            if ratelimited is True:
+                await self.automod_state.reset(update.key)  # Reset our bucket
+                await self._handle_punishment(rule.punishment, message)
+
+    # Raid mode
+    async def is_raid_active(self, guild_id: int) -> bool:
+        """Whether a guild is being raided, either detected or manually enabled"""
+        if self.raids.is_active(guild_id):
+            return True
+
+        record = await self.bot.get_cog("Mod").get_mod_config(guild_id)
+        return bool(record and record.raid_mode.active)
+
+    def end_raid(self, guild_id: int) -> None:
+        self.raids.end(guild_id)
+        self._raid_pending.pop(guild_id, None)
+
+    def get_raid_executor(self, guild_id: int) -> RatelimitedExecutor:
+        executor = self._raid_executors.get(guild_id)
+        if executor is None:
+            executor = RatelimitedExecutor(concurrency=2, interval=0.5, loop=self.bot.loop)
+            self._raid_executors[guild_id] = executor
+        return executor
+
+    def queue_raid_punishments(self, guild: discord.Guild, members: List[discord.Member],
+                               punishment: PunishmentType) -> None:
+        pending = self._raid_pending.setdefault(guild.id, {})
+        for member in members:
+            pending[member.id] = member
+
+        if guild.id not in self._raid_tasks:
+            self._raid_tasks[guild.id] = self.bot.loop.create_task(self._mitigate_raid(guild, punishment))
+
+    async def _mitigate_raid(self, guild: discord.Guild, punishment: PunishmentType) -> None:
+        try:
+            # Give the rest of the wave a second to show up so it's handled in one batch
+            await asyncio.sleep(1)
+            while self._raid_pending.get(guild.id):
+                members = list(self._raid_pending.pop(guild.id).values())
+                await self._punish_raiders(guild, members, punishment)
+        finally:
+            self._raid_tasks.pop(guild.id, None)
+            self._raid_executors.pop(guild.id, None)
+
+    async def _punish_raiders(self, guild: discord.Guild, members: List[discord.Member],
+                              punishment: PunishmentType) -> None:
+        permissions = guild.me.guild_permissions
+        reason = modlogformats.action_format(self.bot.user, reason="Raid detected")
+
+        if punishment is PunishmentType.BAN:
+            if not permissions.ban_members:
+                return
+            action = "BAN"
+            meth = functools.partial(guild.ban, reason=reason, delete_message_days=1)
+        else:
+            if not permissions.kick_members:
+                return
+            action = "KICK"
+            meth = functools.partial(guild.kick, reason=reason)
+
+        executor = self.get_raid_executor(guild.id)
+        results = await executor.run_many([functools.partial(meth, member) for member in members])
+
+        punished = []
+        for member, result in zip(members, results):
+            if isinstance(result, Exception):
+                log.debug(f"Failed to {action.lower()} {member.id} in {guild.id}", exc_info=result)
+                continue
+            punished.append(member)
+
+        if not punished:
+            return
+
+        events = [InfractionEvent(action, member=member, guild=guild, moderator=self.bot.user,
+                                  reason="Raid detected") for member in punished]
+        await bulk_add_infractions(self.bot.pool, [event.action for event in events])
+
+        for event in events:
+            self.bot.dispatch(f"lightning_member_{action.lower()}", event)
+
+        log.info(f"Raid mode punished {len(punished)}/{len(members)} members in {guild.id}")
+
+    @LightningCog.listener()
+    async def on_member_join(self, member: discord.Member) -> None:
+        if member.bot:
+            return
+
+        record = await self.bot.get_cog("Mod").get_mod_config(member.guild.id)
+        if not record:
+            return
+
+        raid = record.raid_mode
+        if raid.active:
+            members = [member]
+        elif raid.detection_enabled:
+            members = self.raids.feed(member, raid.users, raid.seconds)
+        else:
+            return
 
-        if record.url_spam and record.url_spam.update_bucket(message) is True:
-            record.url_spam.reset_bucket(message)  # Reset our bucket
-            await self._handle_punishment(record.url_spam.punishment, message)
+        if members:
+            self.queue_raid_punishments(member.guild, members, raid.punishment)
 
     @LightningCog.listener()
     async def on_lightning_guild_remove(self, guild: Union[PartialGuild, discord.Guild]) -> None:
         await self.get_automod_config.invalidate(guild.id)
+        self.invalidate_whitelist(guild.id)
+        await self.automod_state.clear(f"{guild.id}:")
+        self.end_raid(guild.id)
 
 
 def setup(bot) -> None:
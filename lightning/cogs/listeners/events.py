@@ -14,9 +14,7 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-import asyncio
-from datetime import timedelta
-from typing import Optional
+from typing import Dict, Optional
 
 import discord
 
@@ -24,6 +22,7 @@ from lightning import LightningBot, LightningCog
 from lightning.events import (AuditLogModAction, GuildRoleDeleteEvent,
                               MemberRolesUpdateEvent, MemberRoleUpdateEvent,
                               MemberUpdateEvent)
+from lightning.utils.auditlog import AuditLogPoller
 
 
 def match_attribute(attr, before, after):
@@ -54,32 +53,37 @@ class ListenerEvents(LightningCog):
 
     Based off of Mousey's event system"""
 
+    def __init__(self, bot: LightningBot):
+        super().__init__(bot)
+        self.audit_log_pollers: Dict[int, AuditLogPoller] = {}
+
     # TODO: A temp ignored cache.
 
+    def get_audit_log_poller(self, guild: discord.Guild) -> AuditLogPoller:
+        poller = self.audit_log_pollers.get(guild.id)
+        if poller is None:
+            poller = self.audit_log_pollers[guild.id] = AuditLogPoller(guild)
+        return poller
+
     async def fetch_audit_log_entry(self, guild: discord.Guild, action: discord.AuditLogAction, *, target=None,
-                                    limit: int = 50, check=None) -> Optional[discord.AuditLogEntry]:
-        async for entry in guild.audit_logs(limit=limit, action=action):
-            td = discord.utils.utcnow() - entry.created_at
-            if td < timedelta(seconds=10):
-                if target is not None and entry.target.id == target.id:
-                    return entry
-
-                if check is not None and check(entry):
-                    return entry
-
-    async def check_and_wait(self, guild: discord.Guild, *, timeout=0.5) -> bool:
-        """Checks if the bot has permissions to view the audit log and waits if the bot does have permission."""
+                                    check=None) -> Optional[discord.AuditLogEntry]:
+        """Waits for an audit log entry from the guild's shared poller"""
+        return await self.get_audit_log_poller(guild).find(action, getattr(target, "id", None), check=check)
+
+    async def check_and_wait(self, guild: discord.Guild) -> bool:
+        """Checks if the bot has permissions to view the audit log.
+
+        Waiting for the audit log to catch up is left to the guild's poller."""
         await self.bot.wait_until_ready()  # Might make this optional...
 
         if not guild.me:
             return False
 
-        if not guild.me.guild_permissions.view_audit_log:
-            # There's no point to wait if we don't have perms
-            return False
+        return guild.me.guild_permissions.view_audit_log
 
-        await asyncio.sleep(timeout)
-        return True
+    @LightningCog.listener()
+    async def on_guild_remove(self, guild):
+        self.audit_log_pollers.pop(guild.id, None)
 
     # Moderation Audit Log Integration Events
     @LightningCog.listener('on_member_remove')
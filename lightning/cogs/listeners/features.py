@@ -103,24 +103,25 @@ class FeaturesListeners(LightningCog):
     async def on_member_join(self, member: discord.Member) -> None:
         record = await self.bot.get_guild_bot_config(member.guild.id)
 
-        if not record or not record.autorole_id:
+        automod = self.bot.get_cog("AutoMod")
+        # Raiders are getting punished anyways, no need to look up their old roles. Autorole still applies.
+        if not automod or not await automod.is_raid_active(member.guild.id):
             if hasattr(record, 'flags'):
                 await self.apply_users_roles(member, reapply=bool(record.flags.role_reapply))
             else:
                 await self.apply_users_roles(member)
+
+        if not record or not record.autorole_id:
             return
 
         role = record.autorole
 
         if not role:
-            await self.apply_users_roles(member, reapply=record.flags.role_reapply)
             # Role is deleted
             await self.remove_config_key(member.guild.id, "autorole")
             await self.bot.get_guild_bot_config.invalidate(member.guild.id)
             return
 
-        await self.apply_users_roles(member, reapply=bool(record.flags.role_reapply))
-
         if role not in member.roles:
             with contextlib.suppress(discord.Forbidden, discord.HTTPException):
                 await member.add_roles(role, reason="Applying configured autorole")
@@ -16,15 +16,128 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 from __future__ import annotations
 
-from typing import Optional, Union
+import asyncio
+import logging
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import discord
 
 from lightning import LightningBot, LightningCog, LoggingType
 from lightning.cache import Strategy, cached
+from lightning.enums import ConfigFlags
 from lightning.models import LoggingConfig, PartialGuild
 from lightning.utils import modlogformats
-from lightning.utils.emitters import TextChannelEmitter
+from lightning.utils.emitters import (EmitterManager, OverflowPolicy,
+                                      TextChannelEmitter,
+                                      WebhookChannelEmitter)
+
+log = logging.getLogger(__name__)
+
+# How many log entries a channel can have waiting before they start getting summarized
+EMITTER_QUEUE_SIZE = 500
+# How many seconds a channel's emitter can sit idle before it's closed
+EMITTER_IDLE_TTL = 600.0
+
+# A renderer turns an event into the keyword arguments for TextChannelEmitter.put
+Renderer = Callable[..., Dict[str, Any]]
+
+
+def _mentions(*users) -> discord.AllowedMentions:
+    return discord.AllowedMentions(users=list(users))
+
+
+COMMAND_RAN_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda ctx: {
+        "content": modlogformats.MinimalisticFormat.command_ran(ctx, with_timestamp=True)},
+    "minimal without timestamp": lambda ctx: {
+        "content": modlogformats.MinimalisticFormat.command_ran(ctx, with_timestamp=False)},
+    "emoji": lambda ctx: {"content": modlogformats.EmojiFormat.command_ran(ctx),
+                          "allowed_mentions": _mentions(ctx.author)},
+    "embed": lambda ctx: {"embed": modlogformats.EmbedFormat.command_ran(ctx)}
+}
+
+ACTION_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda action: {
+        "content": modlogformats.MinimalisticFormat.from_action(action).format_message(with_timestamp=True)},
+    "minimal without timestamp": lambda action: {
+        "content": modlogformats.MinimalisticFormat.from_action(action).format_message(with_timestamp=False)},
+    "emoji": lambda action: {"content": modlogformats.EmojiFormat.from_action(action).format_message(),
+                             "allowed_mentions": _mentions(action.target, action.moderator)},
+    "embed": lambda action: {"embed": modlogformats.EmbedFormat.from_action(action).format_message()}
+}
+
+TIMED_ACTION_EXPIRED_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda action, user, mod, timer: {
+        "content": modlogformats.MinimalisticFormat.timed_action_expired(action, user, mod, timer.created_at,
+                                                                         timer.expiry, with_timestamp=True)},
+    "minimal without timestamp": lambda action, user, mod, timer: {
+        "content": modlogformats.MinimalisticFormat.timed_action_expired(action, user, mod, timer.created_at,
+                                                                         timer.expiry, with_timestamp=False)},
+    "emoji": lambda action, user, mod, timer: {
+        "content": modlogformats.EmojiFormat.timed_action_expired(action, user, mod, timer.created_at),
+        "allowed_mentions": _mentions(user, mod)},
+    "embed": lambda action, user, mod, timer: {
+        "embed": modlogformats.EmbedFormat.timed_action_expired(action, mod, user, timer.created_at)}
+}
+
+TIMED_ACTIONS_EXPIRED_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda action, entries, expiry: {
+        "content": modlogformats.MinimalisticFormat.timed_actions_expired(action, entries, expiry,
+                                                                          with_timestamp=True)},
+    "minimal without timestamp": lambda action, entries, expiry: {
+        "content": modlogformats.MinimalisticFormat.timed_actions_expired(action, entries, expiry,
+                                                                          with_timestamp=False)},
+    "emoji": lambda action, entries, expiry: {
+        "content": modlogformats.EmojiFormat.timed_actions_expired(action, entries),
+        # Discord only takes up to 100 users
+        "allowed_mentions": _mentions(*(user for user, _, _ in entries[:100]))},
+    "embed": lambda action, entries, expiry: {
+        "embed": modlogformats.EmbedFormat.timed_actions_expired(action, entries, expiry)}
+}
+
+JOIN_LEAVE_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda event, member: {
+        "content": modlogformats.MinimalisticFormat.join_leave(event, member)},
+    "emoji": lambda event, member: {"content": modlogformats.EmojiFormat.join_leave(event, member),
+                                    "allowed_mentions": _mentions(member)},
+    "embed": lambda event, member: {"embed": modlogformats.EmbedFormat.join_leave(event, member)}
+}
+
+SCREENING_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda member: {
+        "content": modlogformats.MinimalisticFormat.completed_screening(member, with_timestamp=True)},
+    "minimal without timestamp": lambda member: {
+        "content": modlogformats.MinimalisticFormat.completed_screening(member, with_timestamp=False)},
+    "emoji": lambda member: {"content": modlogformats.EmojiFormat.completed_screening(member),
+                             "allowed_mentions": _mentions(member)},
+    "embed": lambda member: {"embed": modlogformats.EmbedFormat.completed_screening(member)}
+}
+
+ROLE_CHANGE_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda member, added, removed, entry: {
+        "content": modlogformats.MinimalisticFormat.role_change(member, added, removed, entry=entry,
+                                                                with_timestamp=True)},
+    "minimal without timestamp": lambda member, added, removed, entry: {
+        "content": modlogformats.MinimalisticFormat.role_change(member, added, removed, entry=entry,
+                                                                with_timestamp=False)},
+    "emoji": lambda member, added, removed, entry: {
+        "content": modlogformats.EmojiFormat.role_change(added, removed, member, entry=entry)},
+    "embed": lambda member, added, removed, entry: {
+        "embed": modlogformats.EmbedFormat.role_change(member, added, removed, entry=entry)}
+}
+
+NICK_CHANGE_RENDERERS: Dict[str, Renderer] = {
+    "minimal with timestamp": lambda member, before, after, mod: {
+        "content": modlogformats.MinimalisticFormat.nick_change(member, before, after, mod, with_timestamp=True)},
+    "minimal without timestamp": lambda member, before, after, mod: {
+        "content": modlogformats.MinimalisticFormat.nick_change(member, before, after, mod, with_timestamp=False)},
+    "emoji": lambda member, before, after, mod: {
+        "content": modlogformats.EmojiFormat.nick_change(member, before, after, mod),
+        "allowed_mentions": _mentions(member)},
+    "embed": lambda member, before, after, mod: {
+        "embed": modlogformats.EmbedFormat.nick_change(member, before, after, mod)}
+}
 
 
 class ModLog(LightningCog):
@@ -33,13 +146,17 @@ class ModLog(LightningCog):
     Infractions should be inserted here as it's part of logging."""
     def __init__(self, bot: LightningBot):
         super().__init__(bot)
-        self._emitters = {}
+        self.emitters = EmitterManager(ttl=EMITTER_IDLE_TTL)
+        # Channels whose emitter was made while webhook logging was enabled
+        self._webhook_channels = set()
+        # Per-channel locks so a burst of events creates one emitter and one webhook instead of one per event
+        self._emitter_locks: Dict[int, asyncio.Lock] = {}
+        self._webhook_locks: Dict[int, asyncio.Lock] = {}
 
     # TODO: Log changes to infractions, temporary shushing of modlog channels
 
     def cog_unload(self):
-        for emitter in self._emitters.values():
-            emitter.close()
+        self.emitters.close()
 
     @cached('logging', Strategy.lru, max_size=64)
     async def get_logging_record(self, guild_id: int) -> Optional[LoggingConfig]:
@@ -57,6 +174,72 @@ class ModLog(LightningCog):
         records = await self.bot.pool.fetch("SELECT * FROM logging WHERE guild_id=$1;", guild_id)
         return LoggingConfig(records) if records else None
 
+    async def get_logging_webhook(self, channel: discord.TextChannel) -> Optional[discord.Webhook]:
+        """Gets the managed logging webhook for a channel, creating one if it doesn't exist.
+
+        Parameters
+        ----------
+        channel : discord.TextChannel
+            The logging channel
+
+        Returns
+        -------
+        Optional[discord.Webhook]
+            The webhook or None if one couldn't be created"""
+        async with self._webhook_locks.setdefault(channel.id, asyncio.Lock()):
+            record = await self.bot.pool.fetchrow("SELECT webhook_id, webhook_token FROM logging_webhooks "
+                                                  "WHERE channel_id=$1;", channel.id)
+            if record:
+                return discord.Webhook.partial(record['webhook_id'], record['webhook_token'],
+                                               session=self.bot.aiosession)
+
+            return await self.create_logging_webhook(channel)
+
+    async def create_logging_webhook(self, channel: discord.TextChannel) -> Optional[discord.Webhook]:
+        """Creates a logging webhook for a channel and stores it.
+
+        Parameters
+        ----------
+        channel : discord.TextChannel
+            The logging channel
+
+        Returns
+        -------
+        Optional[discord.Webhook]
+            The webhook or None if the bot is missing permissions"""
+        if not channel.permissions_for(channel.guild.me).manage_webhooks:
+            return None
+
+        try:
+            webhook = await channel.create_webhook(name=f"{self.bot.user.name} Logging",
+                                                   reason="Creating a webhook for logging")
+        except discord.HTTPException as e:
+            log.debug(f"Unable to create a logging webhook for {channel.id}: {e}")
+            return None
+
+        query = """INSERT INTO logging_webhooks (channel_id, guild_id, webhook_id, webhook_token)
+                   VALUES ($1, $2, $3, $4)
+                   ON CONFLICT (channel_id)
+                   DO UPDATE SET webhook_id = EXCLUDED.webhook_id, webhook_token = EXCLUDED.webhook_token;"""
+        await self.bot.pool.execute(query, channel.id, channel.guild.id, webhook.id, webhook.token)
+        return webhook
+
+    async def _recreate_logging_webhook(self, channel: discord.TextChannel) -> Optional[discord.Webhook]:
+        async with self._webhook_locks.setdefault(channel.id, asyncio.Lock()):
+            await self.bot.pool.execute("DELETE FROM logging_webhooks WHERE channel_id=$1;", channel.id)
+            return await self.create_logging_webhook(channel)
+
+    async def _create_emitter(self, channel: discord.TextChannel, use_webhook: bool) -> TextChannelEmitter:
+        kwargs = dict(ratelimits=self.bot.ratelimits, maxsize=EMITTER_QUEUE_SIZE, overflow=OverflowPolicy.summarize,
+                      outbox=self.bot.outbox)
+        webhook = await self.get_logging_webhook(channel) if use_webhook else None
+        if webhook is None:
+            return TextChannelEmitter(channel, **kwargs)
+
+        return WebhookChannelEmitter(channel, webhook, recreate=lambda: self._recreate_logging_webhook(channel),
+                                     username=self.bot.user.name, avatar_url=self.bot.user.display_avatar.url,
+                                     **kwargs)
+
     async def get_records(self, guild: Union[discord.Guild, int], feature):
         """Async iterator that gets logging records for a guild
 
@@ -74,20 +257,116 @@ class ModLog(LightningCog):
         if not records:
             return
 
+        config = await self.bot.get_guild_bot_config(guild.id)
+        use_webhook = config is not None and ConfigFlags.webhook_logging in config.flags
+
         for channel_id, rec in records:
             channel = guild.get_channel(channel_id)
             if not channel:
                 continue
 
-            emitter = self._emitters.get(channel_id, None)
-            if emitter is None:
-                emitter = TextChannelEmitter(channel)  # At some point, we'll also do EmbedsEmitter
-                self._emitters[channel_id] = emitter
+            yield await self.get_emitter(channel, use_webhook), rec
+
+    async def get_emitter(self, channel: discord.TextChannel, use_webhook: bool) -> TextChannelEmitter:
+        """Gets the running emitter for a logging channel, creating one if needed"""
+        emitter = self.emitters.get(channel.id)
+        if emitter is not None and (channel.id in self._webhook_channels) == use_webhook:
+            return emitter
 
-            if not emitter.running():
-                emitter.start()
+        async with self._emitter_locks.setdefault(channel.id, asyncio.Lock()):
+            emitter = self.emitters.get(channel.id)
+            # Either it was reaped or the flag was toggled since this emitter was made. Another event may have
+            # made a new one while we were waiting for the lock.
+            if emitter is None or (channel.id in self._webhook_channels) != use_webhook:
+                emitter = self.emitters.add(channel.id, await self._create_emitter(channel, use_webhook))
+                if use_webhook:
+                    self._webhook_channels.add(channel.id)
+                else:
+                    self._webhook_channels.discard(channel.id)
 
-            yield emitter, rec
+        return emitter
+
+    async def destination_exists(self, destination: str) -> Optional[bool]:
+        """Checks whether an outbox destination is a channel this process can replay to.
+
+        Returns
+        -------
+        Optional[bool]
+            True if the channel is cached here, False if it's gone and None if it belongs to another process or
+            Discord couldn't be asked.
+        """
+        if not destination.startswith("channel:"):
+            return False
+
+        channel_id = int(destination.split(":", 1)[1])
+        if isinstance(self.bot.get_channel(channel_id), discord.TextChannel):
+            return True
+
+        try:
+            await self.bot.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden):
+            return False
+        except discord.HTTPException:
+            pass
+
+        return None
+
+    async def replay_entry(self, destination: str, entry_id: uuid.UUID, payload: Dict[str, Any]) -> bool:
+        """Queues an outbox entry that was never delivered.
+
+        Returns
+        -------
+        bool
+            Whether the entry was queued. False if the channel no longer logs anything.
+        """
+        if not destination.startswith("channel:"):
+            return False
+
+        channel = self.bot.get_channel(int(destination.split(":", 1)[1]))
+        if not isinstance(channel, discord.TextChannel):
+            return False
+
+        record = await self.get_logging_record(channel.guild.id)
+        if not record or not record.get(channel.id):
+            return False
+
+        config = await self.bot.get_guild_bot_config(channel.guild.id)
+        use_webhook = config is not None and ConfigFlags.webhook_logging in config.flags
+        emitter = await self.get_emitter(channel, use_webhook)
+        await emitter.replay(entry_id, payload)
+        return True
+
+    async def get_emitters(self, guild: Union[discord.Guild, int],
+                           feature) -> Dict[str, List[TextChannelEmitter]]:
+        """Gets the emitters of every channel that logs a feature, grouped by the channel's format"""
+        formats: Dict[str, List[TextChannelEmitter]] = {}
+        async for emitter, record in self.get_records(guild, feature):
+            formats.setdefault(record['format'], []).append(emitter)
+        return formats
+
+    async def dispatch_log(self, guild: Union[discord.Guild, int], feature, renderers: Dict[str, Renderer],
+                           *args) -> None:
+        """Renders an event once per format and sends it to every channel that logs it.
+
+        Parameters
+        ----------
+        guild : Union[discord.Guild, int]
+            The guild the event happened in
+        feature : LoggingType
+            The logging type of the event
+        renderers : Dict[str, Renderer]
+            A table of format to renderer. Formats missing from the table aren't logged.
+        *args
+            The arguments passed to the renderer
+        """
+        for fmt, emitters in (await self.get_emitters(guild, feature)).items():
+            renderer = renderers.get(fmt)
+            if renderer is None:
+                continue
+
+            message = renderer(*args)
+            for emitter in emitters:
+                await emitter.put(**message)
 
     # Bot events
     @LightningCog.listener()
@@ -95,17 +374,7 @@ class ModLog(LightningCog):
         if ctx.guild is None:
             return
 
-        async for emitter, record in self.get_records(ctx.guild, LoggingType.COMMAND_RAN):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                arg = False if record['format'] == "minimal without timestamp" else True
-                fmt = modlogformats.MinimalisticFormat.command_ran(ctx, with_timestamp=arg)
-                await emitter.send(fmt)
-            elif record['format'] == "emoji":
-                fmt = modlogformats.EmojiFormat.command_ran(ctx)
-                await emitter.send(fmt, allowed_mentions=discord.AllowedMentions(users=[ctx.author]))
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.command_ran(ctx)
-                await emitter.send(embed=embed)
+        await self.dispatch_log(ctx.guild, LoggingType.COMMAND_RAN, COMMAND_RAN_RENDERERS, ctx)
 
     # Moderation
     @LightningCog.listener('on_lightning_member_warn')
@@ -119,57 +388,22 @@ class ModLog(LightningCog):
             await event.action.add_infraction(self.bot.pool)
 
         event_name = f"MEMBER_{event.action.event}" if not hasattr(event, "event_name") else f"MEMBER_{str(event)}"
-
-        async for emitter, record in self.get_records(event.guild, LoggingType(event_name)):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                fmt = modlogformats.MinimalisticFormat.from_action(event.action)
-                arg = False if record['format'] == "minimal without timestamp" else True
-                msg = fmt.format_message(with_timestamp=arg)
-                await emitter.send(msg)
-            elif record['format'] == "emoji":
-                fmt = modlogformats.EmojiFormat.from_action(event.action)
-                msg = fmt.format_message()
-                await emitter.send(msg,
-                                   allowed_mentions=discord.AllowedMentions(users=[event.action.target,
-                                                                                   event.action.moderator]))
-            elif record['format'] == "embed":
-                fmt = modlogformats.EmbedFormat.from_action(event.action)
-                embed = fmt.format_message()
-                await emitter.send(embed=embed)
+        await self.dispatch_log(event.guild, LoggingType(event_name), ACTION_RENDERERS, event.action)
 
     @LightningCog.listener()
     async def on_lightning_timed_moderation_action_done(self, action, guild_id, user, moderator, timer):
-        async for emitter, record in self.get_records(guild_id, action):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                arg = False if record['format'] == "minimal without timestamp" else True
-                message = modlogformats.MinimalisticFormat.timed_action_expired(action.lower(), user, moderator,
-                                                                                timer.created_at, timer.expiry,
-                                                                                with_timestamp=arg)
-                await emitter.send(message)
-            elif record['format'] == "emoji":
-                message = modlogformats.EmojiFormat.timed_action_expired(action.lower(), user, moderator,
-                                                                         timer.created_at)
-                await emitter.send(message, allowed_mentions=discord.AllowedMentions(users=[user, moderator]))
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.timed_action_expired(action.lower(), moderator, user,
-                                                                       timer.created_at)
-                await emitter.send(embed=embed)
+        await self.dispatch_log(guild_id, LoggingType(f"MEMBER_{action}"), TIMED_ACTION_EXPIRED_RENDERERS,
+                                action.lower(), user, moderator, timer)
+
+    @LightningCog.listener()
+    async def on_lightning_timed_moderation_actions_done(self, action, guild_id, entries, expiry):
+        await self.dispatch_log(guild_id, LoggingType(f"MEMBER_{action}"), TIMED_ACTIONS_EXPIRED_RENDERERS,
+                                action.lower(), entries, expiry)
 
     # Member events
     async def _log_member_join_leave(self, member, event):
         await self.bot.wait_until_ready()
-
-        guild = member.guild
-        async for emitter, record in self.get_records(guild, event):
-            if record['format'] == "minimal with timestamp":
-                message = modlogformats.MinimalisticFormat.join_leave(str(event), member)
-                await emitter.put(message)
-            elif record['format'] == "emoji":
-                message = modlogformats.EmojiFormat.join_leave(str(event), member)
-                await emitter.put(message, allowed_mentions=discord.AllowedMentions(users=[member]))
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.join_leave(str(event), member)
-                await emitter.put(embed=embed)
+        await self.dispatch_log(member.guild, event, JOIN_LEAVE_RENDERERS, str(event), member)
 
     @LightningCog.listener()
     async def on_member_join(self, member):
@@ -181,32 +415,11 @@ class ModLog(LightningCog):
 
     @LightningCog.listener()
     async def on_lightning_member_passed_screening(self, member):
-        async for emitter, record in self.get_records(member.guild, LoggingType.MEMBER_SCREENING_COMPLETE):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                arg = False if record['format'] == "minimal without timestamp" else True
-                message = modlogformats.MinimalisticFormat.completed_screening(member, with_timestamp=arg)
-                await emitter.put(message)
-            elif record['format'] == "emoji":
-                message = modlogformats.EmojiFormat.completed_screening(member)
-                await emitter.put(message, allowed_mentions=discord.AllowedMentions(users=[member]))
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.completed_screening(member)
-                await emitter.put(embed=embed)
+        await self.dispatch_log(member.guild, LoggingType.MEMBER_SCREENING_COMPLETE, SCREENING_RENDERERS, member)
 
     async def _log_role_changes(self, ltype: LoggingType, guild, member, *, added=None, removed=None,
                                 entry=None) -> None:
-        async for emitter, record in self.get_records(guild, ltype):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                arg = False if record['format'] == "minimal without timestamp" else True
-                message = modlogformats.MinimalisticFormat.role_change(member, added, removed, entry=entry,
-                                                                       with_timestamp=arg)
-                await emitter.send(message)
-            elif record['format'] == "emoji":
-                message = modlogformats.EmojiFormat.role_change(added, removed, member, entry=entry)
-                await emitter.put(message)
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.role_change(member, added, removed, entry=entry)
-                await emitter.put(embed=embed)
+        await self.dispatch_log(guild, ltype, ROLE_CHANGE_RENDERERS, member, added, removed, entry)
 
     @LightningCog.listener()
     async def on_lightning_member_role_change(self, event):
@@ -220,26 +433,12 @@ class ModLog(LightningCog):
 
     @LightningCog.listener()
     async def on_lightning_member_nick_change(self, event):
-        guild = event.guild
-        async for emitter, record in self.get_records(guild, LoggingType.MEMBER_NICK_CHANGE):
-            if record['format'] in ("minimal with timestamp", "minimal without timestamp"):
-                arg = False if record['format'] == "minimal without timestamp" else True
-                message = modlogformats.MinimalisticFormat.nick_change(event.after, event.before.nick, event.after.nick,
-                                                                       event.moderator, with_timestamp=arg)
-                await emitter.put(message)
-            elif record['format'] == "emoji":
-                message = modlogformats.EmojiFormat.nick_change(event.after, event.before.nick, event.after.nick,
-                                                                event.moderator)
-                await emitter.put(message, allowed_mentions=discord.AllowedMentions(users=[event.after]))
-            elif record['format'] == "embed":
-                embed = modlogformats.EmbedFormat.nick_change(event.after, event.before.nick, event.after.nick,
-                                                              event.moderator)
-                await emitter.put(embed=embed)
+        await self.dispatch_log(event.guild, LoggingType.MEMBER_NICK_CHANGE, NICK_CHANGE_RENDERERS, event.after,
+                                event.before.nick, event.after.nick, event.moderator)
 
     def _close_emitter(self, channel_id: int) -> None:
-        emitter = self._emitters.pop(channel_id, None)
-        if emitter:
-            emitter.close()
+        self.emitters.remove(channel_id)
+        self._webhook_channels.discard(channel_id)
 
     @LightningCog.listener()
     async def on_lightning_channel_config_remove(self, event):
@@ -247,6 +446,7 @@ class ModLog(LightningCog):
             return
 
         self._close_emitter(event.channel.id)
+        await self.bot.pool.execute("DELETE FROM logging_webhooks WHERE channel_id=$1;", event.channel.id)
         await self.get_logging_record.invalidate(event.guild.id)
 
     @LightningCog.listener()
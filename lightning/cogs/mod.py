@@ -16,13 +16,13 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 from collections import Counter
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import List, Optional, Set, Tuple, Union
 
 import discord
 from discord.ext import commands
 
 from lightning import (CommandLevel, LightningCog, LightningContext, ModFlags,
-                       cache, command, converters)
+                       PunishmentType, cache, command, converters)
 from lightning import flags as lflags
 from lightning import group
 from lightning.errors import LightningError, MuteRoleError, TimersUnavailable
@@ -32,6 +32,8 @@ from lightning.models import GuildModConfig, PartialGuild
 from lightning.utils import helpers, modlogformats
 from lightning.utils.checks import (has_channel_permissions,
                                     has_guild_permissions)
+from lightning.utils.punishments import (ExpirationQueue, PunishmentJob,
+                                         PunishmentQueue)
 from lightning.utils.time import (FutureTime, get_utc_timestamp,
                                   natural_timedelta)
 
@@ -52,10 +54,28 @@ BaseModParser = lflags.FlagParser([lflags.Flag("--nodm", "--no-dm", is_bool_flag
 
 COMMON_HOIST_CHARACTERS = ["!", "-", "/", "*", "(", ")", "+", "[", "]", "#", "<", ">", "_", ".", "$", "\""]
 
+RAID_PUNISHMENTS = {"kick": PunishmentType.KICK, "ban": PunishmentType.BAN}
+
+
+def convert_to_raid_punishment(argument):
+    if argument.lower() in RAID_PUNISHMENTS.keys():
+        return RAID_PUNISHMENTS[argument.lower()]
+    else:
+        raise commands.BadArgument(f"\"{argument}\" is not a valid raid punishment. Use kick or ban.")
+
 
 class Mod(LightningCog, required=["Configuration"]):
     """Moderation and server management commands."""
 
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.punishment_queue = PunishmentQueue(bot)
+        self.expiration_queue = ExpirationQueue(bot)
+
+    def cog_unload(self):
+        self.punishment_queue.close()
+        self.expiration_queue.close()
+
     @cache.cached('mod_config', cache.Strategy.lru)
     async def get_mod_config(self, guild_id: int) -> Optional[GuildModConfig]:
         query = "SELECT * FROM guild_mod_config WHERE guild_id=$1;"
@@ -80,12 +100,93 @@ class Mod(LightningCog, required=["Configuration"]):
         connection = connection or self.bot.pool
         return await connection.execute(query, guild_id, user_id, [role_id])
 
+    async def add_punishment_roles(self, entries: List[Tuple[int, int, int]], *, connection=None) -> str:
+        """Adds many punishment roles with one query.
+
+        Parameters
+        ----------
+        entries : List[Tuple[int, int, int]]
+            The guild ID, user ID and role ID of each punishment role
+        """
+        query = """INSERT INTO roles (guild_id, user_id, punishment_roles)
+                   SELECT data.guild_id, data.user_id, array_agg(DISTINCT data.role_id)
+                   FROM unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS data(guild_id, user_id, role_id)
+                   GROUP BY data.guild_id, data.user_id
+                   ON CONFLICT (guild_id, user_id)
+                   DO UPDATE SET
+                       punishment_roles =
+                   ARRAY(SELECT DISTINCT * FROM unnest(COALESCE(roles.punishment_roles, '{}') ||
+                                                       EXCLUDED.punishment_roles));"""
+        connection = connection or self.bot.pool
+        guild_ids, user_ids, role_ids = (list(column) for column in zip(*entries))
+        return await connection.execute(query, guild_ids, user_ids, role_ids)
+
     async def remove_punishment_role(self, guild_id: int, user_id: int, role_id: int, *, connection=None) -> None:
         query = """UPDATE roles SET punishment_roles = array_remove(punishment_roles, $1)
                    WHERE guild_id=$2 AND user_id=$3;"""
         connection = connection or self.bot.pool
         await connection.execute(query, role_id, guild_id, user_id)
 
+    async def remove_punishment_roles(self, entries: List[Tuple[int, int, int]], *,
+                                      connection=None) -> Set[Tuple[int, int, int]]:
+        """Removes many punishment roles with one query.
+
+        Parameters
+        ----------
+        entries : List[Tuple[int, int, int]]
+            The guild ID, user ID and role ID of each punishment role
+
+        Returns
+        -------
+        Set[Tuple[int, int, int]]
+            The entries whose role was attached before it was removed
+        """
+        # Every part of the statement sees the same snapshot, so "held" has the roles as they were before removal
+        query = """WITH data AS (SELECT data.guild_id, data.user_id, array_agg(data.role_id) AS role_ids
+                                 FROM unnest($1::bigint[], $2::bigint[], $3::bigint[])
+                                     AS data(guild_id, user_id, role_id)
+                                 GROUP BY data.guild_id, data.user_id),
+                   held AS (SELECT roles.guild_id, roles.user_id, roles.punishment_roles
+                            FROM roles JOIN data ON roles.guild_id = data.guild_id AND roles.user_id = data.user_id),
+                   removed AS (UPDATE roles
+                               SET punishment_roles =
+                                   ARRAY(SELECT role_id FROM unnest(roles.punishment_roles) AS role_id
+                                         WHERE role_id <> ALL(data.role_ids))
+                               FROM data
+                               WHERE roles.guild_id = data.guild_id AND roles.user_id = data.user_id)
+                   SELECT guild_id, user_id, punishment_roles FROM held;"""
+        connection = connection or self.bot.pool
+        guild_ids, user_ids, role_ids = (list(column) for column in zip(*entries))
+        records = await connection.fetch(query, guild_ids, user_ids, role_ids)
+
+        held = {(record['guild_id'], record['user_id']): record['punishment_roles'] or [] for record in records}
+        return {entry for entry in entries if entry[2] in held.get(entry[:2], [])}
+
+    async def held_punishment_roles(self, entries: List[Tuple[int, int, int]], *,
+                                    connection=None) -> Set[Tuple[int, int, int]]:
+        """Checks which of many punishment roles are currently attached with one query.
+
+        Parameters
+        ----------
+        entries : List[Tuple[int, int, int]]
+            The guild ID, user ID and role ID of each punishment role
+
+        Returns
+        -------
+        Set[Tuple[int, int, int]]
+            The entries whose role is currently attached
+        """
+        query = """SELECT roles.guild_id, roles.user_id, roles.punishment_roles
+                   FROM roles
+                   JOIN unnest($1::bigint[], $2::bigint[]) AS data(guild_id, user_id)
+                   ON roles.guild_id = data.guild_id AND roles.user_id = data.user_id;"""
+        connection = connection or self.bot.pool
+        guild_ids, user_ids, _ = (list(column) for column in zip(*entries))
+        records = await connection.fetch(query, guild_ids, user_ids)
+
+        held = {(record['guild_id'], record['user_id']): record['punishment_roles'] or [] for record in records}
+        return {entry for entry in entries if entry[2] in held.get(entry[:2], [])}
+
     async def log_manual_action(self, guild: discord.Guild, target, moderator,
                                 action: Union[modlogformats.ActionType, str], *, timestamp=None,
                                 reason: Optional[str] = None, **kwargs) -> None:
@@ -96,7 +197,11 @@ class Mod(LightningCog, required=["Configuration"]):
 
         event = InfractionEvent(action, member=target, guild=guild, moderator=moderator, reason=reason, **kwargs)
         await event.action.add_infraction(connection)
+        self.dispatch_action_event(event, action, timestamp=timestamp)
 
+    def dispatch_action_event(self, event: InfractionEvent, action: Union[modlogformats.ActionType, str], *,
+                              timestamp: datetime) -> None:
+        """Dispatches the modlog event for an infraction that was already inserted"""
         if not isinstance(action, modlogformats.ActionType):
             action = modlogformats.ActionType[str(action)]
 
@@ -768,62 +873,11 @@ class Mod(LightningCog, required=["Configuration"]):
 
     @LightningCog.listener()
     async def on_lightning_timeban_complete(self, timer):
-        # We need to update timeban status first. Eventually, we need to move this over to infractions cog but idk
-        query = "UPDATE infractions SET active=false WHERE guild_id=$1 AND user_id=$2 AND expiry=$3 AND action='4';"
-        await self.bot.pool.execute(query, timer.extra['guild_id'], timer.extra['user_id'], timer.expiry)
-
-        guild = self.bot.get_guild(timer.extra['guild_id'])
-        if guild is None:
-            # Bot was kicked.
-            return
-
-        try:
-            user = await self.bot.fetch_user(timer.extra['user_id'])
-        except Exception:
-            user = helpers.BetterUserObject(id=timer.extra['user_id'])
-
-        moderator = guild.get_member(timer.extra['mod_id']) or helpers.BetterUserObject(id=timer.extra['mod_id'])
-
-        reason = f"Timed ban made by {modlogformats.base_user_format(moderator)} at {timer.created_at} expired"
-        await guild.unban(user, reason=reason)
-        self.bot.dispatch("lightning_timed_moderation_action_done", "UNBAN", guild, user, moderator, timer)
+        await self.expiration_queue.put(timer)
 
     @LightningCog.listener()
     async def on_lightning_timemute_complete(self, timer):
-        async with self.bot.pool.acquire() as connection:
-            if await self.punishment_role_check(timer.extra['guild_id'],
-                                                timer.extra['user_id'],
-                                                timer.extra['role_id'], connection=connection) is False:
-                return
-
-            await self.remove_punishment_role(timer.extra['guild_id'], timer.extra['user_id'],
-                                              timer.extra['role_id'], connection=connection)
-            query = "UPDATE infractions SET active=false WHERE guild_id=$1 AND user_id=$2 AND expiry=$3 AND action='8';"
-            await connection.execute(query, timer.extra['guild_id'], timer.extra['user_id'], timer.expiry)
-
-        guild = self.bot.get_guild(timer.extra['guild_id'])
-        if guild is None:
-            # Bot was kicked.
-            return
-
-        moderator = guild.get_member(timer.extra['mod_id']) or helpers.BetterUserObject(timer.extra['mod_id'])
-
-        role = guild.get_role(timer.extra['role_id'])
-        if role is None:
-            # Role was deleted or something.
-            return
-
-        user = guild.get_member(timer.extra['user_id'])
-        if user is None:
-            # User left probably...
-            user = helpers.BetterUserObject(timer.extra['user_id'])
-        else:
-            reason = f"Timed mute made by {modlogformats.base_user_format(moderator)} at "\
-                     f"{get_utc_timestamp(timer.created)} expired"
-            # I think I'll intentionally let it raise an error if bot missing perms or w/e...
-            await user.remove_roles(role, reason=reason)
-
-        self.bot.dispatch("lightning_timed_moderation_action_done", "UNMUTE", guild, user, moderator, timer)
+        await self.expiration_queue.put(timer)
 
     @LightningCog.listener()
     async def on_lightning_member_role_change(self, event):
@@ -886,9 +940,94 @@ class Mod(LightningCog, required=["Configuration"]):
     # -------
     # TBH, this is mostly a bunch of listeners, but there's a command or two so it's staying in the same file.
 
-    @command(hidden=True)
+    async def set_raid_mode_key(self, guild_id: int, key: str, value) -> None:
+        query = f"""INSERT INTO guild_mod_config (guild_id, {key})
+                    VALUES ($1, $2)
+                    ON CONFLICT (guild_id)
+                    DO UPDATE SET {key} = EXCLUDED.{key};"""
+        await self.bot.pool.execute(query, guild_id, value)
+        await self.get_mod_config.invalidate(guild_id)
+
+    @has_guild_permissions(manage_guild=True)
+    @group(invoke_without_command=True, level=CommandLevel.Mod)
     async def raidmode(self, ctx: LightningContext) -> None:
-        ...
+        """Shows the raid mode settings for the server.
+
+        Raid mode watches how fast members join the server. New accounts and accounts without an avatar \
+        count more towards the threshold. Once the threshold is hit, the members that joined are punished \
+        and so is everyone who joins until the raid calms down."""
+        record = await self.get_mod_config(ctx.guild.id)
+        automod = self.bot.get_cog("AutoMod")
+
+        if not record or (not record.raid_mode.detection_enabled and not record.raid_mode.active):
+            await ctx.send("Raid mode has not been setup.")
+            return
+
+        raid = record.raid_mode
+        msg = []
+        if raid.detection_enabled:
+            msg.append(f"Threshold: {plural(raid.users):join} in {plural(raid.seconds):second}")
+        msg.append(f"Punishment: {raid.punishment.name.lower()}")
+
+        if raid.active:
+            msg.append("Raid mode is manually enabled.")
+        elif automod and automod.raids.is_active(ctx.guild.id):
+            msg.append("A raid is currently in progress.")
+
+        await ctx.send("\n".join(msg))
+
+    @has_guild_permissions(manage_guild=True)
+    @raidmode.command(name="threshold", level=CommandLevel.Admin)
+    async def raidmode_threshold(self, ctx: LightningContext, users: converters.InbetweenNumber(2, 100),
+                                 seconds: converters.InbetweenNumber(1, 300)) -> None:
+        """Sets how many members can join in a certain amount of seconds before raid mode kicks in"""
+        query = """INSERT INTO guild_mod_config (guild_id, automod_join_threshold_users, automod_join_threshold_seconds)
+                   VALUES ($1, $2, $3)
+                   ON CONFLICT (guild_id)
+                   DO UPDATE SET automod_join_threshold_users = EXCLUDED.automod_join_threshold_users,
+                                 automod_join_threshold_seconds = EXCLUDED.automod_join_threshold_seconds;"""
+        await self.bot.pool.execute(query, ctx.guild.id, users, seconds)
+        await self.get_mod_config.invalidate(ctx.guild.id)
+        await ctx.send(f"Raid mode will now trigger when {plural(users):member} join in {plural(seconds):second}.")
+
+    @has_guild_permissions(manage_guild=True)
+    @raidmode.command(name="punishment", level=CommandLevel.Admin)
+    async def raidmode_punishment(self, ctx: LightningContext, punishment: convert_to_raid_punishment) -> None:
+        """Sets the punishment for members caught by raid mode (kick or ban)"""
+        await self.set_raid_mode_key(ctx.guild.id, "automod_raid_punishment", punishment.value)
+        tense = "banned" if punishment is PunishmentType.BAN else "kicked"
+        await ctx.send(f"Members caught by raid mode will now be {tense}.")
+
+    @has_guild_permissions(manage_guild=True)
+    @raidmode.command(name="disable", level=CommandLevel.Admin)
+    async def raidmode_disable(self, ctx: LightningContext) -> None:
+        """Disables raid detection for the server"""
+        query = """UPDATE guild_mod_config
+                   SET automod_join_threshold_users=NULL,
+                   automod_join_threshold_seconds=NULL
+                   WHERE guild_id=$1;"""
+        await self.bot.pool.execute(query, ctx.guild.id)
+        await self.get_mod_config.invalidate(ctx.guild.id)
+        await ctx.send("Disabled raid detection.")
+
+    @has_guild_permissions(manage_guild=True)
+    @raidmode.command(name="on", level=CommandLevel.Mod)
+    async def raidmode_on(self, ctx: LightningContext) -> None:
+        """Manually enables raid mode. Every member that joins will be punished."""
+        await self.set_raid_mode_key(ctx.guild.id, "raid_mode", True)
+        await ctx.send(f"Raid mode is now on. Use `{ctx.prefix}raidmode off` to turn it off.")
+
+    @has_guild_permissions(manage_guild=True)
+    @raidmode.command(name="off", level=CommandLevel.Mod)
+    async def raidmode_off(self, ctx: LightningContext) -> None:
+        """Turns off raid mode, including any raid that is currently being handled"""
+        await self.set_raid_mode_key(ctx.guild.id, "raid_mode", False)
+
+        automod = self.bot.get_cog("AutoMod")
+        if automod:
+            automod.end_raid(ctx.guild.id)
+
+        await ctx.send("Raid mode is now off.")
 
     async def is_member_whitelisted(self, message) -> bool:
         """Check that tells whether a member is exempt from automod or not"""
@@ -914,15 +1053,12 @@ class Mod(LightningCog, required=["Configuration"]):
                                            modlogformats.ActionType.WARN.value)
         return rev or 0
 
-    async def _kick_punishment(self, target):
-        reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        await target.kick(reason=reason)
-        await self.log_manual_action(target, self.bot.user, "KICK", reason="Member triggered automod")
+    def _queue_warn_punishment(self, action: str, target) -> None:
+        if not isinstance(target, discord.Member):
+            return
 
-    async def _ban_punishment(self, target):
         reason = modlogformats.action_format(self.bot.user, reason="Automod triggered")
-        await target.ban(reason=reason)
-        await self.log_manual_action(target.guild, target, self.bot.user, "BAN", reason=reason)
+        self.punishment_queue.put(PunishmentJob(action, target, moderator=self.bot.user, reason=reason))
 
     async def _delete_punishment(self, message):
         try:
@@ -940,10 +1076,10 @@ class Mod(LightningCog, required=["Configuration"]):
         count = await self.get_warn_count(event.guild.id, event.member.id)
 
         if record.warn_kick and record.warn_kick == count:
-            await self._kick_punishment(event.member)
+            self._queue_warn_punishment("KICK", event.member)
 
         if record.warn_ban and record.warn_ban <= count:
-            await self._ban_punishment(event.member)
+            self._queue_warn_punishment("BAN", event.member)
 
     @LightningCog.listener()
     async def on_message(self, message):
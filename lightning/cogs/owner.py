@@ -55,6 +55,50 @@ class Owner(*OPTIONAL_FEATURES, *STANDARD_FEATURES):
     async def jsk_pip(self, ctx: LightningContext, *, argument: codeblock_converter):
         return await ctx.invoke(self.jsk_shell, argument=Codeblock(argument.language, "pip3 " + argument.content))
 
+    @Feature.Command(parent="jsk", name="emitters")
+    async def jsk_emitters(self, ctx: LightningContext) -> None:
+        """Shows the queues of the bot's emitters"""
+        emitters = [self.bot._error_logger]
+        modlog = self.bot.get_cog("ModLog")
+        managed = ""
+        if modlog:
+            emitters.extend(modlog.emitters.values())
+            managed = (f" ({modlog.emitters.live_tasks} live ModLog tasks, {modlog.emitters.created} created, "
+                       f"{modlog.emitters.reaped} reaped)")
+
+        emitters.sort(key=lambda e: e.depth, reverse=True)
+        table = [(e.name, f"{e.depth}/{e.maxsize or '∞'}", e.overflow.value, f"{e.stats.enqueued.rate:.2f}",
+                  f"{e.stats.dequeued.rate:.2f}", e.stats.dropped) for e in emitters[:15]]
+        headers = ["Emitter", "Depth", "Overflow", "In/s", "Out/s", "Dropped"]
+        content = formatters.codeblock(tabulate.tabulate(table, headers=headers, tablefmt="psql"), language="")
+        total = sum(e.depth for e in emitters)
+        await ctx.send(f"{len(emitters)} emitters with {total} queued entries{managed}\n{content}")
+
+    @Feature.Command(parent="jsk", name="timers")
+    async def jsk_timers(self, ctx: LightningContext) -> None:
+        """Shows how the timer system is keeping up"""
+        cog = self.bot.get_cog("Reminders")
+        if not cog:
+            await ctx.send("The timer system isn't loaded")
+            return
+
+        metrics = cog.metrics
+        table = []
+        for event in metrics.events:
+            lag, handler = metrics.lag[event], metrics.handlers[event]
+            table.append((event, lag.count, f"{lag.percentile(0.5):.2f}", f"{lag.percentile(0.95):.2f}",
+                          f"{lag.max:.2f}", f"{handler.percentile(0.5) * 1000:.1f}",
+                          f"{handler.percentile(0.95) * 1000:.1f}", metrics.handler_errors[event]))
+        headers = ["Event", "Fired", "Lag p50 (s)", "Lag p95 (s)", "Lag max (s)", "Handler p50 (ms)",
+                   "Handler p95 (ms)", "Errors"]
+        content = formatters.codeblock(tabulate.tabulate(table, headers=headers, tablefmt="psql"), language="")
+
+        database = metrics.database
+        await ctx.send(f"{cog.queue_length} timers queued, {metrics.caught_up} caught up on startup, {metrics.late} "
+                       f"fired over {metrics.lag_threshold}s late\nDatabase per dispatch: "
+                       f"p50 {database.percentile(0.5) * 1000:.1f}ms, p95 {database.percentile(0.95) * 1000:.1f}ms "
+                       f"over {database.count} dispatches\n{content}")
+
     @Feature.Command()
     async def fetchlog(self, ctx: LightningContext) -> None:
         """Sends the log file into the invoking author's DMs"""
@@ -15,11 +15,16 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import asyncio
+import contextlib
+import heapq
 import logging
+import os
+import socket
 import textwrap
+import time
 import traceback
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import asyncpg
 import discord
@@ -30,9 +35,50 @@ from lightning.formatters import plural
 from lightning.models import Timer
 from lightning.utils import time as ltime
 from lightning.utils.helpers import BetterUserObject, dm_user
+from lightning.utils.punishments import EXPIRED_ACTIONS
+from lightning.utils.timermetrics import TimerMetrics
+from lightning.utils.timingwheel import TimingWheel
 
 log: logging.Logger = logging.getLogger(__name__)
 
+# How far ahead timers are loaded into memory
+TIMER_LOOKAHEAD = timedelta(minutes=10)
+# How long a process holds the timers it claimed. Leases are renewed every half lease, so a process that stops
+# renewing hands its timers over to the others once this runs out.
+TIMER_LEASE = timedelta(minutes=2)
+# How many overdue timers are claimed at once when catching up
+CATCH_UP_BATCH_SIZE = 500
+# How many overdue timers of the same event are handled at once when catching up. Timebans and timemutes aren't limited
+# since the expiration queue batches and ratelimits them itself.
+CATCH_UP_CONCURRENCY = 10
+# How often short timers are written to the database
+JOURNAL_INTERVAL = 1.0
+
+# Reminder queries filter on the generated author_id column so they can use timers_reminder_author_id_idx.
+# They're kept here so the bench explain command checks the same queries.
+REMINDER_QUERIES = {
+    "get": """SELECT extra FROM timers
+              WHERE id = $1 AND event = 'reminder' AND author_id = $2;""",
+    "list": """SELECT id, expiry, extra
+               FROM timers
+               WHERE event = 'reminder'
+               AND author_id = $1
+               ORDER BY expiry
+               LIMIT 10;""",
+    "delete": """DELETE FROM timers
+                 WHERE id = $1
+                 AND event = 'reminder'
+                 AND author_id = $2;""",
+    "count": """SELECT COUNT(*)
+                FROM timers
+                WHERE event = 'reminder'
+                AND author_id = $1;""",
+    "clear": """DELETE FROM timers
+                WHERE event = 'reminder'
+                AND author_id = $1
+                RETURNING id;"""
+}
+
 
 class Reminders(LightningCog):
     """Commands that remind you something"""
@@ -40,43 +86,350 @@ class Reminders(LightningCog):
     def __init__(self, bot: LightningBot) -> None:
         super().__init__(bot)
 
-        self.task_available = asyncio.Event()
-        self._current_task = None
+        # Every timer due before _horizon is loaded into the heap as (expiry, id)
+        self._heap: List[Tuple[datetime, int]] = []
+        self._timers: Dict[int, Timer] = {}
+        self._horizon = datetime.min
+        # Timers whose listeners are running, they're deleted once they succeed. Journaled short timers that fired
+        # stay here until their row is deleted.
+        self._fired: Set[int] = set()
+        self._wakeup = asyncio.Event()
+
+        # Timers are leased to one process so several can share the table without firing the same timer twice.
+        # A stable instance name lets a restarted process take its own leases back without waiting for them to expire.
+        timers_config = self.bot.config.get("timers") or {}
+        self.lease_owner: str = timers_config.get("instance") or f"{socket.gethostname()}:{os.getpid()}"
+
+        # Timers that are a minute or less away fire from the wheel instead
+        self.short_timers = TimingWheel(self._fire_short_timers)
+        self.journal_short_timers = timers_config.get("journal_short_timers", True)
+        self.metrics = TimerMetrics(lag_threshold=timers_config.get("lag_alert_threshold", 30.0),
+                                    alert_cooldown=timers_config.get("lag_alert_cooldown", 300.0))
+        # Short timers waiting to be written, ordered like a set
+        self._journal: Dict[Timer, None] = {}
+        self._journaling: Set[Timer] = set()
+        self._fired_while_journaling: Set[Timer] = set()
+        self._journal_deletes: List[int] = []
+        self._journal_task = None
+        # IDs of journaled timers that are waiting in the wheel
+        self._wheel_ids: Set[int] = set()
+
         self.dispatch_jobs = self.bot.loop.create_task(self.do_jobs())
+        self.refill_jobs = self.bot.loop.create_task(self.refill_timers())
 
     def cog_unload(self) -> None:
         self.dispatch_jobs.cancel()
+        self.refill_jobs.cancel()
+        self.short_timers.close()
 
-    async def get_next_timer(self) -> Optional[Timer]:
-        query = """SELECT * FROM timers
-                   WHERE "expiry" < (CURRENT_DATE + $1::interval)
-                   ORDER BY "expiry" LIMIT 1;"""
-        record = await self.bot.pool.fetchrow(query, timedelta(days=24))
-        return Timer.from_record(record) if record else None
+    def _push_timer(self, timer: Timer) -> None:
+        if timer.id in self._timers or timer.id in self._fired or timer.id in self._wheel_ids:
+            return
 
-    async def short_timers(self, seconds: float, record: Timer) -> None:
-        """A short loop for the bot to process small timers."""
-        await asyncio.sleep(seconds)
-        self.bot.dispatch(f'lightning_{record.event}_complete', record)
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, (timer.expiry, timer.id))
+        if self._heap[0][1] == timer.id:
+            # It's the next one due, the dispatcher should sleep less
+            self._wakeup.set()
 
-    async def execute_timer(self, record: Timer) -> None:
-        self.bot.dispatch(f'lightning_{record.event}_complete', record)
-        await self.bot.pool.execute("DELETE FROM timers WHERE id=$1;", record.id)
+    def _remove_timers(self, ids) -> None:
+        # The heap entries are skipped once they come up
+        for _id in ids:
+            self._timers.pop(_id, None)
+            self._wheel_ids.discard(_id)
 
-    async def wait_for_timers(self) -> Optional[Timer]:
-        record = await self.get_next_timer()
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + TIMER_LEASE
 
-        if not record:
-            self.task_available.clear()
-            self._current_task = None
-            await self.task_available.wait()
-            return await self.get_next_timer()
+    async def load_timers(self) -> int:
+        """Claims every unleased timer due within the lookahead window and loads it into the heap.
 
-        self.task_available.set()
-        return record
+        Timers this process already holds have their lease renewed.
+
+        Returns
+        -------
+        int
+            How many timers were loaded
+        """
+        query = """UPDATE timers
+                   SET claimed_by = $1, claimed_until = $2
+                   WHERE id IN (SELECT id FROM timers
+                                WHERE expiry <= $3
+                                AND (claimed_by IS NULL OR claimed_by = $1 OR claimed_until < $4)
+                                FOR UPDATE SKIP LOCKED)
+                   RETURNING *;
+                """
+        now = datetime.utcnow()
+        horizon = now + TIMER_LOOKAHEAD
+        records = await self.bot.pool.fetch(query, self.lease_owner, now + TIMER_LEASE, horizon, now)
+        self._horizon = horizon
+
+        before = len(self._timers)
+        for record in records:
+            self._push_timer(Timer.from_record(record))
+        return len(self._timers) - before
+
+    async def release_timers(self, ids: List[int]) -> None:
+        """Gives up this process' lease on some timers so any process can claim them again"""
+        query = """UPDATE timers
+                   SET claimed_by = NULL, claimed_until = NULL
+                   WHERE id = ANY($1::bigint[]) AND claimed_by = $2;
+                """
+        await self.bot.pool.execute(query, ids, self.lease_owner)
+
+    @property
+    def queue_length(self) -> int:
+        """How many timers are waiting in memory"""
+        return len(self._timers) + len(self.short_timers)
+
+    async def _send_alert(self, content: str) -> None:
+        url = self.bot.config['logging'].get('timer_errors')
+        if not url:
+            return
+
+        webhook = discord.Webhook.from_url(url, session=self.bot.aiosession)
+        try:
+            await webhook.execute(content)
+        except discord.HTTPException as e:
+            log.warning(f"Unable to send a timer alert: {e}")
+
+    async def _run_listeners(self, timer: Timer) -> bool:
+        """Runs a timer's listeners and reports their errors.
+
+        Returns
+        -------
+        bool
+            Whether every listener finished without an error
+        """
+        # The listeners are ran here instead of through dispatch so each one can be timed
+        event = f'lightning_{timer.event}_complete'
+        succeeded = True
+        for listener in self.bot.extra_events.get(f'on_{event}', []):
+            start = time.perf_counter()
+            failed = False
+            try:
+                await listener(timer)
+            except Exception:
+                failed = True
+                succeeded = False
+                await self.bot.on_error(event, timer)
+            finally:
+                self.metrics.record_handler(timer.event, time.perf_counter() - start, failed=failed)
+        return succeeded
+
+    async def _catch_up_timer(self, timer: Timer, semaphores: Dict[str, asyncio.Semaphore]) -> bool:
+        if timer.event in EXPIRED_ACTIONS:
+            return await self._run_listeners(timer)
+
+        async with semaphores.setdefault(timer.event, asyncio.Semaphore(CATCH_UP_CONCURRENCY)):
+            return await self._run_listeners(timer)
+
+    async def _complete_timers(self, timers: List[Timer]) -> None:
+        """Runs the listeners of fired timers and deletes the timers whose listeners succeeded.
+
+        The ones that fail are released so the next refill fires them again. If the process dies before this finishes,
+        the timers are still in the database and get caught up on once their lease runs out.
+        """
+        ids = [timer.id for timer in timers]
+        try:
+            results = await asyncio.gather(*[self._run_listeners(timer) for timer in timers])
+            done = [timer.id for timer, succeeded in zip(timers, results) if succeeded]
+            failed = [timer.id for timer, succeeded in zip(timers, results) if not succeeded]
+
+            start = time.perf_counter()
+            await self.bot.pool.execute("DELETE FROM timers WHERE id = ANY($1::bigint[]) AND claimed_by = $2;", done,
+                                        self.lease_owner)
+            self.metrics.record_database(time.perf_counter() - start)
+
+            if failed:
+                log.warning(f"{len(failed)} timers failed and will be retried")
+                await self.release_timers(failed)
+        except (OSError, asyncpg.PostgresConnectionError, asyncio.TimeoutError) as e:
+            # We still hold them, so the next refill loads them again
+            log.warning(f"Unable to complete {len(timers)} timers: {e}")
+        finally:
+            self._fired.difference_update(ids)
+
+    def _dispatch_timers(self, timers: List[Timer], *, complete: bool = False) -> None:
+        now = datetime.utcnow()
+        late = None
+        for timer in timers:
+            lag = (now - timer.expiry).total_seconds()
+            if self.metrics.record_lag(timer.event, lag):
+                late = (timer, lag)
+
+        if complete:
+            self.bot.loop.create_task(self._complete_timers(timers))
+        else:
+            for timer in timers:
+                self.bot.loop.create_task(self._run_listeners(timer))
+
+        if late is not None:
+            timer, lag = late
+            self.bot.loop.create_task(self._send_alert(
+                f"Timers are running late! A {timer.event} timer (ID: {timer.id}) fired {lag:.1f}s after it expired. "
+                f"{self.queue_length} timers are queued and {len(timers)} fired with it."))
+
+    async def catch_up(self) -> int:
+        """Claims and completes every overdue timer in batches.
+
+        Unlike the usual dispatch, each event type only has ``CATCH_UP_CONCURRENCY`` timers in flight. Expired
+        timebans and timemutes are the exception, a whole batch of them is handed to the expiration queue at once.
+        Timers leased by another live process are left to it.
+
+        A timer is only deleted once its listeners succeed. The ones that fail are released when catching up is done,
+        so the next refill fires them again.
+
+        Returns
+        -------
+        int
+            How many timers were completed
+        """
+        query = """UPDATE timers
+                   SET claimed_by = $1, claimed_until = $2
+                   WHERE id IN (SELECT id FROM timers
+                                WHERE expiry <= $3
+                                AND (claimed_by IS NULL OR claimed_by = $1 OR claimed_until < $3)
+                                AND NOT id = ANY($5::bigint[])
+                                ORDER BY expiry
+                                LIMIT $4
+                                FOR UPDATE SKIP LOCKED)
+                   RETURNING *;
+                """
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Failed timers keep their lease until the end, otherwise the next batch would claim them right back
+        failed: List[int] = []
+        start = time.perf_counter()
+        total = 0
+        while True:
+            now = datetime.utcnow()
+            records = await self.bot.pool.fetch(query, self.lease_owner, now + TIMER_LEASE, now, CATCH_UP_BATCH_SIZE,
+                                                failed)
+            if not records:
+                break
+
+            timers = [Timer.from_record(record) for record in records]
+            results = await asyncio.gather(*[self._catch_up_timer(timer, semaphores) for timer in timers])
+
+            ids = [timer.id for timer, succeeded in zip(timers, results) if succeeded]
+            failed.extend(timer.id for timer, succeeded in zip(timers, results) if not succeeded)
+            await self.bot.pool.execute("DELETE FROM timers WHERE id = ANY($1::bigint[]) AND claimed_by = $2;", ids,
+                                        self.lease_owner)
+
+            total += len(ids)
+            self.metrics.caught_up += len(ids)
+            elapsed = time.perf_counter() - start
+            log.info(f"Caught up on {total} overdue timers in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+
+            if len(records) < CATCH_UP_BATCH_SIZE:
+                break
+
+        if failed:
+            log.warning(f"{len(failed)} overdue timers failed and will be retried")
+            await self.release_timers(failed)
+
+        return total
+
+    async def refill_timers(self) -> None:
+        await self.bot.wait_until_ready()
+        try:
+            await self.catch_up()
+        except (OSError, asyncpg.PostgresConnectionError, asyncio.TimeoutError) as e:
+            log.warning(f"Unable to catch up on overdue timers: {e}")
+
+        while not self.bot.is_closed():
+            try:
+                loaded = await self.load_timers()
+            except (OSError, asyncpg.PostgresConnectionError, asyncio.TimeoutError) as e:
+                log.warning(f"Unable to load timers: {e}")
+            else:
+                if loaded:
+                    log.debug(f"Loaded {loaded} timers into the heap")
+
+            # Refilling also renews our leases, so it has to happen before they run out
+            await asyncio.sleep(TIMER_LEASE.total_seconds() / 2)
+
+    def _fire_short_timers(self, timers: List[Timer]) -> None:
+        fired = []
+        for timer in timers:
+            if timer.id is not None:
+                if timer.id not in self._wheel_ids:  # Deleted
+                    continue
+                self._wheel_ids.discard(timer.id)
+                # Its row is still there until the journal deletes it, so a refill must not load it again
+                self._fired.add(timer.id)
+                self._journal_deletes.append(timer.id)
+            elif timer in self._journal:
+                del self._journal[timer]
+            elif timer in self._journaling:
+                # Its row is being written, delete it once we know its ID
+                self._fired_while_journaling.add(timer)
+
+            fired.append(timer)
+
+        self._dispatch_timers(fired)
+        if self._journal_deletes:
+            self._ensure_journal_task()
+
+    def _ensure_journal_task(self) -> None:
+        if self._journal_task is None or self._journal_task.done():
+            self._journal_task = self.bot.loop.create_task(self._flush_journal())
+
+    async def _flush_journal(self) -> None:
+        """Writes short timers to the database in batches and deletes the ones that fired"""
+        while self._journal or self._journal_deletes:
+            await asyncio.sleep(JOURNAL_INTERVAL)
+
+            timers = list(self._journal)
+            self._journal.clear()
+            deletes, self._journal_deletes = self._journal_deletes, []
+            self._journaling.update(timers)
+
+            inserting = []
+            try:
+                if timers:
+                    ids = await self._reserve_timer_ids(len(timers))
+                    # The wheel owns the IDs before their rows exist, so a refill that sees a row skips it
+                    inserting = [timer for timer in timers if timer not in self._fired_while_journaling]
+                    for timer, _id in zip(inserting, ids):
+                        timer.id = _id
+                        self._wheel_ids.add(_id)
+
+                    if inserting:
+                        await self._insert_timers([(t.event, t.created_at, t.expiry, t.extra) for t in inserting],
+                                                  connection=self.bot.pool, ids=[t.id for t in inserting])
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                # The timers still fire from the wheel, they just won't survive a restart
+                log.warning(f"Unable to journal {len(timers)} short timers: {e}")
+                for timer in inserting:
+                    self._wheel_ids.discard(timer.id)
+                    timer.id = None
+            finally:
+                self._journaling.difference_update(timers)
+                self._fired_while_journaling.difference_update(timers)
+
+            if not deletes:
+                continue
+
+            try:
+                await self.bot.pool.execute("DELETE FROM timers WHERE id = ANY($1::bigint[]);", deletes)
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                log.warning(f"Unable to delete {len(deletes)} fired short timers: {e}")
+                self._journal_deletes.extend(deletes)
+            else:
+                self._fired.difference_update(deletes)
+
+    def _pop_due_timers(self, now: datetime) -> List[Timer]:
+        timers = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _id = heapq.heappop(self._heap)
+            timer = self._timers.pop(_id, None)
+            if timer is not None:
+                timers.append(timer)
+        return timers
 
     async def add_job(self, event: str, created, expiry, *, force_insert=False,
-                      **kwargs) -> Union[asyncpg.Record, asyncio.Task]:
+                      **kwargs) -> Union[int, Timer]:
         """Adds a job/pending timer to the timer system
 
         Parameters
@@ -91,49 +444,146 @@ class Reminders(LightningCog):
             Whether to insert into the database regardless of how long the expiry is. Defaults to False
         **kwargs
             Keyword arguments about the event that are passed to the database
+
+        Returns
+        -------
+        Union[int, Timer]
+            The ID of the timer or the timer itself if it's a short timer
         """
         created = ltime.strip_tzinfo(created)
         expiry = ltime.strip_tzinfo(expiry)  # Just in case
 
         delta = (expiry - created).total_seconds()
         if delta <= 60 and force_insert is False:
-            # A loop for small timers
-            return self.bot.loop.create_task(self.short_timers(delta, Timer(None, event, created, expiry, kwargs)))
-
+            timer = Timer(None, event, created, expiry, kwargs)
+            self.short_timers.schedule(timer, (expiry - datetime.utcnow()).total_seconds())
+            if self.journal_short_timers:
+                self._journal[timer] = None
+                self._ensure_journal_task()
+            return timer
+
+        # Timers that go straight into our heap are claimed with the insert
+        claimed = expiry <= self._horizon
+        lease = (self.lease_owner, self._lease_until()) if claimed else (None, None)
         if kwargs:
-            query = """INSERT INTO timers (event, created, expiry, extra)
-                       VALUES ($1, $2, $3, $4::jsonb)
+            query = """INSERT INTO timers (event, created, expiry, extra, claimed_by, claimed_until)
+                       VALUES ($1, $2, $3, $4::jsonb, $5, $6)
                        RETURNING id;"""
-            args = [event, created, expiry, kwargs]
+            args = [event, created, expiry, kwargs, *lease]
         else:
-            query = """INSERT INTO timers (event, created, expiry)
-                       VALUES ($1, $2, $3)
+            query = """INSERT INTO timers (event, created, expiry, claimed_by, claimed_until)
+                       VALUES ($1, $2, $3, $4, $5)
                        RETURNING id;"""
-            args = [event, created, expiry]
+            args = [event, created, expiry, *lease]
 
         record = await self.bot.pool.fetchval(query, *args)
+        if claimed:
+            self._push_timer(Timer(record, event, created, expiry, kwargs or None))
+        return record
 
-        if delta <= (86400 * 24):  # 24 days
-            self.task_available.set()
+    async def _reserve_timer_ids(self, amount: int) -> List[int]:
+        query = "SELECT nextval(pg_get_serial_sequence('timers', 'id')) FROM generate_series(1, $1);"
+        records = await self.bot.pool.fetch(query, amount)
+        return [record[0] for record in records]
+
+    async def _insert_timers(self, jobs: List[Tuple[str, Any, Any, dict]], *, connection,
+                             ids: Optional[List[int]] = None) -> List[int]:
+        # Timers this process will fire itself are claimed with the insert. That's everything in the heap's window and
+        # short timers that fire from the wheel.
+        # IDs from _reserve_timer_ids can be given, otherwise new ones are drawn
+        lease_until = self._lease_until().isoformat()
+        data = []
+        for index, (event, created, expiry, extra) in enumerate(jobs):
+            expiry = ltime.strip_tzinfo(expiry)
+            claimed = expiry <= max(self._horizon, datetime.utcnow() + TIMER_LEASE)
+            data.append({"id": ids[index] if ids else None, "event": event,
+                         "created": ltime.strip_tzinfo(created).isoformat(), "expiry": expiry.isoformat(),
+                         "extra": extra or None,
+                         "claimed_by": self.lease_owner if claimed else None,
+                         "claimed_until": lease_until if claimed else None})
+
+        query = """INSERT INTO timers (id, event, created, expiry, extra, claimed_by, claimed_until)
+                   SELECT COALESCE(data.id, nextval(pg_get_serial_sequence('timers', 'id'))),
+                          data.event, data.created, data.expiry, data.extra, data.claimed_by, data.claimed_until
+                   FROM jsonb_to_recordset($1::jsonb) AS
+                   data(id BIGINT, event TEXT, created TIMESTAMP, expiry TIMESTAMP, extra JSONB, claimed_by TEXT,
+                        claimed_until TIMESTAMP)
+                   RETURNING id;
+                """
+        records = await connection.fetch(query, data)
+        return [record['id'] for record in records]
 
-        if self._current_task and expiry < self._current_task.expiry:
-            # Cancel the task and re-run it
-            self.dispatch_jobs.cancel()
-            self.dispatch_jobs = self.bot.loop.create_task(self.do_jobs())
+    async def add_jobs(self, jobs: List[Tuple[str, Any, Any, dict]], *, connection=None) -> List[int]:
+        """Adds many jobs to the timer system with one query.
 
-        return record
+        Unlike :meth:`add_job`, short jobs are always inserted into the database.
+
+        Parameters
+        ----------
+        jobs : List[Tuple[str, datetime.datetime, datetime.datetime, dict]]
+            The event, creation, expiry and extra of each job
+        connection : optional
+            The connection to use. Defaults to the pool.
+
+        Returns
+        -------
+        List[int]
+            The IDs of the new timers, in the same order as the jobs given.
+        """
+        if not jobs:
+            return []
+
+        ids = await self._insert_timers(jobs, connection=connection or self.bot.pool)
+        for _id, (event, created, expiry, extra) in zip(ids, jobs):
+            expiry = ltime.strip_tzinfo(expiry)
+            if expiry <= self._horizon:
+                self._push_timer(Timer(_id, event, ltime.strip_tzinfo(created), expiry, extra or None))
+
+        return ids
+
+    async def _wait_for_next_timer(self) -> None:
+        self._wakeup.clear()
+        if self._heap:
+            timeout = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if timeout <= 0:
+                return
+        else:
+            timeout = None
+
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
 
     async def do_jobs(self) -> None:
         await self.bot.wait_until_ready()
         try:
             while not self.bot.is_closed():
-                timer = self._current_task = await self.wait_for_timers()
-                current_time = datetime.utcnow()
-                if timer.expiry >= current_time:
-                    tmp = (timer.expiry - current_time).total_seconds()
-                    await asyncio.sleep(tmp)
-                # Dispatch the job and delete it.
-                await self.execute_timer(timer)
+                await self._wait_for_next_timer()
+
+                timers = self._pop_due_timers(datetime.utcnow())
+                if not timers:
+                    continue
+
+                ids = [timer.id for timer in timers]
+                self._fired.update(ids)
+                # Only timers we still hold are fired. The rest were deleted by their author or taken over by another
+                # process after our lease ran out. The lease is renewed so it outlasts the listeners.
+                query = """UPDATE timers
+                           SET claimed_until = $3
+                           WHERE id = ANY($1::bigint[]) AND claimed_by = $2
+                           RETURNING *;
+                        """
+                start = time.perf_counter()
+                try:
+                    records = await self.bot.pool.fetch(query, ids, self.lease_owner, self._lease_until())
+                except BaseException:
+                    self._fired.difference_update(ids)
+                    raise
+                self.metrics.record_database(time.perf_counter() - start)
+
+                held = {record['id'] for record in records}
+                self._fired.difference_update(_id for _id in ids if _id not in held)
+                if records:
+                    self._dispatch_timers([Timer.from_record(record) for record in records], complete=True)
         except asyncio.CancelledError:
             raise
         except (discord.ConnectionClosed, asyncpg.PostgresConnectionError):
@@ -141,8 +591,7 @@ class Reminders(LightningCog):
             self.dispatch_jobs = self.bot.loop.create_task(self.do_jobs())
         except Exception:
             log.error(traceback.format_exc())
-            webhook = discord.Webhook.from_url(self.bot.config['logging']['timer_errors'], session=self.bot.aiosession)
-            await webhook.execute(f"Timers has Errored!\n```{traceback.format_exc()}```")
+            await self._send_alert(f"Timers has Errored!\n```{traceback.format_exc()}```")
 
     @group(usage="<when>", aliases=["reminder"], invoke_without_command=True)
     async def remind(self, ctx: LightningContext, *,
@@ -173,9 +622,7 @@ class Reminders(LightningCog):
     # remind hide/show
     async def reminder_toggler(self, ctx: LightningContext, reminder_id: int, secret: bool) -> None:
         """Marks or unmarks a reminder from the secret status"""
-        query = """SELECT extra FROM timers WHERE id=$1 AND event = 'reminder'
-                   AND extra ->> 'author' = $2;"""
-        record = await self.bot.pool.fetchval(query, reminder_id, str(ctx.author.id))
+        record = await self.bot.pool.fetchval(REMINDER_QUERIES['get'], reminder_id, ctx.author.id)
 
         if not record:
             await ctx.send("Could not find a reminder with that id.")
@@ -185,9 +632,8 @@ class Reminders(LightningCog):
 
         await self.bot.pool.execute("UPDATE timers SET extra=$1 WHERE id=$2;", record, reminder_id)
 
-        if self._current_task and reminder_id == self._current_task.id:
-            # It's probably better to re-run it again.
-            self._current_task.extra = record
+        if reminder_id in self._timers:
+            self._timers[reminder_id].extra = record
 
         if secret:
             await ctx.send(f"Marked {reminder_id} as secret")
@@ -226,14 +672,7 @@ class Reminders(LightningCog):
         """Lists up to 10 of your reminders
 
         This will only show reminders that are longer than one minute."""
-        query = """SELECT id, expiry, extra
-                   FROM timers
-                   WHERE event = 'reminder'
-                   AND extra ->> 'author' = $1
-                   ORDER BY expiry
-                   LIMIT 10;
-                """
-        records = await self.bot.pool.fetch(query, str(ctx.author.id))
+        records = await self.bot.pool.fetch(REMINDER_QUERIES['list'], ctx.author.id)
 
         if len(records) == 0:
             await ctx.send("Seems you haven't set a reminder yet...")
@@ -249,32 +688,19 @@ class Reminders(LightningCog):
         You can get the ID of a reminder with {prefix}remind list
 
         You must own the reminder to remove it"""
-        query = """DELETE FROM timers
-                   WHERE id = $1
-                   AND event = 'reminder'
-                   AND extra ->> 'author' = $2;
-                """
-        result = await self.bot.pool.execute(query, reminder_id, str(ctx.author.id))
+        result = await self.bot.pool.execute(REMINDER_QUERIES['delete'], reminder_id, ctx.author.id)
         if result == "DELETE 0":
             await ctx.send("I couldn't delete a reminder with that ID!")
             return
 
-        if self._current_task and self._current_task.id == reminder_id:
-            # Matches current timer, re-run loop as it's gone
-            self.dispatch_jobs.cancel()
-            self.dispatch_jobs = self.bot.loop.create_task(self.do_jobs())
+        self._remove_timers([reminder_id])
 
         await ctx.send(f"Successfully deleted reminder (ID: {reminder_id})")
 
     @remind.command(name='clear')
     async def clear_reminders(self, ctx: LightningContext) -> None:
         """Clears all of your reminders"""
-        queryc = """SELECT COUNT(*)
-                    FROM timers
-                    WHERE event = 'reminder'
-                    AND extra ->> 'author' = $1
-                """
-        count = await self.bot.pool.fetchval(queryc, str(ctx.author.id))
+        count = await self.bot.pool.fetchval(REMINDER_QUERIES['count'], ctx.author.id)
 
         if count == 0:
             await ctx.send("You don't have any reminders that I can delete")
@@ -285,18 +711,8 @@ class Reminders(LightningCog):
             await ctx.send("Cancelled")
             return
 
-        query = """DELETE FROM timers
-                   WHERE event = 'reminder'
-                   AND extra ->> 'author' = $1
-                   RETURNING id;
-                """
-        records = await self.bot.pool.fetch(query, str(ctx.author.id))
-        ids = [r['id'] for r in records]
-
-        if self._current_task.event == 'reminder' and self._current_task.id in ids:
-            # cancel task
-            self.dispatch_jobs.cancel()
-            self.dispatch_jobs = self.bot.loop.create_task(self.do_jobs())
+        records = await self.bot.pool.fetch(REMINDER_QUERIES['clear'], ctx.author.id)
+        self._remove_timers(r['id'] for r in records)
 
         await ctx.send("Cleared all of your reminders.")
 
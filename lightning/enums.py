@@ -44,6 +44,8 @@ class ConfigFlags(BaseFlags):
     role_reapply = 1 << 1
     # Reapplies punishments only.
     role_reapply_punishments_only = 1 << 2
+    # Sends logging through webhooks instead of the bot
+    webhook_logging = 1 << 3
 
 
 class ModFlags(BaseFlags):
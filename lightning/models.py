@@ -14,7 +14,8 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-from typing import Optional, Union
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
 
 import discord
 
@@ -32,7 +33,7 @@ ConfigFlags = ConfigBFlags
 
 class GuildModConfig:
     __slots__ = ("guild_id", "mute_role_id", "warn_kick", "warn_ban", "temp_mute_role_id", "flags",
-                 "automod")
+                 "automod", "raid_mode")
 
     def __init__(self, record):
         self.guild_id = record['guild_id']
@@ -43,7 +44,7 @@ class GuildModConfig:
         self.flags = ModFlags(record['flags'] or 0)
         self.automod = None
         # self.automod = AutoModConfig(record)
-        # self.raid_mode = record['raid_mode']
+        self.raid_mode = AutoModRaidModeConfig(record)
 
     def get_mute_role(self, ctx: LightningContext) -> discord.Role:
         if not self.mute_role_id:
@@ -81,11 +82,19 @@ class AutoModConfig:
 
 
 class AutoModRaidModeConfig:
+    __slots__ = ("users", "seconds", "punishment", "active")
+
     def __init__(self, record):
-        self.config = AutoModPunishmentConfig(record['punishments_config'])
         # X amount of users can join in Y seconds, if more than act.
         self.users = record['automod_join_threshold_users']
         self.seconds = record['automod_join_threshold_seconds']
+        self.punishment = PunishmentType(record['automod_raid_punishment'] or PunishmentType.KICK.value)
+        # Manually enabled raid mode
+        self.active = record['raid_mode'] or False
+
+    @property
+    def detection_enabled(self) -> bool:
+        return bool(self.users and self.seconds)
 
 
 class AutoModMentionConfig:
@@ -106,26 +115,40 @@ class AutoModPunishmentConfig:
 
 
 class LoggingConfig:
-    __slots__ = ('logging')
+    __slots__ = ('logging', '_features')
 
     def __init__(self, records):
         self.logging = {}
         for record in records:
             self.logging[record['channel_id']] = {"types": LoggingType(record['types']),
                                                   "format": record['format']}
+        self._build_index()
+
+    def _build_index(self) -> None:
+        # Maps each LoggingType bit to the channels that log it
+        features = {}
+        for channel_id, value in self.logging.items():
+            types = int(value['types'])
+            while types:
+                bit = types & -types
+                features.setdefault(bit, []).append((channel_id, value))
+                types ^= bit
+
+        self._features = {bit: tuple(channels) for bit, channels in features.items()}
 
-    def get_channels_with_feature(self, feature) -> list:
-        channels = []
-        for key, value in list(self.logging.items()):
-            if feature in value['types']:
-                channels.append((key, value))
-        return channels
+    def get_channels_with_feature(self, feature) -> Tuple[Tuple[int, dict], ...]:
+        bits = int(feature)
+        if bits & (bits - 1) == 0:  # A single feature
+            return self._features.get(bits, ())
+
+        return tuple((key, value) for key, value in self.logging.items() if feature in value['types'])
 
     def get(self, key):
         return self.logging.get(key, None)
 
     def remove(self, key):
         del self.logging[key]
+        self._build_index()
 
 
 class CommandOverrides:
@@ -393,6 +416,75 @@ class Action:
     def is_logged(self):
         return bool(self.infraction_id)
 
+    def to_record(self) -> dict:
+        """Returns the action as a dict that can be used for a bulk insert"""
+        return {"guild_id": self.guild_id, "user_id": self.target.id, "moderator_id": self.moderator.id,
+                "action": self.action.value, "reason": self.reason,
+                "created_at": strip_tzinfo(self.timestamp).isoformat(),
+                "expiry": strip_tzinfo(self.expiry).isoformat() if self.expiry else None,
+                "extra": self.kwargs or None}
+
     @property
     def event(self):
         return self.action.upper()
+
+
+async def bulk_add_infractions(connection, actions: List[Action]) -> List[int]:
+    """Inserts many infractions into the database with one query.
+
+    Each action gets its infraction_id set, so it won't be inserted again when it's logged.
+
+    Returns
+    -------
+    List[int]
+        The IDs of the newly created infractions
+    """
+    if not actions:
+        return []
+
+    query = """INSERT INTO infractions (guild_id, user_id, moderator_id, action, reason, created_at, expiry, extra)
+               SELECT data.guild_id, data.user_id, data.moderator_id, data.action, data.reason, data.created_at,
+                      data.expiry, data.extra
+               FROM jsonb_to_recordset($1::jsonb) AS
+               data(guild_id BIGINT, user_id BIGINT, moderator_id BIGINT, action INT, reason TEXT,
+                    created_at TIMESTAMP, expiry TIMESTAMP, extra JSONB)
+               RETURNING id;
+            """
+    records = await connection.fetch(query, [action.to_record() for action in actions])
+    ids = [record['id'] for record in records]
+
+    for action, _id in zip(actions, ids):
+        action.infraction_id = _id
+
+    return ids
+
+
+async def bulk_deactivate_infractions(connection, entries: List[Tuple[int, int, datetime, int]]) -> List[int]:
+    """Marks many timed infractions as inactive with one query.
+
+    Like :meth:`Action.add_infraction`, expiry datetimes are stripped of tzinfo.
+
+    Parameters
+    ----------
+    entries : List[Tuple[int, int, datetime, int]]
+        The guild ID, user ID, expiry and action of each infraction
+
+    Returns
+    -------
+    List[int]
+        The IDs of the infractions that were deactivated
+    """
+    if not entries:
+        return []
+
+    query = """UPDATE infractions SET active=false
+               FROM unnest($1::bigint[], $2::bigint[], $3::timestamp[], $4::int[])
+                   AS data(guild_id, user_id, expiry, action)
+               WHERE infractions.guild_id = data.guild_id AND infractions.user_id = data.user_id
+               AND infractions.expiry = data.expiry AND infractions.action = data.action
+               RETURNING infractions.id;
+            """
+    guild_ids, user_ids, expiries, actions = (list(column) for column in zip(*entries))
+    expiries = [strip_tzinfo(expiry) for expiry in expiries]
+    records = await connection.fetch(query, guild_ids, user_ids, expiries, actions)
+    return [record['id'] for record in records]
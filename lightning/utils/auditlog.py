@@ -0,0 +1,182 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import collections
+import logging
+from datetime import timedelta
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import discord
+
+log = logging.getLogger(__name__)
+
+EntryCheck = Callable[[discord.AuditLogEntry], bool]
+
+
+class _Waiter(NamedTuple):
+    action: discord.AuditLogAction
+    target_id: Optional[int]
+    check: Optional[EntryCheck]
+    future: asyncio.Future
+    attempts: List[int]  # A list so it can be counted down in place
+
+
+class AuditLogPoller:
+    """Fetches a guild's audit log once per window for every event that's waiting on it.
+
+    Recent entries are kept in a ring buffer indexed by (action, target ID), so events that arrive after their entry
+    was fetched are resolved without another request.
+
+    Parameters
+    ----------
+    guild : discord.Guild
+        The guild to poll
+    window : float
+        How long to wait for other events before fetching
+    max_age : float
+        How old an entry can be before it's no longer matched
+    size : int
+        How many entries the buffer holds
+    attempts : int
+        How many fetches an event waits through before giving up. The audit log can lag behind gateway events.
+    """
+    def __init__(self, guild: discord.Guild, *, window: float = 0.5, max_age: float = 10.0, size: int = 200,
+                 attempts: int = 2):
+        self.guild = guild
+        self.window = window
+        self.max_age = timedelta(seconds=max_age)
+        self.size = size
+        self.attempts = attempts
+        self.requests = 0
+
+        self._entries: Deque[discord.AuditLogEntry] = collections.deque()
+        self._index: Dict[Tuple[discord.AuditLogAction, Optional[int]], List[discord.AuditLogEntry]] = {}
+        self._newest_id = 0
+        self._waiters: List[_Waiter] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(action: discord.AuditLogAction, target_id: Optional[int]) -> Tuple[discord.AuditLogAction, Optional[int]]:
+        return (action, target_id)
+
+    def _add(self, entry: discord.AuditLogEntry) -> None:
+        if len(self._entries) >= self.size:
+            self._evict()
+
+        self._entries.append(entry)
+        key = self._key(entry.action, getattr(entry.target, "id", None))
+        self._index.setdefault(key, []).append(entry)
+
+    def _evict(self) -> None:
+        entry = self._entries.popleft()
+        key = self._key(entry.action, getattr(entry.target, "id", None))
+        entries = self._index.get(key)
+        if entries:
+            entries.remove(entry)
+            if not entries:
+                del self._index[key]
+
+    def _prune(self) -> None:
+        cutoff = discord.utils.utcnow() - self.max_age
+        while self._entries and self._entries[0].created_at < cutoff:
+            self._evict()
+
+    def lookup(self, action: discord.AuditLogAction, target_id: Optional[int], *,
+               check: Optional[EntryCheck] = None) -> Optional[discord.AuditLogEntry]:
+        """Finds the newest buffered entry for an action and target"""
+        cutoff = discord.utils.utcnow() - self.max_age
+        for entry in reversed(self._index.get(self._key(action, target_id), ())):
+            if entry.created_at < cutoff:
+                break
+
+            if check is None or check(entry):
+                return entry
+
+    async def find(self, action: discord.AuditLogAction, target_id: Optional[int], *,
+                   check: Optional[EntryCheck] = None) -> Optional[discord.AuditLogEntry]:
+        """Waits for the audit log entry of an action.
+
+        Parameters
+        ----------
+        action : discord.AuditLogAction
+            The action to look for
+        target_id : Optional[int]
+            The ID of the action's target
+        check : Optional[EntryCheck]
+            An extra check the entry has to pass
+
+        Returns
+        -------
+        Optional[discord.AuditLogEntry]
+            The entry or None if it didn't show up
+        """
+        entry = self.lookup(action, target_id, check=check)
+        if entry is not None:
+            return entry
+
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append(_Waiter(action, target_id, check, future, [self.attempts]))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+        return await future
+
+    async def _fetch(self) -> None:
+        self.requests += 1
+        cutoff = discord.utils.utcnow() - self.max_age
+        entries = []
+        # Entries come newest first, stop at what we already have
+        async for entry in self.guild.audit_logs(limit=self.size):
+            if entry.id <= self._newest_id or entry.created_at < cutoff:
+                break
+            entries.append(entry)
+
+        for entry in reversed(entries):
+            self._add(entry)
+
+        if entries:
+            self._newest_id = entries[0].id
+
+    def _resolve(self, *, final: bool = False) -> None:
+        waiters = []
+        for waiter in self._waiters:
+            if waiter.future.done():
+                continue
+
+            entry = self.lookup(waiter.action, waiter.target_id, check=waiter.check)
+            waiter.attempts[0] -= 1
+            if entry is not None or waiter.attempts[0] <= 0 or final:
+                waiter.future.set_result(entry)
+            else:
+                waiters.append(waiter)
+
+        self._waiters = waiters
+
+    async def _poll_loop(self) -> None:
+        try:
+            while self._waiters:
+                await asyncio.sleep(self.window)
+                self._prune()
+                try:
+                    await self._fetch()
+                except discord.HTTPException as e:
+                    log.debug(f"Unable to fetch the audit log of {self.guild.id}: {e}")
+                    self._resolve(final=True)
+                    continue
+                self._resolve()
+        finally:
+            # Nobody should wait forever if the loop dies
+            self._resolve(final=True)
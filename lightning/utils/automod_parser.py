@@ -15,7 +15,7 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 from enum import IntEnum
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 import discord
 from discord.ext.commands import BadArgument
@@ -70,6 +70,13 @@ class BaseTableModel(BaseModel):
     punishment: AutomodPunishmentModel
 
 
+class AutomodIgnoresModel(BaseModel):
+    type: Literal["ignores"]
+    channels: List[int] = []
+    categories: List[int] = []
+    roles: List[int] = []
+
+
 class MessageSpamModel(BaseTableModel):
     seconds: float
 
@@ -93,6 +100,12 @@ def parse_config(key: str, value):
     if key == "mass-mentions":
         return BaseTableModel(type=key, **value)
 
+    if key == "ignores":
+        try:
+            return AutomodIgnoresModel(type=key, **value)
+        except ValidationError as e:
+            raise ConfigurationError(f'Unable to parse key "{key}".\n{" ".join([e["msg"] for e in e.errors()])}')
+
     try:
         return MessageSpamModel(type=key, **value)
     except ValidationError as e:
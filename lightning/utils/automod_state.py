@@ -0,0 +1,237 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from aredis import StrictRedis
+from aredis.exceptions import NoScriptError
+from discord.ext.commands.cooldowns import Cooldown
+
+log = logging.getLogger(__name__)
+
+
+class BucketUpdate(NamedTuple):
+    """A single hit against an automod bucket"""
+    key: str
+    rate: int
+    per: float
+
+
+class AutomodStateStore:
+    """Base class for where automod keeps its spam windows.
+
+    A bucket is a fixed window that starts with the first hit against it. It's ratelimited once there have been
+    more than ``rate`` hits within ``per`` seconds, which is the same behaviour as :class:`Cooldown`.
+    """
+
+    async def update_many(self, updates: Sequence[BucketUpdate], *, now: Optional[float] = None) -> List[bool]:
+        """Records a hit against each bucket.
+
+        Parameters
+        ----------
+        updates : Sequence[BucketUpdate]
+            The buckets to update
+        now : Optional[float]
+            The timestamp of the hit. Defaults to the current time.
+
+        Returns
+        -------
+        List[bool]
+            Whether each bucket is ratelimited, in the same order as the updates given.
+        """
+        raise NotImplementedError
+
+    async def update(self, key: str, rate: int, per: float, *, now: Optional[float] = None) -> bool:
+        """Records a hit against a single bucket"""
+        results = await self.update_many([BucketUpdate(key, rate, per)], now=now)
+        return results[0]
+
+    async def reset_many(self, keys: Sequence[str]) -> None:
+        """Resets buckets"""
+        raise NotImplementedError
+
+    async def reset(self, key: str) -> None:
+        await self.reset_many([key])
+
+    async def clear(self, prefix: str) -> None:
+        """Removes every bucket whose key starts with prefix"""
+        raise NotImplementedError
+
+
+class MemoryAutomodState(AutomodStateStore):
+    """Keeps automod buckets in process memory.
+
+    This is the default. Buckets survive automod config reloads, but not restarts.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Cooldown] = {}
+        self._last_cleanup = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _cleanup(self, now: float) -> None:
+        # Same idea as CooldownMapping, although we only sweep once a second rather than on every hit.
+        if now - self._last_cleanup < 1.0:
+            return
+
+        self._last_cleanup = now
+        expired = [k for k, v in self._buckets.items() if now > v._last + v.per]
+        for key in expired:
+            del self._buckets[key]
+
+    def _update(self, update: BucketUpdate, now: float) -> bool:
+        bucket = self._buckets.get(update.key)
+        if bucket is None or bucket.rate != update.rate or bucket.per != update.per:
+            bucket = self._buckets[update.key] = Cooldown(update.rate, update.per)
+        return bool(bucket.update_rate_limit(now))
+
+    async def update_many(self, updates: Sequence[BucketUpdate], *, now: Optional[float] = None) -> List[bool]:
+        now = now or time.time()
+        self._cleanup(now)
+        return [self._update(update, now) for update in updates]
+
+    async def reset_many(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self._buckets.pop(key, None)
+
+    async def clear(self, prefix: str) -> None:
+        for key in [k for k in self._buckets if k.startswith(prefix)]:
+            del self._buckets[key]
+
+
+# Increments every key and starts its window on the first hit. Every bucket in the batch is handled in one
+# atomic call, so shard processes sharing the same redis all see the same window.
+INCREMENT_SCRIPT = """
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local count = redis.call('INCR', key)
+    if count == 1 then
+        redis.call('PEXPIRE', key, ARGV[i])
+    end
+    counts[i] = count
+end
+return counts
+"""
+INCREMENT_SCRIPT_SHA = hashlib.sha1(INCREMENT_SCRIPT.encode()).hexdigest()
+
+
+class RedisAutomodState(AutomodStateStore):
+    """Keeps automod buckets in redis.
+
+    Buckets survive restarts and are shared by every process connected to the same redis database.
+
+    Updates that come in during the same loop iteration (i.e. a burst of messages) are sent to redis as a single
+    script call. If redis stops responding, buckets fall back to process memory until it comes back.
+
+    Parameters
+    ----------
+    redis : StrictRedis
+        The redis client to use
+    prefix : str
+        The prefix to put in front of every key
+    """
+
+    def __init__(self, redis: StrictRedis, *, prefix: str = "lightning:automod:", loop=None):
+        self.redis = redis
+        self.prefix = prefix
+        self.loop = loop or asyncio.get_event_loop()
+        self.fallback = MemoryAutomodState()
+        self._pending: List[Tuple[List[BucketUpdate], float, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    async def _run_script(self, keys: List[str], args: List[int]) -> List[int]:
+        try:
+            return await self.redis.evalsha(INCREMENT_SCRIPT_SHA, len(keys), *keys, *args)
+        except NoScriptError:
+            # EVAL caches the script for next time.
+            return await self.redis.eval(INCREMENT_SCRIPT, len(keys), *keys, *args)
+
+    def _schedule_flush(self) -> None:
+        self._flush_handle = None
+        batch, self._pending = self._pending, []
+        self.loop.create_task(self._flush(batch))
+
+    async def _flush(self, batch: List[Tuple[List[BucketUpdate], float, asyncio.Future]]) -> None:
+        try:
+            await self._flush_batch(batch)
+        except BaseException as e:
+            # Nothing else resolves these, so every automod check waiting on them would hang
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+
+            if not isinstance(e, Exception):
+                raise
+            log.exception(f"Failed to flush {len(batch)} automod bucket updates")
+
+    async def _flush_batch(self, batch: List[Tuple[List[BucketUpdate], float, asyncio.Future]]) -> None:
+        keys = []
+        args = []
+        for updates, _, _ in batch:
+            for update in updates:
+                keys.append(self.prefix + update.key)
+                args.append(max(1, int(update.per * 1000)))
+
+        try:
+            counts = await self._run_script(keys, args)
+        except Exception as e:
+            log.warning(f"Failed to update {len(keys)} automod buckets in redis, using memory instead. ({e!r})")
+            for updates, now, fut in batch:
+                if not fut.done():
+                    fut.set_result(await self.fallback.update_many(updates, now=now))
+            return
+
+        counts = iter(counts)
+        for updates, _, fut in batch:
+            results = [int(next(counts)) > update.rate for update in updates]
+            if not fut.done():
+                fut.set_result(results)
+
+    async def update_many(self, updates: Sequence[BucketUpdate], *, now: Optional[float] = None) -> List[bool]:
+        if not updates:
+            return []
+
+        fut = self.loop.create_future()
+        self._pending.append((list(updates), now or time.time(), fut))
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_soon(self._schedule_flush)
+
+        return await fut
+
+    async def reset_many(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+
+        await self.fallback.reset_many(keys)
+        try:
+            await self.redis.delete(*[self.prefix + key for key in keys])
+        except Exception as e:
+            log.warning(f"Failed to reset automod buckets in redis ({e!r})")
+
+    async def clear(self, prefix: str) -> None:
+        await self.fallback.clear(prefix)
+        try:
+            keys = [key async for key in self.redis.scan_iter(match=f"{self.prefix}{prefix}*")]
+            if keys:
+                await self.redis.delete(*keys)
+        except Exception as e:
+            log.warning(f"Failed to clear automod buckets in redis ({e!r})")
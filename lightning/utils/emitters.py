@@ -15,20 +15,383 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import asyncio
+import enum
+import functools
+import json
 import logging
+import math
+import re
+import time
+import uuid
+from typing import (Any, Awaitable, Callable, Dict, FrozenSet, List, Optional,
+                    Tuple)
 
 import aiohttp
 import discord
 
+from lightning.utils.outbox import Outbox
+from lightning.utils.ratelimits import RatelimitTracker
+
 log = logging.getLogger(__name__)
 
+USER_MENTION_REGEX = re.compile(r"<@!?(\d+)>")
+MAX_CONTENT_LENGTH = 2000
+MAX_EMBEDS = 10
+# The entry keys that can be written to an outbox
+OUTBOX_KEYS = ("content", "embed", "embeds", "allowed_mentions")
+# How long to wait before retrying a send that failed with a transient error. It doubles with every failure.
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+
+def _allowed_user_ids(allowed_mentions: Optional[discord.AllowedMentions]) -> Optional[FrozenSet[int]]:
+    """Returns the user IDs an entry is allowed to mention.
+
+    None is returned if the entry allows more than a list of users, which means it can't be merged with others."""
+    if allowed_mentions is None:
+        return frozenset()
+
+    if allowed_mentions.everyone is True or allowed_mentions.roles is True:
+        return None
+
+    if isinstance(allowed_mentions.roles, (list, tuple)):
+        return None
+
+    if isinstance(allowed_mentions.users, (list, tuple)):
+        return frozenset(user.id for user in allowed_mentions.users)
+
+    return frozenset() if allowed_mentions.users is False else None
+
+
+def _allowed_mentions_to_dict(allowed_mentions: discord.AllowedMentions) -> Dict[str, Any]:
+    # AllowedMentions.to_dict() can't tell explicit values apart from the defaults the bot's settings fill in
+    data = {}
+    for attr in ("everyone", "users", "roles", "replied_user"):
+        value = getattr(allowed_mentions, attr)
+        if isinstance(value, (list, tuple)):
+            data[attr] = [obj.id for obj in value]
+        elif isinstance(value, bool):
+            data[attr] = value
+    return data
+
+
+def _allowed_mentions_from_dict(data: Dict[str, Any]) -> discord.AllowedMentions:
+    kwargs = {attr: [discord.Object(x) for x in value] if isinstance(value, list) else value
+              for attr, value in data.items()}
+    return discord.AllowedMentions(**kwargs)
+
+
+class _TextBatch:
+    __slots__ = ("lines", "length", "allowed", "entries", "indices")
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.length = 0
+        self.allowed: FrozenSet[int] = frozenset()
+        # (mentioned user IDs, allowed user IDs) for every entry in the batch
+        self.entries = []
+        # Where each entry was in the items being coalesced
+        self.indices: List[int] = []
+
+    def can_add(self, content: str, mentioned: FrozenSet[int], allowed: FrozenSet[int]) -> bool:
+        if self.length + len(content) + 1 > MAX_CONTENT_LENGTH:
+            return False
+
+        union = self.allowed | allowed
+        # Merging must not let an entry ping someone it didn't allow pinging.
+        if (mentioned & union) - allowed:
+            return False
+        return all(not ((m & union) - a) for m, a in self.entries)
+
+    def add(self, content: str, mentioned: FrozenSet[int], allowed: FrozenSet[int], index: int) -> None:
+        self.length += len(content) + (1 if self.lines else 0)
+        self.lines.append(content)
+        self.allowed |= allowed
+        self.entries.append((mentioned, allowed))
+        self.indices.append(index)
+
+    def to_payload(self) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"content": "\n".join(self.lines)}
+        if self.allowed:
+            payload['allowed_mentions'] = discord.AllowedMentions(users=[discord.Object(id=i) for i in self.allowed])
+        return payload
+
+
+def group_messages(items: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[int]]]:
+    """Merges queued messages into as few sends as possible while keeping their order.
+
+    Consecutive text-only entries are joined by newlines up to 2,000 characters. Consecutive embed-only entries are
+    grouped up to 10 embeds per send. Anything else (files, views, content with an embed...) is sent as is.
+
+    Returns
+    -------
+    List[Tuple[Dict[str, Any], List[int]]]
+        Each send and the indices of the items that went into it
+    """
+    payloads = []
+    text: Optional[_TextBatch] = None
+    embeds: List[discord.Embed] = []
+    embed_indices: List[int] = []
+
+    def flush():
+        nonlocal text, embeds, embed_indices
+        if text is not None:
+            payloads.append((text.to_payload(), text.indices))
+            text = None
+        if embeds:
+            payloads.append(({"embeds": embeds}, embed_indices))
+            embeds = []
+            embed_indices = []
+
+    for index, item in enumerate(items):
+        extra = {k: v for k, v in item.items() if k not in ("content", "embed", "allowed_mentions") and v is not None}
+        content = item.get("content")
+        embed = item.get("embed")
+
+        if not extra and embed is not None and content is None:
+            if text is not None or len(embeds) >= MAX_EMBEDS:
+                flush()
+            embeds.append(embed)
+            embed_indices.append(index)
+            continue
+
+        allowed = _allowed_user_ids(item.get("allowed_mentions"))
+        if extra or embed is not None or content is None or allowed is None or len(content) > MAX_CONTENT_LENGTH:
+            flush()
+            payloads.append((item, [index]))
+            continue
+
+        content = str(content)
+        mentioned = frozenset(int(x) for x in USER_MENTION_REGEX.findall(content))
+        if embeds or (text is not None and not text.can_add(content, mentioned, allowed)):
+            flush()
+
+        if text is None:
+            text = _TextBatch()
+        text.add(content, mentioned, allowed, index)
+
+    flush()
+    return payloads
+
+
+def coalesce_messages(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Like :func:`group_messages`, but only returns the sends"""
+    return [payload for payload, _ in group_messages(items)]
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a send that failed with this error could succeed later.
+
+    Server errors, ratelimits, timeouts and connection errors are transient. Any other 4xx won't ever succeed.
+    """
+    if isinstance(error, discord.HTTPException):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class OverflowPolicy(enum.Enum):
+    """What an emitter does when its queue is full"""
+    # Wait for room in the queue
+    block = "block"
+    # Throw away the oldest entry to make room
+    drop_oldest = "drop_oldest"
+    # Throw away the new entry and send a summary of how many were dropped
+    summarize = "summarize"
+
+
+class RateCounter:
+    """An exponentially decaying counter that approximates events per second over the last ``tau`` seconds"""
+    __slots__ = ("tau", "total", "_value", "_last")
+
+    def __init__(self, tau: float = 60.0):
+        self.tau = tau
+        self.total = 0
+        self._value = 0.0
+        self._last = time.monotonic()
+
+    def _decay(self, now: float) -> None:
+        self._value *= math.exp(-(now - self._last) / self.tau)
+        self._last = now
+
+    def hit(self, amount: int = 1) -> None:
+        self._decay(time.monotonic())
+        self._value += amount
+        self.total += amount
+
+    @property
+    def rate(self) -> float:
+        self._decay(time.monotonic())
+        return self._value / self.tau
+
+
+class EmitterStats:
+    __slots__ = ("enqueued", "dequeued", "dropped")
+
+    def __init__(self):
+        self.enqueued = RateCounter()
+        self.dequeued = RateCounter()
+        self.dropped = 0
+
 
 class Emitter:
-    """Base emitter"""
-    def __init__(self, *, loop: asyncio.AbstractEventLoop = None):
+    """Base emitter.
+
+    Emitters pace themselves with a :class:`RatelimitTracker`. Pass the bot's tracker so pacing follows the
+    ratelimit headers Discord sends, otherwise a private tracker with Discord's usual defaults is used.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum amount of entries that can be queued. 0 means unbounded.
+    overflow : OverflowPolicy
+        What to do when the queue is full
+    outbox : Optional[Outbox]
+        An outbox that queued entries are recorded to until they're sent
+    """
+    def __init__(self, *, loop: asyncio.AbstractEventLoop = None, ratelimits: Optional[RatelimitTracker] = None,
+                 maxsize: int = 0, overflow: OverflowPolicy = OverflowPolicy.block, outbox: Optional[Outbox] = None):
         self.loop = loop or asyncio.get_event_loop()
-        self._queue = asyncio.Queue()
+        self.ratelimits = ratelimits or RatelimitTracker()
+        self.overflow = overflow
+        self.outbox = outbox
+        # Outbox IDs of entries taken off the queue that haven't been acknowledged yet
+        self._unacked: List[uuid.UUID] = []
+        self.stats = EmitterStats()
+        self._queue = asyncio.Queue(maxsize)
         self._task = None
+        # Entries thrown away by the summarize policy that haven't been reported yet
+        self._summarized = 0
+        self.last_activity = time.monotonic()
+
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def maxsize(self) -> int:
+        return self._queue.maxsize
+
+    @property
+    def bucket_key(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def outbox_key(self) -> str:
+        """Where the emitter's outbox entries are going. Replays are routed with this."""
+        return self.bucket_key
+
+    async def _put(self, item, *, entry_id: Optional[uuid.UUID] = None) -> bool:
+        """Queues an entry according to the overflow policy.
+
+        Returns
+        -------
+        bool
+            Whether the entry was queued
+        """
+        self.last_activity = time.monotonic()
+        if self._queue.full():
+            if self.overflow is OverflowPolicy.drop_oldest:
+                dropped_id, _ = self._queue.get_nowait()
+                if dropped_id is not None:
+                    self.outbox.ack([dropped_id])
+                self.stats.dropped += 1
+            elif self.overflow is OverflowPolicy.summarize:
+                self.stats.dropped += 1
+                self._summarized += 1
+                if entry_id is not None:
+                    self.outbox.ack([entry_id])
+                return False
+
+        if entry_id is None and self.outbox is not None:
+            payload = self.serialize_entry(item)
+            if payload is not None:
+                entry_id = self.outbox.record(self.outbox_key, payload)
+
+        await self._queue.put((entry_id, item))
+        self.stats.enqueued.hit()
+        return True
+
+    def _dequeued(self, entry: Tuple[Optional[uuid.UUID], Any]) -> Tuple[Optional[uuid.UUID], Any]:
+        self.stats.dequeued.hit()
+        self.last_activity = time.monotonic()
+        return entry
+
+    async def _get_entry(self) -> Tuple[Optional[uuid.UUID], Any]:
+        """Gets an entry and its outbox ID. Acknowledging it is up to the caller."""
+        return self._dequeued(await self._queue.get())
+
+    def _get_entry_nowait(self) -> Tuple[Optional[uuid.UUID], Any]:
+        return self._dequeued(self._queue.get_nowait())
+
+    def _take(self, entry) -> Any:
+        entry_id, item = entry
+        if entry_id is not None:
+            self._unacked.append(entry_id)
+        return item
+
+    async def _get(self):
+        return self._take(await self._get_entry())
+
+    def _get_nowait(self):
+        return self._take(self._get_entry_nowait())
+
+    def _acknowledge(self) -> None:
+        """Acknowledges every entry taken off the queue so far"""
+        if self._unacked:
+            self.outbox.ack(self._unacked)
+            self._unacked = []
+
+    def _ack(self, entry_ids: List[Optional[uuid.UUID]]) -> None:
+        """Acknowledges some entries from :meth:`_get_entry`"""
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id is not None]
+        if entry_ids:
+            self.outbox.ack(entry_ids)
+
+    def serialize_entry(self, item) -> Optional[Dict[str, Any]]:
+        """Turns an entry into JSON for the outbox. Entries that return None aren't recorded."""
+        return None
+
+    def deserialize_entry(self, payload: Dict[str, Any]):
+        """Turns JSON from the outbox back into an entry"""
+        raise NotImplementedError
+
+    async def _send_retrying(self, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Calls ``send`` until it stops failing with transient errors, backing off between attempts.
+
+        Errors that aren't transient are raised.
+        """
+        delay = RETRY_DELAY
+        while True:
+            await self.ratelimits.acquire(self.bucket_key)
+            try:
+                return await send()
+            except (asyncio.TimeoutError, aiohttp.ClientError, discord.HTTPException) as e:
+                if not is_transient_error(e):
+                    raise
+                log.warning(f"Unable to send to {self.name}, retrying in {delay:.1f}s: {e}")
+
+            # Still busy, so the manager shouldn't reap us while we wait
+            self.last_activity = time.monotonic()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    async def replay(self, entry_id: uuid.UUID, payload: Dict[str, Any]) -> None:
+        """Queues an entry that was recorded to the outbox but never sent"""
+        await self._put(self.deserialize_entry(payload), entry_id=entry_id)
+
+    def idle_for(self, now: Optional[float] = None) -> float:
+        """How long the emitter has had nothing to do. 0 if it still has entries to send."""
+        if self.depth or self._summarized:
+            return 0.0
+        return (now or time.monotonic()) - self.last_activity
+
+    def _take_summarized(self) -> int:
+        amount, self._summarized = self._summarized, 0
+        return amount
 
     def start(self) -> None:
         self._task = self.loop.create_task(self.emit_loop())
@@ -43,6 +406,10 @@ class Emitter:
     def running(self) -> bool:
         return not self.closed
 
+    def done(self) -> bool:
+        """Whether the emit loop has stopped, either by being closed or by crashing"""
+        return self._task.done() if self._task else True
+
     def get_task(self):
         return self._task
 
@@ -57,30 +424,107 @@ class Emitter:
 
 
 class WebhookEmbedEmitter(Emitter):
-    """An emitter designed for webhooks sending embeds"""
-    def __init__(self, url: str, *, session: aiohttp.ClientSession = None, **kwargs):
+    """An emitter designed for webhooks sending embeds.
+
+    A batch is sent as soon as it has ``max_batch`` embeds, otherwise once ``linger`` seconds have passed since its
+    first embed. Identical embeds in the same batch are sent once with how many times they occurred.
+
+    Parameters
+    ----------
+    url : str
+        The webhook's URL
+    linger : float
+        The longest an embed waits for others to batch with
+    max_batch : int
+        How many embeds to send at once, up to 10
+    """
+    def __init__(self, url: str, *, session: aiohttp.ClientSession = None, linger: float = 1.0,
+                 max_batch: int = MAX_EMBEDS, **kwargs):
         self.session = session or aiohttp.ClientSession()
         self.webhook = discord.Webhook.from_url(url, session=self.session)
+        self.linger = linger
+        self.max_batch = max(1, min(max_batch, MAX_EMBEDS))
         super().__init__(**kwargs)
 
+    @property
+    def bucket_key(self) -> str:
+        return f"webhook:{self.webhook.id}"
+
+    @property
+    def name(self) -> str:
+        return f"webhook {self.webhook.id}"
+
     async def put(self, embed: discord.Embed) -> None:
-        await self._queue.put(embed)
+        await self._put(embed)
+
+    def serialize_entry(self, item: discord.Embed) -> Dict[str, Any]:
+        return {"embed": item.to_dict()}
+
+    def deserialize_entry(self, payload: Dict[str, Any]) -> discord.Embed:
+        return discord.Embed.from_dict(payload['embed'])
+
+    @staticmethod
+    def _fingerprint(embed: discord.Embed) -> str:
+        data = embed.to_dict()
+        data.pop("timestamp", None)
+        return json.dumps(data, sort_keys=True)
+
+    async def _collect(self) -> List[List[Any]]:
+        """Collects a batch of [embed, occurrences]"""
+        first = await self._get()
+        batch = {self._fingerprint(first): [first, 1]}
+        deadline = self.loop.time() + self.linger
+
+        # Leave room for the summary of dropped entries
+        while len(batch) < self.max_batch - (1 if self._summarized else 0):
+            if self._queue.empty():
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    embed = await asyncio.wait_for(self._get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                embed = self._get_nowait()
+
+            key = self._fingerprint(embed)
+            if key in batch:
+                batch[key][1] += 1
+            else:
+                batch[key] = [embed, 1]
+
+        return list(batch.values())
 
     async def _emit(self):
         while not self.closed:
-            embed = await self._queue.get()
-            embeds = [embed]
-            await asyncio.sleep(5)
+            embeds = []
+            for embed, occurrences in await self._collect():
+                if occurrences > 1:
+                    embed = embed.copy()
+                    footer = f"Occurred {occurrences} times"
+                    embed.set_footer(text=f"{embed.footer.text} • {footer}" if embed.footer.text else footer,
+                                     icon_url=embed.footer.icon_url)
+                embeds.append(embed)
 
-            size = self._queue.qsize()
-            for _ in range(min(9, size)):
-                embeds.append(self._queue.get_nowait())
+            if len(embeds) < MAX_EMBEDS and (dropped := self._take_summarized()):
+                embeds.append(discord.Embed(description=f"...and {dropped} more entries were dropped to keep up."))
+
+            try:
+                await self._send_retrying(functools.partial(self.webhook.send, embeds=embeds))
+            except (asyncio.TimeoutError, aiohttp.ClientError, discord.HTTPException) as e:
+                log.warning(f"Dropping {len(embeds)} embeds that {self.name} can't send: {e}")
 
-            await self.webhook.send(embeds=embeds)
+            self._acknowledge()
 
 
 class TextChannelEmitter(Emitter):
-    """An emitter designed for a text channel"""
+    """An emitter designed for a text channel.
+
+    Everything queued while the emitter is busy gets coalesced into as few messages as possible."""
+    max_batch = 100
+
     def __init__(self, channel: discord.TextChannel, **kwargs):
         super().__init__(**kwargs)
         self.channel = channel
@@ -89,24 +533,227 @@ class TextChannelEmitter(Emitter):
         super().start()
         self._task.set_name(f"textchannel-emitter-{self.channel.id}")
 
+    @property
+    def bucket_key(self) -> str:
+        return f"channel:{self.channel.id}"
+
+    @property
+    def outbox_key(self) -> str:
+        return f"channel:{self.channel.id}"
+
+    @property
+    def name(self) -> str:
+        return f"channel {self.channel.id}"
+
     async def put(self, content=None, **kwargs):
-        await self._queue.put({'content': content, **kwargs})
+        await self._put({'content': content, **kwargs})
 
     async def send(self, *args, **kwargs):
         """Alias function for TextChannelEmitter.put"""
         await self.put(*args, **kwargs)
 
+    def serialize_entry(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if any(value is not None for key, value in item.items() if key not in OUTBOX_KEYS):
+            return None  # Files, views...
+
+        payload = {}
+        if item.get('content') is not None:
+            payload['content'] = str(item['content'])
+        if item.get('embed') is not None:
+            payload['embed'] = item['embed'].to_dict()
+        if item.get('embeds') is not None:
+            payload['embeds'] = [embed.to_dict() for embed in item['embeds']]
+        if item.get('allowed_mentions') is not None:
+            payload['allowed_mentions'] = _allowed_mentions_to_dict(item['allowed_mentions'])
+        return payload
+
+    def deserialize_entry(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        item = {'content': payload.get('content')}
+        if 'embed' in payload:
+            item['embed'] = discord.Embed.from_dict(payload['embed'])
+        if 'embeds' in payload:
+            item['embeds'] = [discord.Embed.from_dict(embed) for embed in payload['embeds']]
+        if 'allowed_mentions' in payload:
+            item['allowed_mentions'] = _allowed_mentions_from_dict(payload['allowed_mentions'])
+        return item
+
+    async def _send(self, msg: Dict[str, Any]) -> None:
+        await self.channel.send(**msg)
+
     async def _emit(self):
         while not self.closed:
-            msg = await self._queue.get()
+            entries = [await self._get_entry()]
+            # Anything that comes in while we wait for budget gets coalesced into this batch.
+            await self.ratelimits.wait(self.bucket_key)
+            while len(entries) < self.max_batch and not self._queue.empty():
+                entries.append(self._get_entry_nowait())
 
-            try:
-                await self.channel.send(**msg)
-            except discord.NotFound:
-                self.close()
-            except (asyncio.TimeoutError, aiohttp.ClientError, discord.HTTPException):
-                pass
-
-            # Rough estimate to wait before sending again without hitting ratelimits.
-            # We may need to rethink this...
-            await asyncio.sleep(0.7)
+            if dropped := self._take_summarized():
+                entries.append((None, {'content': f"...and {dropped} more log entries were dropped to keep up."}))
+
+            entry_ids = [entry_id for entry_id, _ in entries]
+            for msg, indices in group_messages([item for _, item in entries]):
+                try:
+                    await self._send_retrying(functools.partial(self._send, msg))
+                except discord.NotFound:
+                    # The channel is gone, so nothing for it will ever be delivered
+                    self._ack(entry_ids)
+                    self.close()
+                    return
+                except (asyncio.TimeoutError, aiohttp.ClientError, discord.HTTPException) as e:
+                    log.debug(f"Dropping {len(indices)} entries that {self.name} can't send: {e}")
+
+                self._ack([entry_ids[index] for index in indices])
+
+
+class WebhookChannelEmitter(TextChannelEmitter):
+    """A text channel emitter that sends through a webhook.
+
+    Webhooks have their own ratelimits, so log traffic doesn't compete with the bot's command replies in the
+    channel. If the webhook gets deleted, ``recreate`` is called to get a new one. If that returns None, the emitter
+    falls back to sending as the bot.
+
+    Parameters
+    ----------
+    channel : discord.TextChannel
+        The channel the webhook belongs to
+    webhook : discord.Webhook
+        The webhook to send with
+    recreate : Callable[[], Awaitable[Optional[discord.Webhook]]]
+        Called when the webhook is found to be deleted
+    username : Optional[str]
+        The username to send as
+    avatar_url : Optional[str]
+        The avatar to send with
+    """
+    def __init__(self, channel: discord.TextChannel, webhook: discord.Webhook, *,
+                 recreate: Callable[[], Awaitable[Optional[discord.Webhook]]], username: Optional[str] = None,
+                 avatar_url: Optional[str] = None, **kwargs):
+        super().__init__(channel, **kwargs)
+        self.webhook: Optional[discord.Webhook] = webhook
+        self.recreate = recreate
+        self.username = username
+        self.avatar_url = avatar_url
+
+    def start(self) -> None:
+        super().start()
+        self._task.set_name(f"webhook-emitter-{self.channel.id}")
+
+    @property
+    def bucket_key(self) -> str:
+        if self.webhook is None:
+            return super().bucket_key
+        return f"webhook:{self.webhook.id}"
+
+    @property
+    def name(self) -> str:
+        return f"channel {self.channel.id} (webhook)"
+
+    async def _send(self, msg: Dict[str, Any]) -> None:
+        if self.webhook is None:
+            await self.channel.send(**msg)
+            return
+
+        try:
+            await self.webhook.send(**msg, username=self.username, avatar_url=self.avatar_url)
+            return
+        except discord.NotFound:
+            log.info(f"Webhook for channel {self.channel.id} was deleted, recreating it")
+            self.webhook = await self.recreate()
+
+        if self.webhook is None:
+            await self.channel.send(**msg)
+        else:
+            await self.webhook.send(**msg, username=self.username, avatar_url=self.avatar_url)
+
+
+class EmitterManager:
+    """Holds emitters by key and closes the ones that have been idle for too long.
+
+    Emitters are started when they're added. Once an emitter has had nothing to send for ``ttl`` seconds, its task
+    is cancelled and it is removed, so a new one should be created the next time it's needed.
+
+    Parameters
+    ----------
+    ttl : float
+        How many seconds an emitter can be idle before it's closed
+    interval : float
+        How often to look for idle emitters
+    """
+    def __init__(self, *, ttl: float = 600.0, interval: float = 60.0, loop: asyncio.AbstractEventLoop = None):
+        self.ttl = ttl
+        self.interval = interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.created = 0
+        self.reaped = 0
+        self._emitters: Dict[Any, Emitter] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._emitters)
+
+    def __contains__(self, key) -> bool:
+        return key in self._emitters
+
+    def values(self) -> List[Emitter]:
+        return list(self._emitters.values())
+
+    @property
+    def live_tasks(self) -> int:
+        """The amount of emitters with a running task"""
+        return sum(1 for emitter in self._emitters.values() if not emitter.done())
+
+    def get(self, key) -> Optional[Emitter]:
+        """Gets an emitter. Emitters that have stopped are removed and None is returned."""
+        emitter = self._emitters.get(key)
+        if emitter is not None and emitter.done():
+            del self._emitters[key]
+            return None
+        return emitter
+
+    def add(self, key, emitter: Emitter) -> Emitter:
+        """Adds and starts an emitter, closing any emitter that was under the same key"""
+        self.remove(key)
+        self._emitters[key] = emitter
+        emitter.start()
+        self.created += 1
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = self.loop.create_task(self._reap_loop())
+        return emitter
+
+    def remove(self, key) -> None:
+        emitter = self._emitters.pop(key, None)
+        if emitter is not None and not emitter.done():
+            emitter.close()
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Closes every emitter that has been idle past the TTL.
+
+        Returns
+        -------
+        int
+            The amount of emitters closed
+        """
+        now = now or time.monotonic()
+        idle = [key for key, emitter in self._emitters.items() if emitter.done() or emitter.idle_for(now) >= self.ttl]
+        for key in idle:
+            self.remove(key)
+
+        self.reaped += len(idle)
+        return len(idle)
+
+    async def _reap_loop(self) -> None:
+        while self._emitters:
+            await asyncio.sleep(self.interval)
+            amount = self.reap()
+            if amount:
+                log.debug(f"Closed {amount} idle emitters, {len(self._emitters)} left")
+
+    def close(self) -> None:
+        """Closes every emitter"""
+        for key in list(self._emitters):
+            self.remove(key)
+
+        if self._reaper is not None:
+            self._reaper.cancel()
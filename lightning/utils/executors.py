@@ -0,0 +1,85 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List
+
+log = logging.getLogger(__name__)
+
+
+class RatelimitedExecutor:
+    """Runs actions with bounded concurrency and a minimum delay between each action starting.
+
+    This is meant for bulk actions (e.g. banning a wave of raiders) where firing every request at once would
+    just end up with us sitting on Discord's ratelimits anyways.
+
+    Parameters
+    ----------
+    concurrency : int
+        How many actions can run at the same time.
+    interval : float
+        The minimum amount of seconds between two actions starting.
+    """
+    def __init__(self, *, concurrency: int = 1, interval: float = 0.0, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """The amount of actions that are waiting or running"""
+        return self._pending
+
+    async def _wait_for_turn(self) -> None:
+        async with self._lock:
+            now = self.loop.time()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def run(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs an action once the executor allows it to.
+
+        Parameters
+        ----------
+        func : Callable[[], Awaitable[Any]]
+            A callable that returns the awaitable to run.
+        """
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                await self._wait_for_turn()
+                return await func()
+        finally:
+            self._pending -= 1
+
+    async def run_many(self, funcs: Iterable[Callable[[], Awaitable[Any]]]) -> List[Any]:
+        """Runs many actions through the executor.
+
+        Exceptions are returned in place of results so that one failure does not cancel the rest.
+
+        Returns
+        -------
+        List[Any]
+            The results in the same order as the actions given.
+        """
+        return await asyncio.gather(*[self.run(func) for func in funcs], return_exceptions=True)
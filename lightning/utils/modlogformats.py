@@ -16,14 +16,17 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 import discord
 
-from lightning.formatters import truncate_text
+from lightning.formatters import plural, truncate_text
+from lightning.utils.emitters import MAX_CONTENT_LENGTH
 from lightning.utils.helpers import Emoji
 from lightning.utils.time import get_utc_timestamp, natural_timedelta
 
+MAX_EMBED_DESCRIPTION_LENGTH = 4096
+
 
 class ActionType(discord.Enum):
     WARN = 1
@@ -198,6 +201,17 @@ class EmojiFormat(BaseFormat):
         msg.append(f" at {get_utc_timestamp(creation)}")
         return ''.join(msg)
 
+    @staticmethod
+    def timed_actions_expired(action, entries) -> str:
+        lines = []
+        for user, mod, creation in entries:
+            line = f"<@!{user.id}>"
+            if hasattr(user, 'name'):
+                line += f" | {discord.utils.escape_mentions(str(user))}"
+            lines.append(f"{line}, made by <@!{mod.id}> at {get_utc_timestamp(creation)}")
+
+        return join_summary(f"\N{WARNING SIGN} **{plural(len(entries)):{action}} expired**", lines)
+
     @staticmethod
     def join_leave(log_type: str, member) -> str:
         safe_name = escape_markdown_and_mentions(str(member))
@@ -272,6 +286,28 @@ def base_user_format(user, unknown_text="Unknown user with ID: ") -> str:
         return f"{unknown_text}{user.id if hasattr(user, 'id') else user}"
 
 
+def join_summary(header: Optional[str], lines: List[str], *, limit: int = MAX_CONTENT_LENGTH) -> str:
+    """Joins a header and as many lines as fit in ``limit`` characters.
+
+    Lines that don't fit are left out and counted in an "...and N more" line instead.
+    """
+    text = [header] if header is not None else []
+    length = len(header) if header is not None else -1
+    # Room for the longest tail there can be, so it always fits
+    reserved = len(f"\n...and {len(lines)} more")
+
+    for index, line in enumerate(lines):
+        room = limit if index == len(lines) - 1 else limit - reserved
+        if length + 1 + len(line) > room:
+            text.append(f"...and {len(lines) - index} more")
+            break
+
+        text.append(line)
+        length += 1 + len(line)
+
+    return '\n'.join(text)
+
+
 def format_timestamp(dt: datetime):
     return discord.utils.format_dt(dt, style="T")
 
@@ -328,6 +364,14 @@ class MinimalisticFormat(BaseFormat):
                     f"\n**Created at**: {discord.utils.format_dt(creation)}")
         return ''.join(text)
 
+    @staticmethod
+    def timed_actions_expired(action, entries, expiry, *, with_timestamp: bool = True) -> str:
+        header = f"[{format_timestamp(expiry)}] " if with_timestamp else ""
+        lines = [f"**User**: {MinimalisticFormat.format_user(user)} | "
+                 f"**Moderator**: {MinimalisticFormat.format_user(mod)} | "
+                 f"**Created at**: {discord.utils.format_dt(creation)}" for user, mod, creation in entries]
+        return join_summary(f"{header}**{plural(len(entries)):{action}} expired**", lines)
+
     @staticmethod
     def bot_addition(bot, mod, time) -> str:
         safe_name = escape_markdown_and_mentions(str(bot))
@@ -453,6 +497,17 @@ class EmbedFormat(BaseFormat):
         embed.set_footer(text=f"Time {action} was made at")
         return embed
 
+    @staticmethod
+    def timed_actions_expired(action, entries, expiry) -> discord.Embed:
+        lines = [f"{base_user_format(user)}, made by {base_user_format(mod)} at {get_utc_timestamp(creation)}"
+                 for user, mod, creation in entries]
+        description = join_summary(None, lines, limit=MAX_EMBED_DESCRIPTION_LENGTH)
+
+        embed = discord.Embed(title=f"{plural(len(entries)):timed {action}} expired", description=description)
+        embed.timestamp = expiry
+        embed.set_footer(text="Expired at")
+        return embed
+
     @staticmethod
     def role_change(user, added, removed, *, entry=None):
         embed = discord.Embed(title="Role Change", color=discord.Color.dark_gold(),
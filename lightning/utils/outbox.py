@@ -0,0 +1,213 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from lightning import LightningBot
+
+log = logging.getLogger(__name__)
+
+# How long an owner can go without a heartbeat before its entries are taken over by other processes
+OUTBOX_OWNER_TTL = timedelta(minutes=2)
+# How many entries are fetched and claimed at once when replaying
+OUTBOX_PAGE_SIZE = 500
+
+# Entries that the given owner can take: its own if include_own is set, unowned ones and those of dead owners
+CLAIMABLE = """(owner IS NULL
+                OR (owner = $1 AND $2)
+                OR (owner <> $1 AND owner NOT IN (SELECT owner FROM emitter_outbox_owners WHERE seen_at >= $3)))"""
+
+
+class Outbox:
+    """A Postgres-backed outbox for emitter entries.
+
+    Emitters record entries when they're queued and acknowledge them once they're sent. Both are buffered and written
+    in batches, so an entry costs no queries of its own.
+
+    Several processes can share the table. Entries are written under the process' owner name, and each process
+    keeps a heartbeat in ``emitter_outbox_owners``. A process only replays its own entries from before it started
+    and the entries of owners whose heartbeat stopped, claiming them first so no other process replays them too.
+
+    Parameters
+    ----------
+    bot : LightningBot
+        The bot. Its pool is used once it exists.
+    owner : str
+        The name entries are written under. A stable name lets a restarted process take its own entries back.
+    interval : float
+        How often to write buffered records and acknowledgements
+    max_batch : int
+        How many buffered records cause an early write
+    """
+    def __init__(self, bot: LightningBot, *, owner: str, interval: float = 1.0, max_batch: int = 250):
+        self.bot = bot
+        self.owner = owner
+        self.interval = interval
+        self.max_batch = max_batch
+        self._records: Dict[uuid.UUID, Tuple[str, Dict[str, Any], datetime]] = {}
+        self._acks: List[uuid.UUID] = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def record(self, destination: str, payload: Dict[str, Any]) -> uuid.UUID:
+        """Buffers an entry to be written to the outbox.
+
+        Parameters
+        ----------
+        destination : str
+            Where the entry is going, usually an emitter's bucket key
+        payload : Dict[str, Any]
+            The JSON-serializable entry
+
+        Returns
+        -------
+        uuid.UUID
+            The ID to acknowledge the entry with
+        """
+        entry_id = uuid.uuid4()
+        self._records[entry_id] = (destination, payload, datetime.utcnow())
+        self._ensure_task()
+        if len(self._records) >= self.max_batch:
+            self._wakeup.set()
+        return entry_id
+
+    def ack(self, entry_ids: Iterable[uuid.UUID]) -> None:
+        """Marks entries as delivered"""
+        self._acks.extend(entry_ids)
+        self._ensure_task()
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Writes buffered records and deletes acknowledged entries"""
+        if not self._records and not self._acks:
+            return
+
+        if self.bot.pool is None:
+            return
+
+        records, self._records = self._records, {}
+        acks, self._acks = self._acks, []
+
+        # Entries that were delivered before they were written never need to touch the table
+        acked = set(acks)
+        rows = [{"id": str(entry_id), "destination": destination, "payload": payload,
+                 "created_at": created_at.isoformat(), "owner": self.owner}
+                for entry_id, (destination, payload, created_at) in records.items() if entry_id not in acked]
+        acks = [entry_id for entry_id in acks if entry_id not in records]
+
+        query = """INSERT INTO emitter_outbox (id, destination, payload, created_at, owner)
+                   SELECT data.id, data.destination, data.payload, data.created_at, data.owner
+                   FROM jsonb_to_recordset($1::jsonb) AS
+                   data(id UUID, destination TEXT, payload JSONB, created_at TIMESTAMP, owner TEXT)
+                   ON CONFLICT (id) DO NOTHING;
+                """
+        try:
+            async with self.bot.pool.acquire() as connection:
+                async with connection.transaction():
+                    if rows:
+                        await connection.execute(query, rows)
+                    if acks:
+                        await connection.execute("DELETE FROM emitter_outbox WHERE id = ANY($1::uuid[]);", acks)
+        except Exception as e:
+            log.warning(f"Unable to write {len(rows)} records and {len(acks)} acknowledgements to the outbox: {e}")
+            # Try again on the next flush
+            self._records = {**{k: v for k, v in records.items() if k not in acked}, **self._records}
+            self._acks = acks + self._acks
+
+    async def heartbeat(self) -> None:
+        """Marks this process as alive so other processes leave its entries alone"""
+        query = """INSERT INTO emitter_outbox_owners (owner, seen_at) VALUES ($1, $2)
+                   ON CONFLICT (owner) DO UPDATE SET seen_at = EXCLUDED.seen_at;
+                """
+        await self.bot.pool.execute(query, self.owner, datetime.utcnow())
+
+    async def pending(self, *, include_own: bool = False, after: Optional[Tuple[datetime, uuid.UUID]] = None,
+                      limit: int = OUTBOX_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Gets a page of the unacknowledged entries this process can take over, oldest first.
+
+        Parameters
+        ----------
+        include_own : bool
+            Whether to include entries written under this process' owner name. Only safe before this process has
+            queued anything, as they'd otherwise be sent twice.
+        after : Optional[Tuple[datetime, uuid.UUID]]
+            The ``created_at`` and ``id`` of the last entry of the previous page
+        limit : int
+            How many entries to get at most
+        """
+        query = f"""SELECT id, destination, payload, created_at FROM emitter_outbox
+                    WHERE {CLAIMABLE}
+                    AND (created_at, id) > ($4, $5)
+                    ORDER BY created_at, id
+                    LIMIT $6;
+                 """
+        created_at, entry_id = after or (datetime.min, uuid.UUID(int=0))
+        records = await self.bot.pool.fetch(query, self.owner, include_own, datetime.utcnow() - OUTBOX_OWNER_TTL,
+                                            created_at, entry_id, limit)
+        return [dict(record) for record in records]
+
+    async def claim(self, entry_ids: List[uuid.UUID], *, include_own: bool = False) -> List[uuid.UUID]:
+        """Takes ownership of entries from :meth:`pending`.
+
+        Returns
+        -------
+        List[uuid.UUID]
+            The IDs that were claimed. Entries another process took in the meantime are left out.
+        """
+        if not entry_ids:
+            return []
+
+        query = f"""UPDATE emitter_outbox SET owner = $1
+                    WHERE id IN (SELECT id FROM emitter_outbox
+                                 WHERE id = ANY($4::uuid[]) AND {CLAIMABLE}
+                                 FOR UPDATE SKIP LOCKED)
+                    RETURNING id;
+                 """
+        records = await self.bot.pool.fetch(query, self.owner, include_own, datetime.utcnow() - OUTBOX_OWNER_TTL,
+                                            entry_ids)
+        return [record['id'] for record in records]
+
+    async def close(self) -> None:
+        """Stops the flush task, writes anything still buffered and lets other processes take the rest"""
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+        if self.bot.pool is None:
+            return
+
+        try:
+            await self.bot.pool.execute("DELETE FROM emitter_outbox_owners WHERE owner = $1;", self.owner)
+        except Exception as e:
+            log.warning(f"Unable to remove the outbox heartbeat of {self.owner}: {e}")
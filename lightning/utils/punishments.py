@@ -0,0 +1,459 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import functools
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import discord
+
+from lightning.events import InfractionEvent
+from lightning.models import bulk_add_infractions, bulk_deactivate_infractions
+from lightning.utils import helpers, modlogformats
+from lightning.utils.executors import RatelimitedExecutor
+from lightning.utils.time import get_utc_timestamp
+
+if TYPE_CHECKING:
+    from lightning import LightningBot
+    from lightning.models import Timer
+
+log = logging.getLogger(__name__)
+
+# Higher replaces lower when a member triggers more than one punishment before the queue gets to them.
+SEVERITY = {"WARN": 0, "TIMEOUT": 1, "MUTE": 2, "TIMEMUTE": 2, "KICK": 3, "TIMEBAN": 4, "BAN": 5}
+TIMED_ACTIONS = {"TIMEBAN": "timeban", "TIMEMUTE": "timemute"}
+# The logged action and infraction action of each timer event that ExpirationQueue handles
+EXPIRED_ACTIONS = {"timeban": ("UNBAN", 4), "timemute": ("UNMUTE", 8)}
+
+
+class PunishmentJob:
+    """A punishment that is waiting to be carried out.
+
+    Parameters
+    ----------
+    action : str
+        One of WARN, TIMEOUT, MUTE, TIMEMUTE, KICK, TIMEBAN or BAN
+    member : discord.Member
+        The member to punish
+    moderator : discord.abc.User
+        The moderator responsible for the punishment
+    reason : Optional[str]
+        The reason that is put into the infraction
+    audit_reason : Optional[str]
+        The reason that shows up in the audit log. Defaults to reason.
+    created_at : Optional[datetime.datetime]
+        When the punishment was triggered
+    expiry : Optional[datetime.datetime]
+        When a TIMEOUT, TIMEMUTE or TIMEBAN expires
+    role : Optional[discord.Role]
+        The role to add for MUTE and TIMEMUTE
+    """
+    __slots__ = ("action", "member", "moderator", "reason", "audit_reason", "created_at", "expiry", "role")
+
+    def __init__(self, action: str, member: discord.Member, *, moderator: discord.abc.User,
+                 reason: Optional[str] = None, audit_reason: Optional[str] = None,
+                 created_at: Optional[datetime.datetime] = None, expiry: Optional[datetime.datetime] = None,
+                 role: Optional[discord.Role] = None):
+        if action not in SEVERITY:
+            raise ValueError(f"Unknown punishment \"{action}\"")
+
+        self.action = action
+        self.member = member
+        self.moderator = moderator
+        self.reason = reason
+        self.audit_reason = audit_reason or reason
+        self.created_at = created_at or discord.utils.utcnow()
+        self.expiry = expiry
+        self.role = role
+
+    @property
+    def severity(self) -> int:
+        return SEVERITY[self.action]
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return (self.member.guild.id, self.member.id)
+
+    def __repr__(self) -> str:
+        return f"<PunishmentJob action={self.action} member={self.member.id} guild={self.member.guild.id}>"
+
+
+class PunishmentQueue:
+    """Carries out punishments in batches.
+
+    Repeated triggers for the same member are collapsed into the most severe one. Discord actions go through a
+    per-guild :class:`RatelimitedExecutor`, and once a batch is done its timers, punishment roles and infractions
+    are each written with a single query.
+
+    Parameters
+    ----------
+    bot : LightningBot
+        The bot
+    concurrency : int
+        How many Discord actions can run at once in a guild
+    interval : float
+        The minimum amount of seconds between Discord actions in a guild
+    linger : float
+        How long to wait for more punishments before processing a guild's batch
+    """
+    def __init__(self, bot: LightningBot, *, concurrency: int = 2, interval: float = 0.25, linger: float = 0.5):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.interval = interval
+        self.linger = linger
+
+        self._pending: Dict[int, Dict[int, PunishmentJob]] = {}
+        self._in_flight: Dict[Tuple[int, int], int] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._executors: Dict[int, RatelimitedExecutor] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def close(self) -> None:
+        for task in self._workers.values():
+            task.cancel()
+
+    async def join(self) -> None:
+        """Waits until every queued punishment has been carried out"""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    def put(self, job: PunishmentJob) -> bool:
+        """Queues a punishment.
+
+        Returns
+        -------
+        bool
+            False if the punishment was dropped because the member already has an equal or more severe punishment
+            queued or in progress.
+        """
+        guild_id = job.member.guild.id
+        pending = self._pending.setdefault(guild_id, {})
+
+        current = pending.get(job.member.id)
+        if current and current.severity >= job.severity:
+            return False
+
+        in_flight = self._in_flight.get(job.key)
+        if in_flight is not None and in_flight >= job.severity:
+            return False
+
+        pending[job.member.id] = job
+
+        if guild_id not in self._workers:
+            self._workers[guild_id] = self.bot.loop.create_task(self._worker(guild_id))
+
+        return True
+
+    def get_executor(self, guild_id: int) -> RatelimitedExecutor:
+        executor = self._executors.get(guild_id)
+        if executor is None:
+            executor = RatelimitedExecutor(concurrency=self.concurrency, interval=self.interval, loop=self.bot.loop)
+            self._executors[guild_id] = executor
+        return executor
+
+    async def _worker(self, guild_id: int) -> None:
+        try:
+            await asyncio.sleep(self.linger)
+            while self._pending.get(guild_id):
+                jobs = list(self._pending.pop(guild_id).values())
+                for job in jobs:
+                    self._in_flight[job.key] = job.severity
+
+                try:
+                    await self._process(guild_id, jobs)
+                except Exception:
+                    log.exception(f"Failed to process {len(jobs)} punishments in {guild_id}")
+                finally:
+                    for job in jobs:
+                        self._in_flight.pop(job.key, None)
+        finally:
+            self._workers.pop(guild_id, None)
+            self._executors.pop(guild_id, None)
+
+    async def _apply(self, job: PunishmentJob) -> None:
+        member = job.member
+
+        if job.action == "KICK":
+            await member.kick(reason=job.audit_reason)
+        elif job.action in ("BAN", "TIMEBAN"):
+            await member.ban(reason=job.audit_reason)
+        elif job.action in ("MUTE", "TIMEMUTE"):
+            await member.add_roles(job.role, reason=job.audit_reason)
+        elif job.action == "TIMEOUT":
+            await member.edit(timed_out_until=job.expiry, reason=job.audit_reason)
+
+    async def _process(self, guild_id: int, jobs: List[PunishmentJob]) -> None:
+        executor = self.get_executor(guild_id)
+        results = await executor.run_many([functools.partial(self._apply, job) for job in jobs])
+
+        done = []
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                log.debug(f"Failed to carry out {job!r}", exc_info=result)
+                continue
+            done.append(job)
+
+        # Timeouts are handled by Discord and aren't logged as infractions
+        done = [job for job in done if job.action != "TIMEOUT"]
+        if done:
+            await self._record(done)
+
+    async def _record(self, jobs: List[PunishmentJob]) -> None:
+        mod = self.bot.get_cog("Mod")
+        reminders = self.bot.get_cog("Reminders")
+
+        timed = [job for job in jobs if job.action in TIMED_ACTIONS]
+        roles = [job for job in jobs if job.role is not None]
+
+        async with self.bot.pool.acquire() as conn:
+            timer_ids: Dict[Tuple[int, int], int] = {}
+            if timed and reminders:
+                entries = []
+                for job in timed:
+                    extra = {"guild_id": job.member.guild.id, "user_id": job.member.id, "mod_id": job.moderator.id}
+                    if job.role is not None:
+                        extra['role_id'] = job.role.id
+                    entries.append((TIMED_ACTIONS[job.action], job.created_at, job.expiry, extra))
+
+                ids = await reminders.add_jobs(entries, connection=conn)
+                timer_ids = {job.key: timer_id for job, timer_id in zip(timed, ids)}
+            elif timed:
+                log.warning(f"Reminders is unavailable, {len(timed)} timed punishments will not expire")
+
+            if roles:
+                await mod.add_punishment_roles([(job.member.guild.id, job.member.id, job.role.id) for job in roles],
+                                               connection=conn)
+
+            events = []
+            for job in jobs:
+                kwargs = {}
+                if job.action in TIMED_ACTIONS:
+                    kwargs['expiry'] = job.expiry
+                    if job.key in timer_ids:
+                        kwargs['timer_id'] = timer_ids[job.key]
+
+                events.append(InfractionEvent(job.action, member=job.member, guild=job.member.guild,
+                                              moderator=job.moderator, reason=job.reason,
+                                              timestamp=job.created_at, **kwargs))
+
+            await bulk_add_infractions(conn, [event.action for event in events])
+
+        for job, event in zip(jobs, events):
+            mod.dispatch_action_event(event, job.action, timestamp=job.created_at)
+
+
+class ExpirationQueue:
+    """Carries out expired timebans and timemutes in batches.
+
+    Expirations in the same guild that come in within ``linger`` seconds of each other are handled together. Their
+    punishment roles and infractions are each updated with a single query, unbans and role removals go through a
+    per-guild :class:`RatelimitedExecutor`, and each kind of expiration gets one mod log entry for the whole batch.
+
+    :meth:`put` returns a future that finishes once the expiration has been carried out, so a timer is only deleted
+    after its action has actually happened.
+
+    Parameters
+    ----------
+    bot : LightningBot
+        The bot
+    concurrency : int
+        How many Discord actions can run at once in a guild
+    interval : float
+        The minimum amount of seconds between Discord actions in a guild
+    linger : float
+        How long to wait for more expirations before processing a guild's batch
+    """
+    def __init__(self, bot: LightningBot, *, concurrency: int = 2, interval: float = 0.25, linger: float = 1.0):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.interval = interval
+        self.linger = linger
+
+        self._pending: Dict[int, List[Tuple[Timer, asyncio.Future]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._executors: Dict[int, RatelimitedExecutor] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def close(self) -> None:
+        for task in self._workers.values():
+            task.cancel()
+
+        # A worker that's cancelled before it starts never gets to cancel its futures
+        for jobs in self._pending.values():
+            for _, future in jobs:
+                future.cancel()
+        self._pending.clear()
+
+    async def join(self) -> None:
+        """Waits until every queued expiration has been carried out"""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    def put(self, timer: Timer) -> asyncio.Future:
+        """Queues an expired timeban or timemute timer.
+
+        Returns
+        -------
+        asyncio.Future
+            A future that finishes once the expiration has been carried out or skipped. It raises the exception if
+            the unban or role removal failed.
+        """
+        if timer.event not in EXPIRED_ACTIONS:
+            raise ValueError(f"Unknown timed action \"{timer.event}\"")
+
+        guild_id = timer.extra['guild_id']
+        future = self.bot.loop.create_future()
+        self._pending.setdefault(guild_id, []).append((timer, future))
+
+        if guild_id not in self._workers:
+            self._workers[guild_id] = self.bot.loop.create_task(self._worker(guild_id))
+
+        return future
+
+    def get_executor(self, guild_id: int) -> RatelimitedExecutor:
+        executor = self._executors.get(guild_id)
+        if executor is None:
+            executor = RatelimitedExecutor(concurrency=self.concurrency, interval=self.interval, loop=self.bot.loop)
+            self._executors[guild_id] = executor
+        return executor
+
+    async def _worker(self, guild_id: int) -> None:
+        jobs: List[Tuple[Timer, asyncio.Future]] = []
+        try:
+            await asyncio.sleep(self.linger)
+            while self._pending.get(guild_id):
+                jobs = self._pending.pop(guild_id)
+                try:
+                    await self._process(guild_id, jobs)
+                except Exception as e:
+                    log.exception(f"Failed to process {len(jobs)} expirations in {guild_id}")
+                    for _, future in jobs:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self._workers.pop(guild_id, None)
+            self._executors.pop(guild_id, None)
+            # Nobody should wait forever if the worker is cancelled
+            for _, future in jobs + self._pending.pop(guild_id, []):
+                if not future.done():
+                    future.cancel()
+
+    @staticmethod
+    def _role_entry(timer: Timer) -> Tuple[int, int, int]:
+        return (timer.extra['guild_id'], timer.extra['user_id'], timer.extra['role_id'])
+
+    async def _expire(self, guild: discord.Guild, timer: Timer) -> Optional[Tuple[Any, Any]]:
+        moderator = guild.get_member(timer.extra['mod_id']) or helpers.BetterUserObject(timer.extra['mod_id'])
+        user_id = timer.extra['user_id']
+
+        if timer.event == "timeban":
+            # Unbanning only needs the ID, so there's no reason to fetch the user
+            user = self.bot.get_user(user_id) or helpers.BetterUserObject(user_id)
+            reason = f"Timed ban made by {modlogformats.base_user_format(moderator)} at {timer.created_at} expired"
+            try:
+                await guild.unban(user, reason=reason)
+            except discord.NotFound:
+                # Already unbanned, likely by an earlier attempt whose database update failed
+                return None
+            return user, moderator
+
+        role = guild.get_role(timer.extra['role_id'])
+        if role is None:
+            # Role was deleted or something.
+            return None
+
+        user = guild.get_member(user_id)
+        if user is None:
+            # User left probably...
+            return helpers.BetterUserObject(user_id), moderator
+
+        reason = f"Timed mute made by {modlogformats.base_user_format(moderator)} at "\
+                 f"{get_utc_timestamp(timer.created_at)} expired"
+        await user.remove_roles(role, reason=reason)
+        return user, moderator
+
+    async def _finish(self, timers: List[Timer]) -> None:
+        """Removes the punishment roles and deactivates the infractions of expirations that are done"""
+        if not timers:
+            return
+
+        mutes = [self._role_entry(timer) for timer in timers if timer.event == "timemute"]
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                if mutes:
+                    await self.bot.get_cog("Mod").remove_punishment_roles(mutes, connection=conn)
+                await bulk_deactivate_infractions(conn, [(timer.extra['guild_id'], timer.extra['user_id'],
+                                                          timer.expiry, EXPIRED_ACTIONS[timer.event][1])
+                                                         for timer in timers])
+
+    async def _process(self, guild_id: int, jobs: List[Tuple[Timer, asyncio.Future]]) -> None:
+        mutes = [timer for timer, _ in jobs if timer.event == "timemute"]
+        if mutes:
+            mod = self.bot.get_cog("Mod")
+            held = await mod.held_punishment_roles([self._role_entry(timer) for timer in mutes])
+            # The role was already taken off (e.g. by a manual unmute), so there's nothing left to expire
+            for timer, future in jobs:
+                if timer.event == "timemute" and self._role_entry(timer) not in held:
+                    future.set_result(None)
+            jobs = [(timer, future) for timer, future in jobs if not future.done()]
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            # Bot was kicked.
+            await self._finish([timer for timer, _ in jobs])
+            for _, future in jobs:
+                future.set_result(None)
+            return
+
+        executor = self.get_executor(guild_id)
+        results = await executor.run_many([functools.partial(self._expire, guild, timer) for timer, _ in jobs])
+
+        # The database is only updated for expirations that were carried out, so failed ones can be retried as is
+        expired = []
+        for (timer, future), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                log.debug(f"Failed to expire {timer.event} timer {timer.id} in {guild_id}", exc_info=result)
+                future.set_exception(result)
+                continue
+
+            expired.append((timer, future, result))
+
+        await self._finish([timer for timer, _, _ in expired])
+
+        done: Dict[str, List[Tuple[Timer, Any, Any]]] = {}
+        for timer, future, result in expired:
+            future.set_result(None)
+            if result is not None:
+                done.setdefault(EXPIRED_ACTIONS[timer.event][0], []).append((timer, *result))
+
+        for action, entries in done.items():
+            if len(entries) == 1:
+                timer, user, moderator = entries[0]
+                self.bot.dispatch("lightning_timed_moderation_action_done", action, guild, user, moderator, timer)
+                continue
+
+            summary = [(user, moderator, timer.created_at) for timer, user, moderator in entries]
+            self.bot.dispatch("lightning_timed_moderation_actions_done", action, guild, summary, entries[-1][0].expiry)
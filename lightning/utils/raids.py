@@ -0,0 +1,143 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import collections
+import datetime
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+import discord
+
+# How long a raid stays active after the last suspicious join.
+RAID_COOLDOWN = 300.0
+
+
+def score_member(member: discord.Member, *, now: Optional[datetime.datetime] = None) -> float:
+    """Scores a member that joined a guild.
+
+    Every join counts as one. Fresh accounts and accounts without an avatar weigh more, so a raid made up of
+    throwaway accounts trips the threshold earlier than a wave of regular members would."""
+    now = now or discord.utils.utcnow()
+    score = 1.0
+
+    age = now - member.created_at
+    if age < datetime.timedelta(days=1):
+        score += 1.0
+    elif age < datetime.timedelta(days=7):
+        score += 0.5
+
+    if member.avatar is None:
+        score += 0.5
+
+    return score
+
+
+class JoinWindow:
+    """A sliding window of joins for a guild.
+
+    The total score is kept up to date as joins enter and leave the window."""
+    __slots__ = ("seconds", "joins", "total")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.joins: Deque[Tuple[float, float, discord.Member]] = collections.deque()
+        self.total = 0.0
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.seconds
+        while self.joins and self.joins[0][0] <= cutoff:
+            _, score, _ = self.joins.popleft()
+            self.total -= score
+
+    def add(self, member: discord.Member, score: float, *, now: float) -> float:
+        self._expire(now)
+        self.joins.append((now, score, member))
+        self.total += score
+        return self.total
+
+    def drain(self) -> List[discord.Member]:
+        """Empties the window and returns the members that were in it"""
+        members = [member for _, _, member in self.joins]
+        self.joins.clear()
+        self.total = 0.0
+        return members
+
+
+class RaidDetector:
+    """Keeps track of join rates for guilds and decides when a guild is being raided."""
+    def __init__(self, *, cooldown: float = RAID_COOLDOWN):
+        self.cooldown = cooldown
+        self._windows: Dict[int, JoinWindow] = {}
+        # guild_id: monotonic time that the raid ends at
+        self._raids: Dict[int, float] = {}
+
+    def is_active(self, guild_id: int) -> bool:
+        """Whether a guild is currently considered to be raided"""
+        until = self._raids.get(guild_id)
+        if until is None:
+            return False
+
+        if time.monotonic() >= until:
+            del self._raids[guild_id]
+            return False
+
+        return True
+
+    def start(self, guild_id: int) -> None:
+        self._raids[guild_id] = time.monotonic() + self.cooldown
+
+    def end(self, guild_id: int) -> None:
+        self._raids.pop(guild_id, None)
+        self._windows.pop(guild_id, None)
+
+    def feed(self, member: discord.Member, users: int, seconds: float) -> List[discord.Member]:
+        """Feeds a join into the detector.
+
+        Parameters
+        ----------
+        member : discord.Member
+            The member that joined
+        users : int
+            The join threshold for the guild
+        seconds : float
+            The length of the window in seconds
+
+        Returns
+        -------
+        List[discord.Member]
+            The members that should be punished. This is empty if the guild is not being raided.
+        """
+        guild_id = member.guild.id
+
+        if self.is_active(guild_id):
+            # Every join extends the raid.
+            self.start(guild_id)
+            return [member]
+
+        window = self._windows.get(guild_id)
+        if window is None or window.seconds != seconds:
+            window = self._windows[guild_id] = JoinWindow(seconds)
+
+        total = window.add(member, score_member(member), now=time.monotonic())
+        if total < users:
+            return []
+
+        self.start(guild_id)
+        return window.drain()
+
+    @property
+    def active_raids(self) -> int:
+        return sum(1 for guild_id in list(self._raids) if self.is_active(guild_id))
@@ -0,0 +1,165 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+# The routes our emitters send to. Anything else is ignored.
+ROUTES = [("POST", re.compile(r"/channels/(\d+)/messages$"), "channel"),
+          ("POST", re.compile(r"/webhooks/(\d+)/[^/]+$"), "webhook")]
+
+
+def route_key(method: str, path: str) -> Optional[str]:
+    for route_method, regex, name in ROUTES:
+        if method != route_method:
+            continue
+
+        match = regex.search(path)
+        if match:
+            return f"{name}:{match.group(1)}"
+
+
+class RatelimitBucket:
+    """A token bucket that mirrors one of Discord's ratelimit buckets.
+
+    Until Discord tells us otherwise, the bucket assumes ``limit`` requests per ``per`` seconds.
+    """
+    __slots__ = ("limit", "per", "remaining", "reset_at")
+
+    def __init__(self, limit: int = 5, per: float = 5.0):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = 0.0
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """How long until a request can be made"""
+        now = now or time.monotonic()
+        self._refill(now)
+        if self.remaining > 0:
+            return 0.0
+        return self.reset_at - now
+
+    def consume(self, now: Optional[float] = None) -> None:
+        now = now or time.monotonic()
+        self._refill(now)
+        if self.reset_at == 0.0:
+            # The window starts with the first request
+            self.reset_at = now + self.per
+        self.remaining = max(0, self.remaining - 1)
+
+    def update(self, *, remaining: int, reset_after: float, limit: Optional[int] = None,
+               now: Optional[float] = None) -> None:
+        """Updates the bucket from the headers Discord sent us"""
+        now = now or time.monotonic()
+        if limit is not None:
+            self.limit = limit
+        # Responses can arrive out of order, the lowest remaining count is the safest one to trust.
+        reset_at = now + reset_after
+        if reset_at > self.reset_at + 0.05:
+            self.remaining = remaining
+        else:
+            self.remaining = min(self.remaining, remaining)
+        self.reset_at = reset_at
+
+
+class RatelimitTracker:
+    """Keeps track of Discord's ratelimits for the routes emitters send to.
+
+    The tracker is fed by an aiohttp :class:`aiohttp.TraceConfig` which reads the ratelimit headers of every
+    response, so every emitter that shares a route also shares its budget.
+
+    Parameters
+    ----------
+    default_limit : int
+        The amount of requests a bucket allows before any headers were seen
+    default_per : float
+        The length of a bucket's window before any headers were seen
+    """
+    def __init__(self, *, default_limit: int = 5, default_per: float = 5.0):
+        self.default_limit = default_limit
+        self.default_per = default_per
+        self.buckets: Dict[str, RatelimitBucket] = {}
+        self.global_reset_at = 0.0
+        self.ratelimited = 0
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_end.append(self._on_request_end)
+
+    def get_bucket(self, key: str) -> RatelimitBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = RatelimitBucket(self.default_limit, self.default_per)
+        return bucket
+
+    def delay(self, key: str) -> float:
+        now = time.monotonic()
+        return max(self.global_reset_at - now, self.get_bucket(key).delay(now), 0.0)
+
+    async def wait(self, key: str) -> None:
+        """Waits until a request can be made to a route without using up any of its budget"""
+        while (delay := self.delay(key)) > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire(self, key: str) -> None:
+        """Waits until a request can be made to a route and takes a token from its bucket"""
+        await self.wait(key)
+        self.get_bucket(key).consume()
+
+    def update_from_headers(self, key: str, status: int, headers) -> None:
+        now = time.monotonic()
+
+        if status == 429:
+            self.ratelimited += 1
+            retry_after = float(headers.get("Retry-After", 1.0))
+            if headers.get("X-RateLimit-Global"):
+                self.global_reset_at = now + retry_after
+                return
+
+            bucket = self.get_bucket(key)
+            bucket.update(remaining=0, reset_after=retry_after, now=now)
+            return
+
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is None or reset_after is None:
+            return
+
+        limit = headers.get("X-RateLimit-Limit")
+        self.get_bucket(key).update(remaining=int(remaining), reset_after=float(reset_after),
+                                    limit=int(limit) if limit is not None else None, now=now)
+
+    async def _on_request_end(self, session, ctx, params: aiohttp.TraceRequestEndParams) -> None:
+        key = route_key(params.method, params.url.path)
+        if key is None:
+            return
+
+        try:
+            self.update_from_headers(key, params.response.status, params.response.headers)
+        except ValueError:
+            log.debug(f"Unable to parse ratelimit headers for {key}")
@@ -20,16 +20,22 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 # https://github.com/Rapptz/RoboDanny/blob/245f2aa4a5caed6861b581c262dafc6835863fe2/cogs/utils/time.py
 
 
+import calendar
 import datetime
+import logging
 import re
+from typing import Iterable, List, NamedTuple, Optional, Tuple
 
 import parsedatetime as pdt
 from dateutil.relativedelta import relativedelta
 from discord.ext import commands
 from discord.utils import format_dt
+from lru import LRU
 
 from lightning.formatters import human_join, plural
 
+log = logging.getLogger(__name__)
+
 
 class ShortTime:
     compiled = re.compile("""(?:(?P<years>[0-9])(?:years?|y))?             # e.g. 2y
@@ -137,151 +143,365 @@ class UserFriendlyTime(commands.Converter):
         # Create a copy of ourselves to prevent race conditions from two
         # events modifying the same instance of a converter
         result = self.copy()
+        now = ctx.message.created_at
 
         try:
-            calendar = HumanTime.calendar
-            regex = ShortTime.compiled
-            now = ctx.message.created_at
-
-            match = regex.match(argument)
-            if match is not None and match.group(0):
-                data = {k: int(v) for k, v in match.groupdict(default=0).items()}
-                remaining = argument[match.end():].strip()
-                result.dt = now + relativedelta(**data)
-                return await result.check_constraints(ctx, now, remaining)
-
-            # apparently nlp does not like "from now"
-            # it likes "from x" in other cases though so let me handle the 'now' case
-            if argument.endswith('from now'):
-                argument = argument[:-8].strip()
-
-            if argument[0:2] == 'me':
-                # starts with "me to", "me in", or "me at "
-                if argument[0:6] in ('me to ', 'me in ', 'me at '):
-                    argument = argument[6:]
-
-            elements = calendar.nlp(argument, sourceTime=now)
-            if elements is None or len(elements) == 0:
-                raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
-
-            # handle the following cases:
-            # "date time" foo
-            # date time foo
-            # foo date time
-
-            # first the first two cases:
-            dt, status, begin, end, dt_string = elements[0]
-
-            if not status.hasDateOrTime:
-                raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
-
-            if begin not in (0, 1) and end != len(argument):
-                raise commands.BadArgument('Time is either in an inappropriate location, which '
-                                           'must be either at the end or beginning of your input, '
-                                           'or I just flat out did not understand what you meant. Sorry.')
-
-            if not status.hasTime:
-                # replace it with the current time
-                dt = dt.replace(hour=now.hour, minute=now.minute, second=now.second, microsecond=now.microsecond)
-
-            # if midnight is provided, just default to next day
-            if status.accuracy == pdt.pdtContext.ACU_HALFDAY:
-                dt = dt.replace(day=now.day + 1)
-
-            if dt.tzinfo is None:
-                dt = add_tzinfo(dt)
-
-            result.dt = dt
-
-            if begin in (0, 1):
-                if begin == 1:
-                    # check if it's quoted:
-                    if argument[0] != '"':
-                        raise commands.BadArgument('Expected quote before time input...')
-
-                    if not (end < len(argument) and argument[end] == '"'):
-                        raise commands.BadArgument('If the time is quoted, you must unquote it.')
-
-                    remaining = argument[end + 1:].lstrip(' ,.!')
-                else:
-                    remaining = argument[end:].lstrip(' ,.!')
-            elif len(argument) == end:
-                remaining = argument[:begin].strip()
-
-            return await result.check_constraints(ctx, now, remaining)
-        except:  # noqa
-            import traceback
-            traceback.print_exc()
+            result.dt, remaining = parse_user_friendly_time(argument, now)
+        except commands.BadArgument:
+            raise
+        except Exception:
+            log.exception(f"Unable to parse {argument!r} as a time")
             raise
 
+        return await result.check_constraints(ctx, now, remaining)
+
+
+class ParsedTime(NamedTuple):
+    dt: datetime.datetime
+    remaining: str
+    # Whether dt moves with the time it was parsed at, e.g. "in 2 hours" but not "tomorrow at 5pm".
+    # None if that isn't known, which keeps it out of the cache.
+    relative: Optional[bool]
+
+
+UNITS = {"s": "seconds", "sec": "seconds", "secs": "seconds", "second": "seconds", "seconds": "seconds",
+         "m": "minutes", "min": "minutes", "mins": "minutes", "minute": "minutes", "minutes": "minutes",
+         "h": "hours", "hr": "hours", "hrs": "hours", "hour": "hours", "hours": "hours",
+         "d": "days", "day": "days", "days": "days", "w": "weeks", "week": "weeks", "weeks": "weeks",
+         "mo": "months", "month": "months", "months": "months", "y": "years", "year": "years", "years": "years"}
+
+# The forms most reminders use, so they don't have to go through parsedatetime. Past offsets ("2 days ago") are left
+# to parsedatetime.
+RELATIVE_REGEX = re.compile(r"(?:in\s+)?(?P<amount>[0-9]{1,5}|an?)\s+(?P<unit>%s)\b(?:\s+from\s+now\b)?"
+                            r"(?!\s+ago\b)" % "|".join(sorted(UNITS, key=len, reverse=True)), re.IGNORECASE)
+DAY_REGEX = re.compile(r"(?P<day>today|tomorrow)(?:\s+(?:at\s+)?(?P<hour>[0-9]{1,2})(?::(?P<minute>[0-9]{2}))?"
+                       r"\s*(?P<meridiem>am|pm)?)?\b", re.IGNORECASE)
+ISO_REGEX = re.compile(r"(?P<date>[0-9]{4}-[0-9]{2}-[0-9]{2})(?:[T ](?P<hour>[0-9]{2}):(?P<minute>[0-9]{2})"
+                       r"(?::(?P<second>[0-9]{2}))?)?(?=\s|$)")
+# Inputs like "in 2 hours and 30 minutes" are left to parsedatetime
+CONTINUATION_REGEX = re.compile(r"(?:and\s+|,\s*)?[0-9]")
+
+# Parses are cached per minute. Relative results are moved to the time they're looked up at.
+_parse_cache = LRU(1024)
+
+
+def _clock(hour: str, minute: Optional[str], meridiem: Optional[str]) -> Optional[Tuple[int, int]]:
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+
+    if hour > 23 or minute > 59:
+        return None
+    return hour, minute
+
+
+def parse_fast(argument: str, now: datetime.datetime) -> Optional[ParsedTime]:
+    """Parses relative offsets, "today" or "tomorrow" with an optional time, and ISO dates.
+
+    Returns None for anything else.
+    """
+    match = RELATIVE_REGEX.match(argument)
+    if match is not None:
+        remaining = argument[match.end():]
+        if CONTINUATION_REGEX.match(remaining.lstrip()):
+            return None
+
+        amount = match.group('amount')
+        amount = 1 if amount.lower() in ("a", "an") else int(amount)
+        try:
+            dt = now + relativedelta(**{UNITS[match.group('unit').lower()]: amount})
+        except (ValueError, OverflowError):
+            raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
+        return ParsedTime(dt, remaining.lstrip(' ,.!'), True)
+
+    match = DAY_REGEX.match(argument)
+    if match is not None:
+        tomorrow = match.group('day').lower() == "tomorrow"
+        day = now + datetime.timedelta(days=1) if tomorrow else now
+        if match.group('hour') is None:
+            if not tomorrow:  # "today" on its own isn't a time
+                return None
+            return ParsedTime(day, argument[match.end():].lstrip(' ,.!'), True)
+
+        # A bare number could be the start of the reminder
+        if match.group('minute') is None and match.group('meridiem') is None:
+            return None
+
+        clock = _clock(match.group('hour'), match.group('minute'), match.group('meridiem'))
+        if clock is None:
+            return None
+
+        dt = day.replace(hour=clock[0], minute=clock[1], second=0, microsecond=0)
+        return ParsedTime(dt, argument[match.end():].lstrip(' ,.!'), False)
+
+    match = ISO_REGEX.match(argument)
+    if match is not None:
+        try:
+            date = datetime.date.fromisoformat(match.group('date'))
+        except ValueError:
+            return None
+
+        if match.group('hour') is None:
+            # Like parsedatetime, a date without a time keeps the current time
+            dt = now.replace(year=date.year, month=date.month, day=date.day)
+            relative = True
+        else:
+            clock = _clock(match.group('hour'), match.group('minute'), None)
+            if clock is None or int(match.group('second') or 0) > 59:
+                return None
+            dt = datetime.datetime(date.year, date.month, date.day, clock[0], clock[1], int(match.group('second') or 0),
+                                   tzinfo=datetime.timezone.utc)
+            relative = False
+
+        return ParsedTime(dt, argument[match.end():].lstrip(' ,.!'), relative)
+
+
+def parse_nlp(argument: str, now: datetime.datetime) -> ParsedTime:
+    """Parses a time anywhere at the start or end of the argument with parsedatetime"""
+    elements = HumanTime.calendar.nlp(argument, sourceTime=now)
+    if elements is None or len(elements) == 0:
+        raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
+
+    # handle the following cases:
+    # "date time" foo
+    # date time foo
+    # foo date time
+
+    # first the first two cases:
+    dt, status, begin, end, dt_string = elements[0]
+
+    if not status.hasDateOrTime:
+        raise commands.BadArgument('Invalid time provided, try e.g. "tomorrow" or "3 days".')
+
+    if begin not in (0, 1) and end != len(argument):
+        raise commands.BadArgument('Time is either in an inappropriate location, which '
+                                   'must be either at the end or beginning of your input, '
+                                   'or I just flat out did not understand what you meant. Sorry.')
+
+    if not status.hasTime:
+        # replace it with the current time
+        dt = dt.replace(hour=now.hour, minute=now.minute, second=now.second, microsecond=now.microsecond)
+
+    # if midnight is provided, just default to next day
+    if status.accuracy == pdt.pdtContext.ACU_HALFDAY:
+        dt = dt.replace(day=now.day + 1)
 
-def natural_timedelta(dt, *, source=None, accuracy=3, brief=False, suffix=True) -> str:
-    now = source or datetime.datetime.now(datetime.timezone.utc)
-    # We're just going to add tzinfo to both if we have to
     if dt.tzinfo is None:
         dt = add_tzinfo(dt)
 
-    if now.tzinfo is None:
-        now = add_tzinfo(now)
+    if begin in (0, 1):
+        if begin == 1:
+            # check if it's quoted:
+            if argument[0] != '"':
+                raise commands.BadArgument('Expected quote before time input...')
+
+            if not (end < len(argument) and argument[end] == '"'):
+                raise commands.BadArgument('If the time is quoted, you must unquote it.')
+
+            remaining = argument[end + 1:].lstrip(' ,.!')
+        else:
+            remaining = argument[end:].lstrip(' ,.!')
+    elif len(argument) == end:
+        remaining = argument[:begin].strip()
 
-    # Microsecond free zone
-    now = now.replace(microsecond=0)
-    dt = dt.replace(microsecond=0)
+    # parsedatetime doesn't say whether a time of day was relative ("in 2 hours") or not ("at 5pm")
+    return ParsedTime(dt, remaining, None if status.hasTime else True)
 
-    # This implementation uses relativedelta instead of the much more obvious
+
+def _strip_filler(argument: str) -> str:
+    # apparently nlp does not like "from now"
+    # it likes "from x" in other cases though so let me handle the 'now' case
+    if argument.endswith('from now'):
+        argument = argument[:-8].strip()
+
+    if argument[0:2] == 'me':
+        # starts with "me to", "me in", or "me at "
+        if argument[0:6] in ('me to ', 'me in ', 'me at '):
+            argument = argument[6:]
+
+    return argument
+
+
+def _parse(argument: str, now: datetime.datetime) -> ParsedTime:
+    match = ShortTime.compiled.match(argument)
+    if match is not None and match.group(0):
+        data = {k: int(v) for k, v in match.groupdict(default=0).items()}
+        return ParsedTime(now + relativedelta(**data), argument[match.end():].strip(), True)
+
+    argument = _strip_filler(argument)
+    return parse_fast(argument, now) or parse_nlp(argument, now)
+
+
+def parse_user_friendly_time(argument: str, now: datetime.datetime) -> Tuple[datetime.datetime, str]:
+    """Parses a time and the text around it from an argument.
+
+    Results are cached by the argument and the minute they were parsed in.
+
+    Parameters
+    ----------
+    argument : str
+        The argument to parse
+    now : datetime.datetime
+        The time to parse relative to
+
+    Returns
+    -------
+    Tuple[datetime.datetime, str]
+        The time and the rest of the argument
+
+    Raises
+    ------
+    commands.BadArgument
+        The argument doesn't have a time in it
+    """
+    argument = argument.strip()
+    # Buckets line up with minutes, so a bucket never spans two days
+    key = (argument, int(now.timestamp() // 60))
+    cached = _parse_cache.get(key)
+    if cached is None:
+        parsed = _parse(argument, now)
+        if parsed.relative is not None:
+            _parse_cache[key] = (parsed, now)
+        return parsed.dt, parsed.remaining
+
+    parsed, parsed_at = cached
+    if parsed.relative:
+        return now + (parsed.dt - parsed_at), parsed.remaining
+    return parsed.dt, parsed.remaining
+
+
+# Rendered timedeltas keyed by both timestamps and the formatting options
+_timedelta_cache = LRU(2048)
+
+TIMEDELTA_UNITS = [('year', 'y'), ('month', 'mo'), ('day', 'd'), ('hour', 'h'), ('minute', 'm'), ('second', 's')]
+DAYS_IN_MONTH = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def _days_in_month(year: int, month: int) -> int:
+    if month == 2 and calendar.isleap(year):
+        return 29
+    return DAYS_IN_MONTH[month]
+
+
+def _delta_parts(later: datetime.datetime, earlier: datetime.datetime) -> Tuple[int, int, int, int, int, int]:
+    # The same years, months, days, hours, minutes and seconds relativedelta(later, earlier) gives.
+    # Whole months are counted on the calendar first, then the rest is worked out with integers.
+    later_seconds = later.hour * 3600 + later.minute * 60 + later.second
+    earlier_seconds = earlier.hour * 3600 + earlier.minute * 60 + earlier.second
+    months = (later.year - earlier.year) * 12 + later.month - earlier.month
+
+    # The anchor is earlier moved by the whole months, clipped to the end of its month
+    anchor_day = min(earlier.day, _days_in_month(later.year, later.month))
+    days = later.day - anchor_day
+    if (later.day, later_seconds) < (anchor_day, earlier_seconds):
+        # Went too far, the anchor is in the month before later's
+        months -= 1
+        year, month = (later.year, later.month - 1) if later.month > 1 else (later.year - 1, 12)
+        previous_days = _days_in_month(year, month)
+        days = later.day + previous_days - min(earlier.day, previous_days)
+
+    minutes, seconds = divmod(days * 86400 + later_seconds - earlier_seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    years, months = divmod(months, 12)
+    return years, months, days, hours, minutes, seconds
+
+
+def _render_timedelta(dt: datetime.datetime, now: datetime.datetime, accuracy, brief: bool, suffix: bool) -> str:
+    key = (dt, now, accuracy, brief, suffix)
+    rendered = _timedelta_cache.get(key)
+    if rendered is not None:
+        return rendered
+
+    # This implementation counts months on the calendar instead of the much more obvious
     # divmod approach with seconds because the seconds approach is not entirely
     # accurate once you go over 1 week in terms of accuracy since you have to
     # hardcode a month as 30 or 31 days.
     # A query like "11 months" can be interpreted as "!1 months and 6 days"
     if dt > now:
-        delta = relativedelta(dt, now)
-        suffix = ''
+        parts = _delta_parts(dt, now)
+        ending = ''
     else:
-        delta = relativedelta(now, dt)
-        suffix = ' ago' if suffix else ''
-
-    attrs = [
-        ('year', 'y'),
-        ('month', 'mo'),
-        ('day', 'd'),
-        ('hour', 'h'),
-        ('minute', 'm'),
-        ('second', 's'),
-    ]
+        parts = _delta_parts(now, dt)
+        ending = ' ago' if suffix else ''
 
     output = []
-    for attr, brief_attr in attrs:
-        elem = getattr(delta, attr + 's')
+    for (attr, brief_attr), elem in zip(TIMEDELTA_UNITS, parts):
         if not elem:
             continue
 
         if attr == 'day':
-            weeks = delta.weeks
+            weeks, elem = divmod(elem, 7)
             if weeks:
-                elem -= weeks * 7
                 if not brief:
                     output.append(format(plural(weeks), 'week'))
                 else:
                     output.append(f'{weeks}w')
 
-        if elem <= 0:
-            continue
-
-        if brief:
-            output.append(f'{elem}{brief_attr}')
-        else:
-            output.append(format(plural(elem), attr))
+        if elem > 0:
+            if brief:
+                output.append(f'{elem}{brief_attr}')
+            else:
+                output.append(format(plural(elem), attr))
 
-    if accuracy is not None:
-        output = output[:accuracy]
+        # The smaller units would be cut off anyways
+        if accuracy is not None and len(output) >= accuracy:
+            output = output[:accuracy]
+            break
 
     if len(output) == 0:
-        return 'now'
+        rendered = 'now'
+    elif not brief:
+        rendered = human_join(output, conj='and') + ending
     else:
-        if not brief:
-            return human_join(output, conj='and') + suffix
-        else:
-            return ' '.join(output) + suffix
+        rendered = ' '.join(output) + ending
+
+    _timedelta_cache[key] = rendered
+    return rendered
+
+
+def _normalize_timestamp(dt: datetime.datetime) -> datetime.datetime:
+    # We're just going to add tzinfo if we have to. Microsecond free zone
+    if dt.tzinfo is None:
+        dt = add_tzinfo(dt)
+    elif dt.utcoffset():
+        dt = dt.astimezone(datetime.timezone.utc)
+    return dt.replace(microsecond=0)
+
+
+def natural_timedelta(dt, *, source=None, accuracy=3, brief=False, suffix=True) -> str:
+    now = _normalize_timestamp(source or datetime.datetime.now(datetime.timezone.utc))
+    return _render_timedelta(_normalize_timestamp(dt), now, accuracy, brief, suffix)
+
+
+def natural_timedeltas(dts: Iterable[datetime.datetime], *, source=None, accuracy=3, brief=False,
+                       suffix=True) -> List[str]:
+    """Formats many datetimes relative to the same time.
+
+    This is :func:`natural_timedelta` for list views, the reference time is only worked out once.
+
+    Parameters
+    ----------
+    dts : Iterable[datetime.datetime]
+        The datetimes to format
+    source : Optional[datetime.datetime]
+        The time they're relative to. Defaults to now.
+    accuracy : Optional[int]
+        How many units to show
+    brief : bool
+        Whether to use short units
+    suffix : bool
+        Whether past times end with "ago"
+
+    Returns
+    -------
+    List[str]
+        The formatted timedeltas, in the same order
+    """
+    now = _normalize_timestamp(source or datetime.datetime.now(datetime.timezone.utc))
+    return [_render_timedelta(_normalize_timestamp(dt), now, accuracy, brief, suffix) for dt in dts]
 
 
 def strip_tzinfo(dt: datetime.datetime):
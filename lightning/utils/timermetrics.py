@@ -0,0 +1,110 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import collections
+import statistics
+import time
+from typing import Deque, Dict, Optional
+
+
+class SampleWindow:
+    """Keeps the most recent samples of a measurement for percentiles.
+
+    Parameters
+    ----------
+    size : int
+        How many samples are kept
+    """
+    __slots__ = ("samples", "count", "max")
+
+    def __init__(self, size: int = 1000):
+        self.samples: Deque[float] = collections.deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> float:
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent))]
+
+    @property
+    def mean(self) -> float:
+        return statistics.mean(self.samples) if self.samples else 0.0
+
+
+class TimerMetrics:
+    """Dispatch measurements for the timer system.
+
+    Lag (fire time minus expiry) and handler duration are kept per event. Database time is kept per dispatch.
+
+    Parameters
+    ----------
+    lag_threshold : float
+        How many seconds late a timer can fire before it's worth an alert
+    alert_cooldown : float
+        How many seconds to wait between alerts
+    """
+    def __init__(self, *, lag_threshold: float = 30.0, alert_cooldown: float = 300.0):
+        self.lag_threshold = lag_threshold
+        self.alert_cooldown = alert_cooldown
+        self.lag: Dict[str, SampleWindow] = collections.defaultdict(SampleWindow)
+        self.handlers: Dict[str, SampleWindow] = collections.defaultdict(SampleWindow)
+        self.handler_errors: collections.Counter = collections.Counter()
+        self.database = SampleWindow()
+        # Timers completed by the startup catch-up are late on purpose, so their lag isn't recorded
+        self.caught_up = 0
+        self.late = 0
+        self._last_alert: Optional[float] = None
+
+    def record_lag(self, event: str, lag: float) -> bool:
+        """Records how late a timer fired.
+
+        Returns
+        -------
+        bool
+            Whether an alert should be sent for it
+        """
+        self.lag[event].add(lag)
+        if lag < self.lag_threshold:
+            return False
+
+        self.late += 1
+        now = time.monotonic()
+        if self._last_alert is not None and now - self._last_alert < self.alert_cooldown:
+            return False
+
+        self._last_alert = now
+        return True
+
+    def record_handler(self, event: str, duration: float, *, failed: bool = False) -> None:
+        self.handlers[event].add(duration)
+        if failed:
+            self.handler_errors[event] += 1
+
+    def record_database(self, duration: float) -> None:
+        self.database.add(duration)
+
+    @property
+    def events(self):
+        return sorted(set(self.lag) | set(self.handlers))
@@ -0,0 +1,95 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import math
+from typing import Any, Callable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """A hashed timing wheel that fires scheduled items with a single task.
+
+    Items are hashed into ``slots`` buckets by the tick they're due on. Every tick, the task fires the items in the
+    current bucket that are due. Items further away than one turn of the wheel wait in their bucket until their turn
+    comes around. The task only runs while something is scheduled.
+
+    Parameters
+    ----------
+    callback : Callable[[List[Any]], Any]
+        Called with the items that are due on a tick
+    resolution : float
+        How many seconds a tick is
+    slots : int
+        How many buckets the wheel has
+    """
+    def __init__(self, callback: Callable[[List[Any]], Any], *, resolution: float = 1.0, slots: int = 64):
+        self.callback = callback
+        self.resolution = resolution
+        self._slots: List[List[Tuple[int, Any]]] = [[] for _ in range(slots)]
+        self._tick = 0
+        self._started_at = 0.0
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _now_tick(self) -> float:
+        return (asyncio.get_event_loop().time() - self._started_at) / self.resolution
+
+    def schedule(self, item: Any, delay: float) -> None:
+        """Schedules an item to fire after ``delay`` seconds, rounded up to the next tick"""
+        if self._task is None or self._task.done():
+            self._started_at = asyncio.get_event_loop().time()
+            self._tick = 0
+            self._task = asyncio.create_task(self._run())
+
+        target = max(self._tick + 1, math.ceil(self._now_tick() + max(delay, 0) / self.resolution))
+        self._slots[target % len(self._slots)].append((target, item))
+        self._count += 1
+
+    def _advance(self) -> List[Any]:
+        self._tick += 1
+        slot = self._slots[self._tick % len(self._slots)]
+        due = [item for target, item in slot if target <= self._tick]
+        if due:
+            slot[:] = [(target, item) for target, item in slot if target > self._tick]
+            self._count -= len(due)
+        return due
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self._count:
+            next_at = self._started_at + (self._tick + 1) * self.resolution
+            await asyncio.sleep(max(0, next_at - loop.time()))
+
+            # Catch up on every tick that passed while we were asleep
+            due = []
+            while self._tick < int(self._now_tick()):
+                due.extend(self._advance())
+
+            if due:
+                try:
+                    self.callback(due)
+                except Exception as e:
+                    log.exception("An exception occurred while firing timers", exc_info=e)
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
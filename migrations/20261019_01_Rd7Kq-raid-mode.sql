@@ -0,0 +1,4 @@
+-- Raid mode punishments
+-- depends: 20211013_01_343eu-3-3-0
+
+ALTER TABLE guild_mod_config ADD COLUMN automod_raid_punishment INT;
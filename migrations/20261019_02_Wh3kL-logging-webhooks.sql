@@ -0,0 +1,10 @@
+-- Webhooks used for logging
+-- depends: 20261019_01_Rd7Kq-raid-mode
+
+CREATE TABLE IF NOT EXISTS logging_webhooks
+(
+    channel_id BIGINT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    webhook_id BIGINT NOT NULL,
+    webhook_token TEXT NOT NULL
+);
@@ -0,0 +1,12 @@
+-- Outbox for emitter entries
+-- depends: 20261019_02_Wh3kL-logging-webhooks
+
+CREATE TABLE IF NOT EXISTS emitter_outbox
+(
+    id UUID PRIMARY KEY,
+    destination TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS emitter_outbox_created_at_idx ON emitter_outbox (created_at);
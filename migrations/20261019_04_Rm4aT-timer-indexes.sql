@@ -0,0 +1,8 @@
+-- Indexes for timer lookups
+-- depends: 20261019_03_Ob7xQ-emitter-outbox
+
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS author_id BIGINT GENERATED ALWAYS AS ((extra ->> 'author')::bigint) STORED;
+
+CREATE INDEX IF NOT EXISTS timers_reminder_author_id_idx ON timers (author_id, expiry) WHERE event = 'reminder';
+CREATE INDEX IF NOT EXISTS timers_event_expiry_idx ON timers (event, expiry);
+CREATE INDEX IF NOT EXISTS timers_expiry_idx ON timers (expiry);
@@ -0,0 +1,7 @@
+-- Lease timers to the process that fires them
+-- depends: 20261019_04_Rm4aT-timer-indexes
+
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS claimed_by TEXT;
+ALTER TABLE timers ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS timers_claimed_by_idx ON timers (claimed_by) WHERE claimed_by IS NOT NULL;
@@ -0,0 +1,12 @@
+-- Track which process owns each outbox entry
+-- depends: 20261019_05_Tl9sN-timer-leases
+
+ALTER TABLE emitter_outbox ADD COLUMN IF NOT EXISTS owner TEXT;
+
+CREATE INDEX IF NOT EXISTS emitter_outbox_owner_idx ON emitter_outbox (owner);
+
+CREATE TABLE IF NOT EXISTS emitter_outbox_owners
+(
+    owner TEXT PRIMARY KEY,
+    seen_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
@@ -0,0 +1,104 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+
+import discord
+
+from lightning.utils import emitters
+from lightning.utils.emitters import TextChannelEmitter, coalesce_messages
+from lightning.utils.ratelimits import RatelimitTracker
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "error"
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.recorded = 0
+        self.acked = []
+
+    def record(self, destination, payload):
+        self.recorded += 1
+        return self.recorded
+
+    def ack(self, entry_ids):
+        self.acked.extend(entry_ids)
+
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(kwargs)
+
+
+async def run_emitter(channel, *contents):
+    outbox = FakeOutbox()
+    emitter = TextChannelEmitter(channel, outbox=outbox, ratelimits=RatelimitTracker(default_limit=100))
+    emitter.start()
+    for content in contents:
+        await emitter.put(content)
+
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if len(outbox.acked) == len(contents) or emitter.done():
+            break
+
+    emitter.close()
+    return emitter, outbox
+
+
+def test_coalesce_messages_joins_plain_content():
+    assert coalesce_messages([{"content": "a"}, {"content": "b"}]) == [{"content": "a\nb"}]
+
+
+def test_transient_failures_are_retried(monkeypatch):
+    monkeypatch.setattr(emitters, "RETRY_DELAY", 0.01)
+    channel = FakeChannel([discord.HTTPException(FakeResponse(503), "unavailable"), asyncio.TimeoutError()])
+
+    _, outbox = asyncio.run(run_emitter(channel, "a", "b"))
+
+    assert channel.sent == [{"content": "a\nb"}]
+    assert outbox.acked == [1, 2]
+
+
+def test_permanent_failures_are_dropped(monkeypatch):
+    monkeypatch.setattr(emitters, "RETRY_DELAY", 0.01)
+    channel = FakeChannel([discord.Forbidden(FakeResponse(403), "missing access")])
+
+    _, outbox = asyncio.run(run_emitter(channel, "a"))
+
+    assert channel.sent == []
+    assert outbox.acked == [1]
+
+
+def test_deleted_channel_closes_the_emitter():
+    channel = FakeChannel([discord.NotFound(FakeResponse(404), "unknown channel")])
+
+    emitter, outbox = asyncio.run(run_emitter(channel, "a"))
+
+    assert emitter.done()
+    assert outbox.acked == [1]
@@ -0,0 +1,64 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime
+
+import pytest
+
+from lightning.utils.emitters import MAX_CONTENT_LENGTH
+from lightning.utils.modlogformats import (MAX_EMBED_DESCRIPTION_LENGTH,
+                                           EmbedFormat, EmojiFormat,
+                                           MinimalisticFormat, join_summary)
+
+
+class FakeUser:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __str__(self):
+        return f"{self.name}#0001"
+
+
+def long_entries(count):
+    created = datetime(2022, 1, 1)
+    return [(FakeUser(900000000000000000 + i, "x" * 32), FakeUser(800000000000000000 + i, "y" * 32), created)
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("with_timestamp", [True, False])
+def test_minimal_expired_summary_fits_in_a_message(with_timestamp):
+    text = MinimalisticFormat.timed_actions_expired("unban", long_entries(20), datetime(2022, 1, 2),
+                                                    with_timestamp=with_timestamp)
+    assert len(text) <= MAX_CONTENT_LENGTH
+    assert text.endswith("more")
+
+
+def test_emoji_expired_summary_fits_in_a_message():
+    text = EmojiFormat.timed_actions_expired("unmute", long_entries(20))
+    assert len(text) <= MAX_CONTENT_LENGTH
+    assert text.endswith("more")
+
+
+def test_embed_expired_summary_fits_in_a_description():
+    embed = EmbedFormat.timed_actions_expired("unban", long_entries(200), datetime(2022, 1, 2))
+    assert len(embed.description) <= MAX_EMBED_DESCRIPTION_LENGTH
+
+
+def test_join_summary_counts_left_out_lines():
+    lines = ["a" * 10] * 5
+    assert join_summary("header", lines, limit=1000) == "\n".join(["header"] + lines)
+    assert join_summary("header", lines, limit=40) == "header\naaaaaaaaaa\n...and 4 more"
@@ -0,0 +1,115 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from lightning import bot as lightning_bot
+from lightning.bot import LightningBot
+
+ERROR_KEY = "webhook:1"
+
+
+class FakeOutbox:
+    """Keeps entries in memory and pages through them like Outbox.pending does"""
+    def __init__(self, destinations):
+        start = datetime(2022, 1, 1)
+        self.entries = [{"id": uuid.UUID(int=i + 1), "destination": destination, "payload": {"content": str(i)},
+                         "created_at": start + timedelta(seconds=i)} for i, destination in enumerate(destinations)]
+        self.pages = []
+        self.claims = []
+        self.acked = []
+        # IDs another process claims first
+        self.taken = set()
+
+    async def pending(self, *, include_own=False, after=None, limit=500):
+        after = after or (datetime.min, uuid.UUID(int=0))
+        entries = [entry for entry in self.entries if (entry['created_at'], entry['id']) > after]
+        self.pages.append(after)
+        return [dict(entry) for entry in entries[:limit]]
+
+    async def claim(self, entry_ids, *, include_own=False):
+        self.claims.append(list(entry_ids))
+        return [entry_id for entry_id in entry_ids if entry_id not in self.taken]
+
+    def ack(self, entry_ids):
+        self.acked.extend(entry_ids)
+
+
+class FakeErrorLogger:
+    outbox_key = ERROR_KEY
+
+    def __init__(self):
+        self.replayed = []
+
+    async def replay(self, entry_id, payload):
+        self.replayed.append(entry_id)
+
+
+class FakeModLog:
+    def __init__(self, exists):
+        self.exists = exists
+        self.checked = []
+        self.replayed = []
+
+    async def destination_exists(self, destination):
+        self.checked.append(destination)
+        return self.exists[destination]
+
+    async def replay_entry(self, destination, entry_id, payload):
+        self.replayed.append(entry_id)
+        return True
+
+
+def make_bot(outbox, modlog):
+    bot = LightningBot.__new__(LightningBot)
+    bot.outbox = outbox
+    bot._error_logger = FakeErrorLogger()
+    bot.get_cog = lambda name: modlog
+    return bot
+
+
+def test_replay_pages_through_the_backlog(monkeypatch):
+    monkeypatch.setattr(lightning_bot, "OUTBOX_PAGE_SIZE", 2)
+    outbox = FakeOutbox(["channel:1"] * 5)
+    modlog = FakeModLog({"channel:1": True})
+    bot = make_bot(outbox, modlog)
+
+    asyncio.run(bot.replay_outbox(include_own=True))
+
+    assert modlog.replayed == [entry['id'] for entry in outbox.entries]
+    assert [len(ids) for ids in outbox.claims] == [2, 2, 1]
+    assert len(outbox.pages) == 3
+    # Destinations are only looked up once for the whole backlog
+    assert modlog.checked == ["channel:1"]
+
+
+def test_replay_routes_entries_by_destination(monkeypatch):
+    monkeypatch.setattr(lightning_bot, "OUTBOX_PAGE_SIZE", 2)
+    outbox = FakeOutbox(["channel:1", "channel:2", "channel:3", ERROR_KEY, "channel:1"])
+    modlog = FakeModLog({"channel:1": True, "channel:2": None, "channel:3": False})
+    bot = make_bot(outbox, modlog)
+    ids = [entry['id'] for entry in outbox.entries]
+    outbox.taken.add(ids[4])
+
+    asyncio.run(bot.replay_outbox())
+
+    assert modlog.replayed == [ids[0]]
+    assert bot._error_logger.replayed == [ids[3]]
+    # Unknown channels are left for another process, gone channels are discarded
+    assert all(ids[1] not in claim for claim in outbox.claims)
+    assert outbox.acked == [ids[2]]
@@ -0,0 +1,245 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from datetime import datetime
+
+import discord
+import pytest
+
+from lightning.models import Timer
+from lightning.utils.punishments import ExpirationQueue
+
+GUILD_ID = 1
+MUTE_ROLE_ID = 5
+
+
+class FakeResponse:
+    status = 404
+    reason = "Not Found"
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self):
+        self.deactivated = []
+        self.fail_writes = False
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetch(self, query, guild_ids, user_ids, expiries, actions):
+        if self.fail_writes:
+            raise ConnectionError("database went away")
+        self.deactivated.extend(zip(user_ids, actions))
+        return []
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def acquire(self):
+        connection = self.connection
+
+        class Acquire:
+            async def __aenter__(self):
+                return connection
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+class FakeMod:
+    def __init__(self, roles):
+        # (guild_id, user_id): [role_id, ...]
+        self.roles = roles
+
+    async def held_punishment_roles(self, entries, *, connection=None):
+        return {entry for entry in entries if entry[2] in self.roles.get(entry[:2], [])}
+
+    async def remove_punishment_roles(self, entries, *, connection=None):
+        if connection.fail_writes:
+            raise ConnectionError("database went away")
+        for guild_id, user_id, role_id in entries:
+            self.roles[(guild_id, user_id)].remove(role_id)
+
+
+class FakeMember:
+    def __init__(self, guild, id):
+        self.guild = guild
+        self.id = id
+
+    def __str__(self):
+        return f"member{self.id}#0001"
+
+    async def remove_roles(self, role, *, reason=None):
+        if self.id in self.guild.failing:
+            raise discord.HTTPException(FakeResponse(), "failed")
+        self.guild.unmuted.append(self.id)
+
+
+class FakeGuild:
+    id = GUILD_ID
+
+    def __init__(self):
+        self.bans = set()
+        self.unmuted = []
+        self.failing = set()
+
+    def get_member(self, id):
+        return FakeMember(self, id)
+
+    def get_role(self, id):
+        return discord.Object(id=id)
+
+    async def unban(self, user, *, reason=None):
+        if user.id in self.failing:
+            raise discord.HTTPException(FakeResponse(), "failed")
+        if user.id not in self.bans:
+            raise discord.NotFound(FakeResponse(), "Unknown Ban")
+        self.bans.remove(user.id)
+
+
+class FakeBot:
+    def __init__(self, loop, roles=None):
+        self.loop = loop
+        self.connection = FakeConnection()
+        self.pool = FakePool(self.connection)
+        self.mod = FakeMod(roles or {})
+        self.guild = FakeGuild()
+        self.events = []
+
+    def get_cog(self, name):
+        return self.mod
+
+    def get_guild(self, guild_id):
+        return self.guild
+
+    def get_user(self, user_id):
+        return None
+
+    def dispatch(self, event, *args):
+        self.events.append((event, *args))
+
+
+def make_timer(id, event, user_id):
+    now = datetime(2022, 1, 1)
+    extra = {"guild_id": GUILD_ID, "user_id": user_id, "mod_id": 2}
+    if event == "timemute":
+        extra['role_id'] = MUTE_ROLE_ID
+    return Timer(id, event, now, now, extra)
+
+
+def run(coro_func):
+    async def runner():
+        return await coro_func(asyncio.get_running_loop())
+    return asyncio.run(runner())
+
+
+def test_failed_role_removal_keeps_the_punishment_role_for_a_retry():
+    async def scenario(loop):
+        bot = FakeBot(loop, roles={(GUILD_ID, 10): [MUTE_ROLE_ID]})
+        queue = ExpirationQueue(bot, linger=0, interval=0)
+        timer = make_timer(1, "timemute", 10)
+
+        bot.guild.failing.add(10)
+        with pytest.raises(discord.HTTPException):
+            await queue.put(timer)
+
+        assert bot.mod.roles[(GUILD_ID, 10)] == [MUTE_ROLE_ID]
+        assert bot.connection.deactivated == []
+
+        bot.guild.failing.clear()
+        assert await queue.put(timer) is None
+        assert bot.guild.unmuted == [10]
+        assert bot.mod.roles[(GUILD_ID, 10)] == []
+        assert bot.connection.deactivated == [(10, 8)]
+
+    run(scenario)
+
+
+def test_only_successful_expirations_update_the_database():
+    async def scenario(loop):
+        bot = FakeBot(loop)
+        bot.guild.bans.update({20, 21})
+        bot.guild.failing.add(21)
+        queue = ExpirationQueue(bot, linger=0, interval=0)
+
+        results = await asyncio.gather(queue.put(make_timer(1, "timeban", 20)),
+                                       queue.put(make_timer(2, "timeban", 21)), return_exceptions=True)
+
+        assert results[0] is None
+        assert isinstance(results[1], discord.HTTPException)
+        assert bot.connection.deactivated == [(20, 4)]
+        assert bot.guild.bans == {21}
+
+    run(scenario)
+
+
+def test_failed_database_update_is_retried_after_the_unban():
+    async def scenario(loop):
+        bot = FakeBot(loop)
+        bot.guild.bans.add(20)
+        queue = ExpirationQueue(bot, linger=0, interval=0)
+        timer = make_timer(1, "timeban", 20)
+
+        bot.connection.fail_writes = True
+        with pytest.raises(ConnectionError):
+            await queue.put(timer)
+        assert bot.guild.bans == set()
+
+        # The member is already unbanned, so the retry only has to finish the database update
+        bot.connection.fail_writes = False
+        assert await queue.put(timer) is None
+        assert bot.connection.deactivated == [(20, 4)]
+
+    run(scenario)
+
+
+def test_manually_removed_mute_is_skipped():
+    async def scenario(loop):
+        bot = FakeBot(loop, roles={(GUILD_ID, 10): []})
+        queue = ExpirationQueue(bot, linger=0, interval=0)
+
+        assert await queue.put(make_timer(1, "timemute", 10)) is None
+        assert bot.guild.unmuted == []
+        assert bot.connection.deactivated == []
+        assert bot.events == []
+
+    run(scenario)
+
+
+def test_close_cancels_waiting_expirations():
+    async def scenario(loop):
+        bot = FakeBot(loop)
+        queue = ExpirationQueue(bot, linger=60)
+        future = queue.put(make_timer(1, "timeban", 20))
+
+        queue.close()
+        with pytest.raises(asyncio.CancelledError):
+            await future
+
+    run(scenario)
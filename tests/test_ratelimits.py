@@ -0,0 +1,35 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from lightning.utils.ratelimits import RatelimitBucket
+
+
+def test_ratelimit_bucket_waits_for_its_window():
+    bucket = RatelimitBucket(limit=2, per=5.0)
+    bucket.consume(now=100.0)
+    bucket.consume(now=100.5)
+
+    assert bucket.delay(now=101.0) == 4.0
+    assert bucket.delay(now=105.0) == 0.0
+
+
+def test_ratelimit_bucket_trusts_the_lowest_remaining_count():
+    bucket = RatelimitBucket(limit=5, per=5.0)
+    bucket.update(remaining=1, reset_after=2.0, now=100.0)
+    # A response that was sent earlier arrives late with a higher count for the same window
+    bucket.update(remaining=3, reset_after=2.0, now=100.0)
+
+    assert bucket.remaining == 1
@@ -0,0 +1,121 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+from datetime import datetime
+
+from lightning.cogs import reminders
+from lightning.cogs.reminders import Reminders
+from lightning.models import Timer
+from lightning.utils.timermetrics import TimerMetrics
+
+NOW = datetime(2022, 1, 1)
+
+
+class FakePool:
+    def __init__(self):
+        self.executed = []
+        # Called while an insert is being awaited
+        self.during_insert = None
+
+    async def execute(self, query, *args):
+        self.executed.append((query.split()[0], args))
+
+    async def fetch(self, query, *args):
+        if "generate_series" in query:
+            return [(100 + i,) for i in range(args[0])]
+
+        if self.during_insert is not None:
+            self.during_insert()
+        return [{"id": entry['id']} for entry in args[0]]
+
+
+class FakeBot:
+    def __init__(self, listeners=()):
+        self.pool = FakePool()
+        self.extra_events = {"on_lightning_test_complete": list(listeners)}
+        self.errors = []
+
+    async def on_error(self, event, *args):
+        self.errors.append(event)
+
+
+def make_cog(bot):
+    # The cog starts its dispatch tasks on init, which these tests drive by hand
+    cog = Reminders.__new__(Reminders)
+    cog.bot = bot
+    cog.lease_owner = "test"
+    cog.metrics = TimerMetrics()
+    cog._heap = []
+    cog._timers = {}
+    cog._fired = set()
+    cog._horizon = datetime.max
+    cog._wakeup = asyncio.Event()
+    cog._journal = {}
+    cog._journaling = set()
+    cog._fired_while_journaling = set()
+    cog._journal_deletes = []
+    cog._wheel_ids = set()
+    return cog
+
+
+def test_only_succeeded_timers_are_deleted():
+    async def listener(timer):
+        if timer.id == 2:
+            raise RuntimeError("listener failed")
+
+    async def scenario():
+        bot = FakeBot([listener])
+        cog = make_cog(bot)
+        timers = [Timer(i, "test", NOW, NOW, {}) for i in (1, 2, 3)]
+        cog._fired.update(timer.id for timer in timers)
+
+        await cog._complete_timers(timers)
+        return bot, cog
+
+    bot, cog = asyncio.run(scenario())
+    assert bot.pool.executed == [("DELETE", ([1, 3], "test")), ("UPDATE", ([2], "test"))]
+    assert bot.errors == ["lightning_test_complete"]
+    assert cog._fired == set()
+
+
+def test_journaled_timer_fires_once(monkeypatch):
+    monkeypatch.setattr(reminders, "JOURNAL_INTERVAL", 0)
+
+    async def scenario():
+        bot = FakeBot()
+        cog = make_cog(bot)
+        fired = []
+        cog._dispatch_timers = lambda timers, **kwargs: fired.extend(timer.id for timer in timers)
+        cog._ensure_journal_task = lambda: None
+
+        timer = Timer(None, "test", NOW, NOW, {})
+        cog._journal[timer] = None
+        # A refill loads the row before the insert returns
+        bot.pool.during_insert = lambda: cog._push_timer(Timer(100, "test", NOW, NOW, {}))
+        await cog._flush_journal()
+
+        cog._fire_short_timers([timer])
+        # A refill between the wheel firing and the row being deleted
+        cog._push_timer(Timer(100, "test", NOW, NOW, {}))
+        await cog._flush_journal()
+        return bot, cog, fired
+
+    bot, cog, fired = asyncio.run(scenario())
+    assert fired == [100]
+    assert cog._pop_due_timers(datetime.max) == []
+    assert bot.pool.executed == [("DELETE", ([100],))]
+    assert cog._fired == set()
@@ -0,0 +1,44 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime
+
+import pytest
+from discord.ext import commands
+
+from lightning.utils.time import parse_fast
+
+NOW = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.parametrize("argument, expected, remaining", [
+    ("in 5 days water plants", NOW + datetime.timedelta(days=5), "water plants"),
+    ("an hour from now stretch", NOW + datetime.timedelta(hours=1), "stretch"),
+    ("tomorrow at 5pm call", datetime.datetime(2022, 1, 2, 17, 0, tzinfo=datetime.timezone.utc), "call"),
+])
+def test_parse_fast(argument, expected, remaining):
+    result = parse_fast(argument, NOW)
+    assert result.dt == expected
+    assert result.remaining == remaining
+
+
+def test_parse_fast_rejects_out_of_range_years():
+    with pytest.raises(commands.BadArgument):
+        parse_fast("in 99999 years x", NOW)
+
+
+def test_parse_fast_leaves_past_offsets_to_parsedatetime():
+    assert parse_fast("2 days ago x", NOW) is None
@@ -0,0 +1,37 @@
+"""
+Lightning.py - A Discord bot
+Copyright (C) 2019-2022 LightSage
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation at version 3 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import asyncio
+
+from lightning.utils.timingwheel import TimingWheel
+
+
+def test_timing_wheel_fires_in_order_across_turns():
+    async def scenario():
+        fired = []
+        wheel = TimingWheel(fired.append, resolution=0.01, slots=4)
+        # 0.09s is more than two turns of a four slot wheel
+        wheel.schedule("late", 0.09)
+        wheel.schedule("early", 0.01)
+        wheel.schedule("middle", 0.05)
+
+        await asyncio.sleep(0.2)
+        wheel.close()
+        return fired, len(wheel)
+
+    fired, remaining = asyncio.run(scenario())
+    assert [item for batch in fired for item in batch] == ["early", "middle", "late"]
+    assert remaining == 0